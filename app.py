@@ -1,53 +1,97 @@
-import json
+import mimetypes
 import os
 
 import streamlit as st
-from unidecode import unidecode
-
-from iperocks_croqui_ui.export_pdf import export_to_pdf
-
+from streamlit import runtime
+
+from iperocks_croqui_ui.export_jobs import ExportJobManager
+from iperocks_croqui_ui.page_pack import INDEX_FILE, PagePack, pack_folder
+from iperocks_croqui_ui.renditions import (
+    RENDITION_FOLDER,
+    pick_packed_rendition,
+    rendition_name,
+)
+from iperocks_croqui_ui.route_catalog import PAGE_SIZE, RouteCatalog
+
+DATA_FILE = "output/routes_store.json"
+CATALOG_FILE = "output/routes.sqlite"
+# Each guidebook's page images live in a folder named after it
+OUTPUT_ROOT = "output"
+
+
+# One catalog per process, shared by all sessions; every query sees the
+# latest data written by collect_json
+@st.cache_resource
+def get_catalog(catalog_file, store_file):
+    return RouteCatalog(catalog_file, store_file)
+
+
+# Background PDF exports, memoized per filters and data version
+@st.cache_resource
+def get_export_manager(output_directory):
+    return ExportJobManager(output_directory)
+
+
+# Progress of a running export, polled on its own so the rest of the page
+# stays usable; the whole app reruns once it is finished to offer the PDF
+@st.fragment(run_every=0.5)
+def show_export_progress(export_job):
+    if export_job.finished:
+        st.rerun()
+    st.progress(export_job.progress, "Exporting...")
+
+
+# Memory-mapped image pack of a guidebook folder, shared by all sessions.
+# Folders converted before packs existed are packed on first use
+@st.cache_resource
+def get_page_pack(image_folder):
+    if os.path.isdir(image_folder) and not os.path.exists(
+        os.path.join(image_folder, INDEX_FILE)
+    ):
+        pack_folder(image_folder)
+    return PagePack(image_folder)
+
+
+# Smallest packed page rendition that fits, else the page PNG, as (name,
+# bytes); None when the page image is not available. Renditions are only
+# written at ingest
+def load_page_image(image_folder, page_number, max_width):
+    pack = get_page_pack(image_folder)
+    pack.refresh()
+    name = pick_packed_rendition(pack, page_number, max_width)
+    return (name, pack.get(name)) if name is not None else None
+
+
+# Packed thumbnail of a page as (name, bytes), None when it has none
+def load_page_thumbnail(image_folder, page_number):
+    pack = get_page_pack(image_folder)
+    name = f"{RENDITION_FOLDER}/{rendition_name(page_number)}"
+    return (name, pack.get(name)) if name in pack else None
+
+
+# URL of a packed image on Streamlit's media server, which keeps its own copy
+# of the bytes. Unlike st.image, the WebP renditions are served as they are,
+# and the URL only depends on the bytes: a page prefetched while a
+# neighbouring route is shown comes from the browser's cache once shown
+def page_image_url(image, coordinates):
+    name, data = image
+    url = runtime.get_instance().media_file_mgr.add(
+        bytes(data), mimetypes.guess_type(name)[0], coordinates
+    )
+    # Relative to the page, so it also resolves under a base URL path
+    return url.lstrip("/")
 
-# Load JSON data
-def load_data(json_file):
-    with open(json_file, "r", encoding="utf-8") as file:
-        data = json.load(file)
-    return data
 
+# Filter routes based on normalized selections, one page of results at a time
+def get_filtered_routes(
+    catalog, grade, block, sector, query=None, source=None, limit=None, offset=0
+):
+    return catalog.filter(grade, block, sector, query, source, limit, offset)
 
-# Normalize names by converting to lowercase and removing accents
-def normalize_name(name):
-    return unidecode(name).strip().lower() if name else ""
 
-
-# Load and filter routes based on normalized selections
-def get_filtered_routes(data, grade, block, sector):
-    filtered_routes = []
-    by_grade = data.get("by_grade", {})
-
-    # Normalize grade
-    if grade:
-        filtered_routes.extend(by_grade.get(grade, []))
-    else:
-        for routes in by_grade.values():
-            filtered_routes.extend(routes)
-
-    # Normalize block and sector
-    if block:
-        block = normalize_name(block)
-        filtered_routes = [
-            route
-            for route in filtered_routes
-            if normalize_name(route.get("block")) == block
-        ]
-    if sector:
-        sector = normalize_name(sector)
-        filtered_routes = [
-            route
-            for route in filtered_routes
-            if normalize_name(route.get("sector")) == sector
-        ]
-
-    return filtered_routes
+# Folder holding the page images of the guidebook a route comes from
+def route_image_folder(route):
+    return os.path.join(OUTPUT_ROOT, route.get("source") or "")
 
 
 # Streamlit App
@@ -56,67 +100,71 @@ def get_filtered_routes(data, grade, block, sector):
 st.set_page_config(layout="wide")
 
 # Load data
-data = load_data("output/consolidated_routes.json")
-image_folder = "output/Croqui_Iperocks_v4-3"  # Replace with your image folder path
-
-# Extract unique values for filters, normalize them for uniformity
-sectors = sorted(
-    set(
-        normalize_name(route["sector"])
-        for grade_routes in data["by_grade"].values()
-        for route in grade_routes
-    )
-)
+catalog = get_catalog(CATALOG_FILE, DATA_FILE)
+# Built again from the JSON store when that is newer, e.g. after a pull
+catalog.refresh()
+
+# Unique values for filters, normalized for uniformity
+sectors = catalog.sectors()
 
 st.sidebar.divider()
 st.sidebar.caption("Filters")
 
 with st.sidebar:
+    # Free-text search over names, descriptions, blocks and sectors
+    search_query = st.text_input("Search", placeholder="e.g. reglete, SDS, travessia")
+
+    # Only offered when routes from several guidebooks were collected
+    guidebooks = catalog.sources()
+    selected_source = None
+    if len(guidebooks) > 1:
+        selected_guidebook = st.selectbox("Select Guidebook", ["All"] + guidebooks)
+        if selected_guidebook != "All":
+            selected_source = selected_guidebook
+
     # Sidebar filters
     selected_sector = st.selectbox("Select Sector", ["All"] + sectors)
 
     # Filter blocks based on selected sector
-    if selected_sector != "All":
-        filtered_blocks = sorted(
-            set(
-                normalize_name(route["block"])
-                for grade_routes in data["by_grade"].values()
-                for route in grade_routes
-                if normalize_name(route["sector"]) == selected_sector
-            )
-        )
-    else:
-        filtered_blocks = sorted(
-            set(
-                normalize_name(route["block"])
-                for grade_routes in data["by_grade"].values()
-                for route in grade_routes
-            )
-        )
+    filtered_blocks = catalog.blocks(
+        selected_sector if selected_sector != "All" else None
+    )
 
     selected_block = st.selectbox("Select Block", ["All"] + filtered_blocks)
 
-    # Filter grades based on selected block
-    if selected_block != "All":
-        filtered_grades = sorted(
-            set(
-                route["grade"]
-                for grade_routes in data["by_grade"].values()
-                for route in grade_routes
-                if normalize_name(route["block"]) == selected_block
-            )
-        )
-    else:
-        filtered_grades = sorted(data["by_grade"].keys())
+    # Filter grades based on selected sector and block
+    filtered_grades = catalog.grades(
+        selected_sector if selected_sector != "All" else None,
+        selected_block if selected_block != "All" else None,
+    )
 
     selected_grade = st.selectbox("Select Grade", ["All"] + filtered_grades)
 
+    # Image width: smaller renditions load faster on mobile connections
+    image_sizes = {"Small": 480, "Medium": 960, "Full": None}
+    image_size = st.select_slider("Image size", list(image_sizes), value="Medium")
+
     # Filter routes based on normalized selections
-    filtered_routes = get_filtered_routes(
-        data,
+    filters = (
         selected_grade if selected_grade != "All" else None,
         selected_block if selected_block != "All" else None,
         selected_sector if selected_sector != "All" else None,
+        search_query,
+        selected_source,
+    )
+    total_routes = catalog.count(*filters)
+
+    # Large result sets are listed a page at a time
+    result_page = 1
+    if total_routes > PAGE_SIZE:
+        result_page = st.number_input(
+            "Results page",
+            min_value=1,
+            max_value=(total_routes - 1) // PAGE_SIZE + 1,
+            value=1,
+        )
+    filtered_routes = get_filtered_routes(
+        catalog, *filters, limit=PAGE_SIZE, offset=(result_page - 1) * PAGE_SIZE
     )
 
     if not filtered_routes:
@@ -129,7 +177,7 @@ with st.sidebar:
         route_page_numbers = [route["page_number"] for route in filtered_routes]
 
         st.divider()
-        st.caption(f"Filtered results ({len(filtered_routes)} routes found)")
+        st.caption(f"Filtered results ({total_routes} routes found)")
 
         # Initialize session state for current route index
         if "current_route_index" not in st.session_state:
@@ -167,29 +215,70 @@ with st.sidebar:
 
         st.divider()
         st.caption("Export as PDF")
+        unique_pages = st.checkbox(
+            "One page per image", help="Embed shared pages once and list their routes"
+        )
         exp1, exp2 = st.columns([1, 1])
         with exp1:
             export_pdf = st.button("Export PDF", use_container_width=True)
 
+        if export_pdf:
+            # The export covers every page of results
+            job = get_export_manager("output/exports").submit(
+                get_filtered_routes(catalog, *filters),
+                OUTPUT_ROOT,
+                catalog.data_version,
+                selected_sector,
+                selected_block,
+                selected_grade,
+                unique_pages=unique_pages,
+            )
+            st.session_state.export_job_path = job.path
+
+        # Show the progress of this session's export, it runs in the background
+        export_job = None
+        if "export_job_path" in st.session_state:
+            export_job = get_export_manager("output/exports").get(
+                st.session_state.export_job_path
+            )
+
         with exp2:
-            if export_pdf:
-                pdf_path = export_to_pdf(
-                    filtered_routes,
-                    image_folder,
-                    "output",
-                    selected_sector,
-                    selected_block,
-                    selected_grade,
-                )
-                # Provide download link for the generated PDF
-                with open(pdf_path, "rb") as file:
-                    st.download_button(
-                        label="Download PDF",
-                        data=file,
-                        file_name=os.path.basename(pdf_path),
-                        mime="application/pdf",
-                        use_container_width=True,
-                    )
+            if export_job is not None and not export_job.finished:
+                show_export_progress(export_job)
+            elif export_job is not None and export_job.status == "done":
+                # The PDF is only read when asked for, not on every rerun
+                download = st.empty()
+                if download.button("Get PDF", use_container_width=True):
+                    with open(export_job.path, "rb") as file:
+                        download.download_button(
+                            label="Download PDF",
+                            data=file,
+                            file_name=os.path.basename(export_job.path),
+                            mime="application/pdf",
+                            use_container_width=True,
+                        )
+            elif export_job is not None and export_job.status == "failed":
+                st.error(f"Export failed: {export_job.error}")
+
+
+with st.sidebar.expander("Data stats"):
+    stats = catalog.stats()
+    st.caption(
+        f"{stats['routes']} routes, opened in {stats['open_seconds'] * 1000:.0f} ms"
+        + (
+            f" (built in {stats['build_seconds'] * 1000:.0f} ms)"
+            if stats["builds"]
+            else ""
+        )
+        + f", {stats['file_bytes'] / 1e3:.0f} KB on disk, page cache up to "
+        f"{stats['page_cache_bytes'] / 1e6:.1f} MB. {stats['queries']} queries in "
+        f"{stats['query_seconds'] * 1000:.1f} ms, last query "
+        f"{stats['last_query_seconds'] * 1000:.2f} ms"
+    )
+
+if not filtered_routes:
+    st.info("No routes to show, the search found no matches.")
+    st.stop()
 
 # Display route information
 current_route = filtered_routes[st.session_state.current_route_index]
@@ -197,13 +286,50 @@ st.subheader(
     f"{current_route['sector']} / {current_route['block']} / {current_route['name']} - {current_route['grade']}"
 )
 st.text(current_route["description"])
+if current_route.get("provenance"):
+    # Merged from copies read on several pages or guidebooks
+    st.caption(
+        "Found on "
+        + ", ".join(
+            f"{copy['source']} page {copy['page_number']}"
+            for copy in current_route["provenance"]
+        )
+    )
 
 # Display route image if available
-image_filename = f"page_{current_route['page_number']}.png"  # Assuming image filenames follow this pattern
-image_path = os.path.join(image_folder, image_filename)
+image_folder = route_image_folder(current_route)
+page_image = load_page_image(
+    image_folder, current_route["page_number"], image_sizes[image_size]
+)
 
-if os.path.exists(image_path):
-    st.image(image_path, caption=f"Page {current_route['page_number']}")
+# Routes shown by the Previous and Next buttons
+neighbours = {
+    "previous": st.session_state.current_route_index - 1,
+    "next": st.session_state.current_route_index + 1,
+}
+neighbours = {
+    key: filtered_routes[index]
+    for key, index in neighbours.items()
+    if 0 <= index < len(filtered_routes)
+}
+
+if page_image is not None:
+    st.html(
+        f'<figure style="margin: 0"><img src="{page_image_url(page_image, "page")}" '
+        f'style="max-width: 100%"><figcaption>Page {current_route["page_number"]}'
+        "</figcaption></figure>"
+    )
+
+    # The browser loads the neighbouring pages while this one is viewed
+    prefetch = []
+    for key, route in neighbours.items():
+        image = load_page_image(
+            route_image_folder(route), route["page_number"], image_sizes[image_size]
+        )
+        if image is not None:
+            prefetch.append(page_image_url(image, f"prefetch.{key}"))
+    if prefetch:
+        st.html("".join(f'<img src="{url}" style="display: none">' for url in prefetch))
 
     # Display navigation buttons below the image
     prev_disabled = st.session_state.current_route_index == 0
@@ -219,5 +345,18 @@ if os.path.exists(image_path):
         if st.button("Next", disabled=next_disabled, use_container_width=True):
             if st.session_state.current_route_index < len(route_options) - 1:
                 st.session_state.current_route_index += 1
+
+    # Thumbnails of the pages the buttons lead to
+    for column, key in ((col1, "previous"), (col2, "next")):
+        route = neighbours.get(key)
+        thumbnail = route and load_page_thumbnail(
+            route_image_folder(route), route["page_number"]
+        )
+        if thumbnail:
+            column.html(
+                f'<img src="{page_image_url(thumbnail, f"thumbnail.{key}")}" '
+                f'style="width: 100%" title="{route["name"]}, page '
+                f'{route["page_number"]}">'
+            )
 else:
     st.text("Image not available")
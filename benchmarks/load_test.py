@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from iperocks_croqui_ui.route_catalog import RouteCatalog
+from iperocks_croqui_ui.static_site import build_site
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# http.server over keep-alive, with Nagle off: it writes headers and body
+# separately, which otherwise stalls each response on a delayed ACK
+STATIC_SERVER = """
+import http.server, sys
+class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    def log_message(self, *args):
+        pass
+http.server.ThreadingHTTPServer(("127.0.0.1", int(sys.argv[1])), Handler).serve_forever()
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, path="/", timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", path)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a process, None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def summarize(name, latencies, elapsed, server_cpu):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "name": name,
+        "requests": count,
+        "requests_per_second": count / elapsed if elapsed else 0.0,
+        "p50_ms": latencies[count // 2] * 1000 if count else None,
+        "p95_ms": latencies[int(count * 0.95)] * 1000 if count else None,
+        "server_cpu_ms_per_request": (
+            server_cpu / count * 1000 if count and server_cpu is not None else None
+        ),
+    }
+
+
+def load_static(site_dir, concurrency, duration):
+    """
+    Clients viewing route pages of the static site: each view is the
+    pre-rendered route page plus its page image, over keep-alive connections.
+    """
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-c", STATIC_SERVER, str(port)],
+        cwd=site_dir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(port, "/index.html")
+        routes = sorted(os.listdir(os.path.join(site_dir, "routes")))
+        images = []
+        for dirpath, _, filenames in os.walk(os.path.join(site_dir, "images")):
+            images += [
+                os.path.relpath(os.path.join(dirpath, name), site_dir)
+                for name in filenames
+            ]
+        latencies = []
+        deadline = time.monotonic() + duration
+
+        def client(offset):
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+            view = offset
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                for path in (
+                    f"/routes/{routes[view % len(routes)]}",
+                    f"/{images[view % len(images)]}",
+                ):
+                    connection.request("GET", path)
+                    connection.getresponse().read()
+                latencies.append(time.perf_counter() - started)
+                view += concurrency
+
+        cpu = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=client, args=(i,)) for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        after = cpu_seconds(server.pid)
+        server_cpu = after - cpu if cpu is not None else None
+    finally:
+        server.terminate()
+        server.wait()
+    return summarize("static route views", latencies, elapsed, server_cpu)
+
+
+async def streamlit_session(port, deadline, latencies):
+    # Imported here, only the Streamlit load test needs a websocket client
+    import websockets
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    async with websockets.connect(
+        f"ws://127.0.0.1:{port}/_stcore/stream",
+        subprotocols=["streamlit"],
+        max_size=None,
+    ) as websocket:
+        while time.monotonic() < deadline:
+            # A widget change or button click re-runs the whole script
+            message = BackMsg()
+            message.rerun_script.query_string = ""
+            started = time.perf_counter()
+            await websocket.send(message.SerializeToString())
+            while True:
+                response = ForwardMsg()
+                response.ParseFromString(await websocket.recv())
+                if response.WhichOneof("type") == "script_finished":
+                    break
+            latencies.append(time.perf_counter() - started)
+
+
+def load_streamlit(concurrency, duration):
+    """Sessions of the current app, each re-running the script in a loop."""
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            "app.py",
+            "--server.headless",
+            "true",
+            "--server.port",
+            str(port),
+            "--browser.gatherUsageStats",
+            "false",
+        ],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(port, "/_stcore/health")
+        latencies = []
+
+        async def run(deadline):
+            await asyncio.gather(
+                *(
+                    streamlit_session(port, deadline, latencies)
+                    for _ in range(concurrency)
+                )
+            )
+
+        # One warm-up run loads the catalog and the page images
+        asyncio.run(run(time.monotonic()))
+        latencies.clear()
+        cpu = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        asyncio.run(run(time.monotonic() + duration))
+        elapsed = time.perf_counter() - started
+        after = cpu_seconds(server.pid)
+        server_cpu = after - cpu if cpu is not None else None
+    finally:
+        server.terminate()
+        server.wait()
+    return summarize("streamlit reruns", latencies, elapsed, server_cpu)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the static catalog site against the Streamlit app."
+    )
+    parser.add_argument(
+        "--site-dir",
+        help="Built site to serve (default: built from output/ into a temp folder).",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients.")
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds per load test."
+    )
+    parser.add_argument(
+        "--skip-streamlit", action="store_true", help="Only load test the static site."
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="croqui_site_") as temp_dir:
+        site_dir = args.site_dir
+        if site_dir is None:
+            site_dir = temp_dir
+            catalog = RouteCatalog(
+                os.path.join(ROOT, "output", "routes.sqlite"),
+                os.path.join(ROOT, "output", "routes_store.json"),
+            )
+            build_site(catalog, os.path.join(ROOT, "output"), site_dir)
+
+        results = [load_static(site_dir, args.concurrency, args.duration)]
+    if not args.skip_streamlit:
+        results.append(load_streamlit(args.concurrency, args.duration))
+
+    print(f"{'':<22}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'server cpu ms/req':>20}")
+    for result in results:
+        cpu = result["server_cpu_ms_per_request"]
+        print(
+            f"{result['name']:<22}{result['requests_per_second']:>10.1f}"
+            f"{result['p50_ms'] or 0:>10.2f}{result['p95_ms'] or 0:>10.2f}"
+            f"{'n/a' if cpu is None else f'{cpu:.2f}':>20}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
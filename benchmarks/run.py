@@ -0,0 +1,467 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory of exports is not measured
+    resource = None
+
+from benchmarks.synthetic import (
+    BASE_PAGES,
+    generate_pages,
+    write_guidebook_folder,
+    write_guidebook_pdf,
+)
+from iperocks_croqui_ui.collect_json import (
+    consolidate,
+    iter_page_files,
+    load_json_files,
+    read_page_routes,
+    save_consolidated_data,
+)
+from iperocks_croqui_ui.export_pdf import export_to_pdf, stream_pdf
+from iperocks_croqui_ui.page_pack import PagePack, pack_folder, page_image_name
+from iperocks_croqui_ui.route_catalog import PAGE_SIZE, RouteCatalog
+from iperocks_croqui_ui.route_dedup import merge_duplicates, name_bands, name_shingles
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SUITES = ("startup", "ingest", "consolidate", "viewer", "export")
+# Fresh interpreters, as started by the CLI and each spawned pool worker
+STARTUP_COMMANDS = {
+    "python": ["-c", "pass"],
+    "import_pdf_converter": ["-c", "import iperocks_croqui_ui.pdf_converter"],
+    "import_collect_json": ["-c", "import iperocks_croqui_ui.collect_json"],
+    "main_help": ["main.py", "--help"],
+}
+SEARCH_QUERIES = ["reglete", "travesia", "sol poente", "pedra 12", "sds aresta"]
+# Timings below this many seconds are too noisy to fail a run on
+MIN_REGRESSION_SECONDS = 0.005
+FAST_SECONDS = 0.05
+FAST_REPEAT = 10
+
+
+def measure(func, repeat=3):
+    """
+    Best wall time of func() in seconds over `repeat` runs, with its output
+    silenced. Functions faster than FAST_SECONDS are run FAST_REPEAT times,
+    the minimum being the least noisy estimate on a busy machine.
+    """
+    timings = []
+    while len(timings) < repeat:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        if timings[0] < FAST_SECONDS:
+            repeat = max(repeat, FAST_REPEAT)
+    return min(timings)
+
+
+def bench_startup(results):
+    """Start-up time of a new interpreter for each of STARTUP_COMMANDS."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # Imports must work without credentials
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    for name, args in STARTUP_COMMANDS.items():
+
+        def run():
+            subprocess.run(
+                [sys.executable, *args],
+                cwd=root,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+
+        results[f"startup/{name}"] = measure(run, repeat=5)
+
+
+def bench_ingest(workdir, pages, results):
+    """Full conversion of a synthetic PDF with the offline LLM stub."""
+    # Imported here, the converter needs poppler and tesseract at run time
+    from iperocks_croqui_ui.pdf_converter import pdf_to_png_and_extract_text
+
+    pdf_path = write_guidebook_pdf(
+        os.path.join(workdir, "Synthetic.pdf"), generate_pages(pages)
+    )
+    for workers in (1, 4):
+
+        def run():
+            output_root = os.path.join(workdir, f"ingest_{workers}")
+            shutil.rmtree(output_root, ignore_errors=True)
+            pdf_to_png_and_extract_text(
+                pdf_path,
+                output_root,
+                workers=workers,
+                llm_backend="fake",
+                renditions=False,
+            )
+
+        results[f"ingest/{pages}p/w{workers}"] = measure(run, repeat=1)
+
+
+def bench_consolidate(root, scale, results):
+    """
+    Legacy grouped JSON, then full, no-op incremental and one page changed
+    route store builds, and the duplicate merge alone on a catalog with one
+    route in ten repeated.
+    """
+    legacy_file = os.path.join(root, "consolidated_routes.json")
+    store_file = os.path.join(root, "routes_store.json")
+    manifest_file = os.path.join(root, "manifest.json")
+
+    results[f"consolidate/legacy/x{scale}"] = measure(
+        lambda: save_consolidated_data(load_json_files(root), legacy_file)
+    )
+    results[f"consolidate/full/x{scale}"] = measure(
+        lambda: consolidate(root, store_file, manifest_file, full=True)
+    )
+    results[f"consolidate/incremental/x{scale}"] = measure(
+        lambda: consolidate(root, store_file, manifest_file)
+    )
+
+    # One route of one page file renamed, then back, between runs
+    page_file = next(iter_page_files(root))
+    with open(page_file, "r", encoding="utf-8") as file:
+        original = file.read()
+    page = json.loads(original)
+    page["routes"][0]["name"] += " (edited)"
+    versions = itertools.cycle([json.dumps(page), original])
+
+    def one_page():
+        with open(page_file, "w", encoding="utf-8") as file:
+            file.write(next(versions))
+        consolidate(root, store_file, manifest_file)
+
+    results[f"consolidate/one_page/x{scale}"] = measure(one_page, repeat=4)
+    with open(page_file, "w", encoding="utf-8") as file:
+        file.write(original)
+    consolidate(root, store_file, manifest_file)
+
+    routes = [
+        route for path in iter_page_files(root) for route in read_page_routes(path)
+    ]
+    # Read again from the next page, under the placeholder block name
+    copies = [
+        dict(route, page_number=route["page_number"] + 1, block="Bloco")
+        for route in routes[::10]
+    ]
+
+    def dedup():
+        name_shingles.cache_clear()
+        name_bands.cache_clear()
+        return merge_duplicates(routes + copies)
+
+    results[f"consolidate/dedup/x{scale}"] = measure(dedup)
+    return store_file
+
+
+def bench_viewer(store_file, scale, results):
+    """Catalog open, cascading filter queries and free-text search."""
+    # The SQLite catalog consolidate wrote next to the store
+    catalog = RouteCatalog(os.path.join(os.path.dirname(store_file), "routes.sqlite"))
+    results[f"viewer/catalog_open/x{scale}"] = measure(
+        lambda: RouteCatalog(catalog.catalog_file).count()
+    )
+
+    # The filter combinations the sidebar offers, capped for large catalogs
+    combinations = [(None, None, None)]
+    for sector in catalog.sectors()[:20]:
+        combinations.append((None, None, sector))
+        for block in catalog.blocks(sector)[:5]:
+            combinations.append((None, block, sector))
+            for grade in catalog.grades(sector, block)[:3]:
+                combinations.append((grade, block, sector))
+
+    def catalog_filter_all():
+        for grade, block, sector in combinations:
+            catalog.grades(sector, block)
+            catalog.count(grade, block, sector)
+            catalog.filter(grade, block, sector, limit=PAGE_SIZE)
+
+    results[f"viewer/catalog_filter/x{scale}"] = measure(catalog_filter_all) / len(
+        combinations
+    )
+    results[f"viewer/catalog_search/x{scale}"] = measure(
+        lambda: [
+            catalog.filter(query=query, limit=PAGE_SIZE) for query in SEARCH_QUERIES
+        ]
+    ) / len(SEARCH_QUERIES)
+
+
+def bench_images(image_folder, page_numbers, results):
+    """Listing and fetching page images as loose files and from the pack."""
+    pages = len(page_numbers)
+    results[f"images/pack/{pages}p"] = measure(
+        lambda: pack_folder(image_folder), repeat=1
+    )
+
+    def fetch_loose():
+        listed = {name for name in os.listdir(image_folder) if name.endswith(".png")}
+        for page_number in page_numbers:
+            path = os.path.join(image_folder, page_image_name(page_number))
+            if os.path.exists(path) and os.path.basename(path) in listed:
+                with open(path, "rb") as file:
+                    file.read()
+
+    def fetch_packed():
+        pack = PagePack(image_folder)
+        for page_number in page_numbers:
+            pack.get(page_image_name(page_number))
+
+    results[f"images/fetch_loose/{pages}p"] = measure(fetch_loose)
+    results[f"images/fetch_packed/{pages}p"] = measure(fetch_packed)
+
+
+def resident_bytes():
+    with open("/proc/self/statm", "r", encoding="utf-8") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def stream_export(connection, routes, image_folder, cache_folder):
+    """
+    Child process: stream an export like a chunked response would, and send
+    back the time to its first chunk and how far the RSS grew at its peak.
+    """
+    start_bytes = resident_bytes()
+    start = time.perf_counter()
+    first_chunk = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in stream_pdf(routes, image_folder, cache_folder=cache_folder):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+    peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    connection.send((first_chunk, peak_bytes - start_bytes))
+
+
+def measure_stream(routes, image_folder, cache_folder):
+    """(time to first byte, peak RSS growth) of a streamed export, or None."""
+    if resource is None or not os.path.exists("/proc/self/statm"):
+        return None
+    # A fresh process, so the peak RSS is that of this export only
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=stream_export, args=(sender, routes, image_folder, cache_folder)
+    )
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def bench_export(workdir, sizes, results, memory):
+    """
+    PDF export of catalogs of several sizes, cold and with a warm cache,
+    then the time to first byte and peak memory of streaming it.
+    """
+    image_folder = os.path.join(workdir, "export_images")
+    pages = generate_pages(max(sizes), routes_per_page=1)
+    write_guidebook_folder(image_folder, pages)
+    # Exports read the page images from the pack, like after a conversion
+    bench_images(image_folder, list(pages), results)
+    routes = [page["routes"][0] for page in pages.values()]
+    output_directory = os.path.join(workdir, "exports")
+    os.makedirs(output_directory, exist_ok=True)
+
+    for size in sizes:
+        cache_folder = os.path.join(workdir, f"export_cache_{size}")
+
+        def run():
+            export_to_pdf(
+                routes[:size],
+                image_folder,
+                output_directory,
+                cache_folder=cache_folder,
+            )
+
+        # Large exports take minutes, they are timed once
+        results[f"export/cold/{size}p"] = measure(run, repeat=1)
+        results[f"export/warm/{size}p"] = measure(run, repeat=1 if size > 100 else 3)
+
+        streamed = measure_stream(routes[:size], image_folder, cache_folder)
+        if streamed is not None:
+            results[f"export/ttfb/{size}p"], memory[f"export/peak_rss/{size}p"] = (
+                streamed
+            )
+
+
+def run_benchmarks(suites, scales, export_sizes, ingest_pages):
+    """Timings in seconds and peak memory growths in bytes, by benchmark."""
+    results = {}
+    memory = {}
+    if "startup" in suites:
+        bench_startup(results)
+    with tempfile.TemporaryDirectory(prefix="croqui_bench_") as workdir:
+        if "ingest" in suites:
+            bench_ingest(workdir, ingest_pages, results)
+
+        for scale in scales:
+            if not {"consolidate", "viewer"} & set(suites):
+                break
+            root = os.path.join(workdir, f"catalog_x{scale}")
+            folder = os.path.join(root, "Synthetic")
+            write_guidebook_folder(
+                folder, generate_pages(BASE_PAGES * scale, seed=scale), images=False
+            )
+            store_file = bench_consolidate(root, scale, results)
+            if "viewer" in suites:
+                bench_viewer(store_file, scale, results)
+            shutil.rmtree(root)
+
+        if "export" in suites:
+            bench_export(workdir, export_sizes, results, memory)
+    return results, memory
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance, min_regression=MIN_REGRESSION_SECONDS):
+    """
+    Return the benchmarks slower (or, for memory, bigger) than the baseline
+    by more than tolerance.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if value > expected * (1 + tolerance) and value - expected > min_regression:
+            regressions.append((name, expected, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark start-up, and ingest, consolidation, viewer queries "
+        "and export on synthetic guidebooks."
+    )
+    parser.add_argument(
+        "--suites",
+        nargs="+",
+        choices=SUITES,
+        default=list(SUITES),
+        help="Benchmark suites to run.",
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=int,
+        default=[1, 10, 100],
+        help=f"Catalog sizes as multiples of the {BASE_PAGES}-page guidebook "
+        "(add 1000 for the large catalog, it takes several minutes).",
+    )
+    parser.add_argument(
+        "--export-sizes",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000],
+        help="Numbers of pages exported to PDF.",
+    )
+    parser.add_argument(
+        "--ingest-pages",
+        type=int,
+        default=30,
+        help="Number of pages in the synthetic PDF that is ingested.",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_FILE,
+        help="Baseline timings the results are compared against.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        help="Allowed slowdown over the baseline, as a fraction (1.0 = 2x).",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing.",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+    # A suite left out of the results would pass the comparison unnoticed
+    if "ingest" in args.suites and shutil.which("pdftoppm") is None:
+        parser.error(
+            "the ingest suite needs poppler (pdftoppm), install it or leave "
+            "ingest out of --suites"
+        )
+
+    results, memory = run_benchmarks(
+        args.suites, args.scales, args.export_sizes, args.ingest_pages
+    )
+    for name, seconds in sorted(results.items()):
+        print(f"{name:<36}{seconds * 1000:>12.2f} ms")
+    for name, size in sorted(memory.items()):
+        print(f"{name:<36}{size / 1024**2:>12.2f} MB")
+
+    report = {"environment": environment(), "results": results, "memory": memory}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {"environment": environment(), "results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as file:
+                baseline = json.load(file)
+        # Benchmarks that were not run keep their previous baseline
+        baseline["environment"] = environment()
+        baseline["results"].update(results)
+        baseline.setdefault("memory", {}).update(memory)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline.get("environment") != environment():
+        print(f"Warning: baseline was recorded on {baseline.get('environment')}")
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for name, expected, seconds in regressions:
+        print(
+            f"REGRESSION {name}: {seconds * 1000:.2f} ms "
+            f"(baseline {expected * 1000:.2f} ms)"
+        )
+    # Peak memory is not noisy like timings, any growth beyond tolerance counts
+    memory_regressions = compare(
+        memory, baseline.get("memory", {}), args.tolerance, min_regression=0
+    )
+    for name, expected, size in memory_regressions:
+        print(
+            f"REGRESSION {name}: {size / 1024**2:.2f} MB "
+            f"(baseline {expected / 1024**2:.2f} MB)"
+        )
+    if regressions or memory_regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import json
+import os
+import random
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw
+
+# Size of the real guidebook the scale factors are relative to
+BASE_PAGES = 150
+ROUTES_PER_PAGE = 3
+PAGE_SIZE = (800, 450)
+
+SECTOR_WORDS = ["Nascente", "Seu Luiz", "Pasto", "Mirante", "Cachoeira", "Toca"]
+BLOCK_WORDS = ["Pedra", "Gigante", "Ovo", "Baleia", "Torre", "Capivara", "Lua"]
+NAME_WORDS = [
+    "Reglete",
+    "Travessia",
+    "Sem",
+    "Educação",
+    "Mal",
+    "Criado",
+    "Ipê",
+    "Roxo",
+    "Planetário",
+    "Sol",
+    "Poente",
+    "Pé",
+    "Frio",
+]
+DESCRIPTION_WORDS = ["SDS", "start", "sentado", "aresta", "regletes", "top", "out"]
+
+
+def generate_pages(pages, routes_per_page=ROUTES_PER_PAGE, seed=0):
+    """
+    Build `pages` CroquiPage-shaped dicts, keyed by 1-based page number.
+
+    Sectors and blocks are shared by consecutive pages like in the real
+    guidebook, so the facet filters stay selective as the catalog grows.
+    """
+    rng = random.Random(seed)
+    result = {}
+    route_number = 0
+    for page_number in range(1, pages + 1):
+        sector_id = page_number // 25
+        block_id = page_number // 4
+        sector = f"Setor {SECTOR_WORDS[sector_id % len(SECTOR_WORDS)]} {sector_id}"
+        block = f"{BLOCK_WORDS[block_id % len(BLOCK_WORDS)]} {block_id}"
+        routes = []
+        for _ in range(routes_per_page):
+            route_number += 1
+            routes.append(
+                {
+                    "id_number": route_number,
+                    "name": " ".join(rng.sample(NAME_WORDS, 2)),
+                    "grade": f"V{rng.randint(0, 12)}",
+                    "description": " ".join(rng.choices(DESCRIPTION_WORDS, k=6)),
+                    "page_number": page_number,
+                    "block": block,
+                    "sector": sector,
+                }
+            )
+        result[page_number] = {"page_message": "", "routes": routes}
+    return result
+
+
+def page_text(page):
+    """Page text in the layout fake_llm.fake_page_response understands."""
+    routes = page["routes"]
+    lines = [routes[0]["sector"].upper(), f"Bloco {routes[0]['block']}"]
+    lines += [f"{r['id_number']} {r['name']} - {r['grade']}" for r in routes]
+    return "\n".join(lines)
+
+
+def render_page_image(page_number, page, size=PAGE_SIZE):
+    """A flat-colour page image with its routes written on it."""
+    rng = random.Random(page_number)
+    img = Image.new("RGB", size, tuple(rng.randint(120, 220) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + 120, y + 80), fill=(90, 80, 70))
+    draw.multiline_text((20, 20), page_text(page), fill=(0, 0, 0))
+    return img
+
+
+def write_guidebook_folder(folder, pages, images=True):
+    """
+    Write the page_N.json/.txt (and .png) files the converter would produce
+    for the generated pages.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for page_number, page in pages.items():
+        base = os.path.join(folder, f"page_{page_number}")
+        with open(f"{base}.json", "w", encoding="utf-8") as file:
+            json.dump(page, file, indent=4)
+        with open(f"{base}.txt", "w", encoding="utf-8") as file:
+            file.write(page_text(page))
+        if images:
+            render_page_image(page_number, page).save(f"{base}.png", "PNG")
+
+
+def write_guidebook_pdf(path, pages):
+    """Write a PDF with one text page per generated page, for ingest runs."""
+    pdf = FPDF(orientation="L", format=(PAGE_SIZE[1] * 0.3, PAGE_SIZE[0] * 0.3))
+    pdf.set_font("Helvetica", size=12)
+    for page in pages.values():
+        pdf.add_page()
+        text = page_text(page).encode("latin-1", "replace").decode("latin-1")
+        pdf.multi_cell(0, 6, text)
+    pdf.output(path)
+    return path
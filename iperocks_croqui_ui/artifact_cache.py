@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+
+
+def hash_bytes(*parts):
+    """SHA-256 hex digest over several str/bytes parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_image(image):
+    """Hash the decoded pixels of a PIL image, independent of its encoding."""
+    return hash_bytes(image.mode, f"{image.size[0]}x{image.size[1]}", image.tobytes())
+
+
+def ocr_cache_key(pixel_hash, ocr_config):
+    return hash_bytes("ocr", pixel_hash, ocr_config)
+
+
+def llm_cache_key(text, page_number, llm_config):
+    return hash_bytes("llm", text, str(page_number), llm_config)
+
+
+def blob_path(cache_dir, key):
+    return os.path.join(cache_dir, "objects", key[:2], key)
+
+
+def read_blob(cache_dir, key):
+    """Read a cached blob without touching the index (safe in pool workers)."""
+    try:
+        with open(blob_path(cache_dir, key), "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_blob(cache_dir, key, data):
+    """Atomically write a blob (safe in pool workers). Returns its size."""
+    path = blob_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+    return len(data)
+
+
+class ArtifactCache:
+    """
+    Content-addressed store for OCR text and LLM responses.
+
+    Blobs live under `<cache_dir>/objects/` named by the hash of their inputs,
+    and `<cache_dir>/index.json` tracks their size and last access so the
+    least recently used entries are evicted once `max_bytes` is exceeded.
+    The index also remembers the pixel hash of each (PDF digest, page) so an
+    unchanged guidebook does not need to be re-rendered.
+
+    Only the owning process updates the index; pool workers use read_blob and
+    write_blob and report back through record().
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.entries = {}
+        self.pages = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                index = json.load(file)
+            self.entries = index.get("entries", {})
+            self.pages = index.get("pages", {})
+
+    @property
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def get(self, key):
+        data = read_blob(self.cache_dir, key)
+        self.record(key, data is not None, None if data is None else len(data))
+        return data
+
+    def put(self, key, data):
+        size = write_blob(self.cache_dir, key, data)
+        self.entries[key] = {"size": size, "last_access": time.time()}
+        self.evict()
+
+    def get_text(self, key):
+        data = self.get(key)
+        return None if data is None else data.decode("utf-8")
+
+    def put_text(self, key, text):
+        self.put(key, text.encode("utf-8"))
+
+    def record(self, key, hit, size=None):
+        """Account for a lookup, possibly done by a worker, in stats and index."""
+        self.stats["hits" if hit else "misses"] += 1
+        if size is not None:
+            self.entries[key] = {"size": size, "last_access": time.time()}
+            self.evict()
+        elif key in self.entries and not hit:
+            # The blob was removed from disk behind our back
+            del self.entries[key]
+
+    def page_pixel_hash(self, pdf_digest, page_number):
+        return self.pages.get(f"{pdf_digest}:{page_number}")
+
+    def set_page_pixel_hash(self, pdf_digest, page_number, pixel_hash):
+        self.pages[f"{pdf_digest}:{page_number}"] = pixel_hash
+
+    def evict(self):
+        """Drop least recently used blobs until the cache fits in max_bytes."""
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["size"]
+            try:
+                os.remove(blob_path(self.cache_dir, key))
+            except FileNotFoundError:
+                pass
+            self.stats["evictions"] += 1
+
+    def save(self):
+        """Persist the index atomically."""
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"entries": self.entries, "pages": self.pages}, file)
+        os.replace(temp_path, self.index_path)
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (
+            f"Cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({hit_rate:.0%} hit rate), {self.stats['evictions']} evictions, "
+            f"{len(self.entries)} entries, {self.total_bytes / 1e6:.1f} MB"
+        )
@@ -1,9 +1,51 @@
+import argparse
+import fnmatch
+import hashlib
 import json
 import os
 from collections import defaultdict
 
+from iperocks_croqui_ui.artifact_cache import hash_bytes
+from iperocks_croqui_ui.route_catalog import (
+    catalog_routes,
+    clear_catalog,
+    connect,
+    delete_rows,
+    find_routes,
+    insert_routes,
+    prepare_catalog,
+    read_meta,
+    write_meta,
+)
+from iperocks_croqui_ui.route_dedup import merge_duplicates
+from iperocks_croqui_ui.route_dedup import sector_key as merge_key
+from iperocks_croqui_ui.route_store import (
+    RouteStore,
+    route_copies,
+    route_id,
+    save_store,
+)
 
-def load_json_files(root_folder):
+PAGE_PATTERN = "page_*.json"
+MANIFEST_VERSION = 3
+
+
+def iter_page_files(root_folder):
+    """Yield the path of every page JSON below root_folder, in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if fnmatch.fnmatch(filename, PAGE_PATTERN):
+                yield os.path.join(dirpath, filename)
+
+
+def read_page_routes(file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    return data.get("routes", []) if isinstance(data, dict) else []
+
+
+def group_routes(routes):
     # Dictionary to store all routes, categorized by different properties
     consolidated_data = {
         "by_grade": defaultdict(list),
@@ -11,42 +53,362 @@ def load_json_files(root_folder):
         "by_sector": defaultdict(list),
     }
 
-    # Walk through the directory to find JSON files
-    for dirpath, _, filenames in os.walk(root_folder):
-        for filename in filenames:
-            if filename.endswith(".json"):
-                file_path = os.path.join(dirpath, filename)
-                with open(file_path, "r", encoding="utf-8") as file:
-                    print(f"Reading JSON file {file_path}")
-                    data = json.load(file)
-                    # Extract routes
-                    for route in data.get("routes", []):
-                        # Add route to different categories
-                        grade = route.get("grade")
-                        block = route.get("block")
-                        sector = route.get("sector")
-
-                        if grade:
-                            consolidated_data["by_grade"][grade].append(route)
-                        if block:
-                            consolidated_data["by_block"][block].append(route)
-                        if sector:
-                            consolidated_data["by_sector"][sector].append(route)
+    for route in routes:
+        # Add route to different categories
+        grade = route.get("grade")
+        block = route.get("block")
+        sector = route.get("sector")
+
+        if grade:
+            consolidated_data["by_grade"][grade].append(route)
+        if block:
+            consolidated_data["by_block"][block].append(route)
+        if sector:
+            consolidated_data["by_sector"][sector].append(route)
 
     return consolidated_data
 
 
+def load_json_files(root_folder):
+    """Read every page JSON below root_folder and group its routes."""
+    routes = []
+    for file_path in iter_page_files(root_folder):
+        routes.extend(read_page_routes(file_path))
+    return group_routes(routes)
+
+
 def save_consolidated_data(consolidated_data, output_file):
     print(f"Saving JSON {output_file}")
     with open(output_file, "w", encoding="utf-8") as file:
         json.dump(consolidated_data, file, indent=4)
 
 
-# Usage example
-root_folder = "output"  # Replace with your folder containing JSON files
-output_file = "output/consolidated_routes.json"
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_sha256(file_path):
+    with open(file_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def empty_manifest():
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return empty_manifest()
+    with open(manifest_file, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    # Files listed by an older version are read again
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def guidebook_of(rel_path):
+    """The guidebook of a page file is the folder it was written to."""
+    parts = rel_path.split(os.sep)
+    return parts[0] if len(parts) > 1 else ""
+
+
+def save_manifest(manifest, manifest_file):
+    temp_file = f"{manifest_file}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as file:
+        # dumps encodes in one C call, dump writes chunk by chunk
+        file.write(json.dumps(manifest))
+    os.replace(temp_file, manifest_file)
+
+
+def read_source_routes(root_folder, rel_path):
+    """Routes of a page file, tagged with the guidebook they come from."""
+    file_path = os.path.join(root_folder, rel_path)
+    try:
+        routes = read_page_routes(file_path)
+    except ValueError as e:
+        print(f"Skipping invalid JSON file {file_path}: {e}")
+        routes = []
+    for route in routes:
+        route["source"] = guidebook_of(rel_path)
+    return routes
+
+
+def page_sort_key(rel_path, position):
+    """Place of a page route in store order: page file order, then response order."""
+    return f"{rel_path}\x1f{position:06d}"
+
+
+def update_manifest(root_folder, manifest):
+    """
+    Bring the manifest in line with the page files on disk.
+
+    Only files whose mtime or size changed are hashed, and only files whose
+    hash changed are parsed again; the manifest keeps the ids of their
+    routes. Returns (changed, removed, restamped): the routes of each
+    changed file, by relative path, in file order, then the relative paths
+    of the removed files and of the files whose content is unchanged but
+    whose mtime or size changed.
+    """
+    files = manifest["files"]
+    seen = set()
+    changed = {}
+    restamped = []
+
+    for file_path in iter_page_files(root_folder):
+        rel_path = os.path.relpath(file_path, root_folder)
+        seen.add(rel_path)
+        mtime_ns, size = file_signature(file_path)
+        entry = files.get(rel_path)
+        if entry and entry["mtime_ns"] == mtime_ns and entry["size"] == size:
+            continue
+
+        digest = file_sha256(file_path)
+        if entry is None or entry["sha256"] != digest:
+            routes = read_source_routes(root_folder, rel_path)
+            entry = {"route_ids": [route_id(route) for route in routes]}
+            changed[rel_path] = routes
+        else:
+            restamped.append(rel_path)
+        entry.update(mtime_ns=mtime_ns, size=size, sha256=digest)
+        files[rel_path] = entry
+
+    removed = [rel_path for rel_path in files if rel_path not in seen]
+    for rel_path in removed:
+        del files[rel_path]
+
+    return changed, removed, restamped
+
+
+def update_catalog(connection, root_folder, manifest, changed, dirty, merge=True):
+    """
+    Swap the routes of changed page files into the catalog, row by row.
+
+    Catalog routes built from a route id in dirty are deleted. Their other
+    copies are read again from their page files and, with the routes of the
+    changed files, merged into the catalog routes of the same sectors, which
+    are not compared with each other again. Returns the deleted and the
+    inserted routes.
+    """
+    dropped, dropped_keys = find_routes(connection, copy_ids=dirty)
+    # Unchanged page files to read again, with the route ids wanted from
+    # them: the other copies of the deleted routes, and the changed ids
+    # that unchanged files have too
+    wanted = defaultdict(set)
+    for copy, sort_key in dropped_keys.items():
+        if copy not in dirty:
+            wanted[sort_key.split("\x1f")[0]].add(copy)
+    for rel_path, entry in manifest["files"].items():
+        if rel_path not in changed and not dirty.isdisjoint(entry["route_ids"]):
+            wanted[rel_path].update(dirty.intersection(entry["route_ids"]))
+
+    # Each page route is kept where it is read first, as in the store
+    first_copies = {}
+
+    def add(rel_path, position, route):
+        rid, sort_key = route_id(route), page_sort_key(rel_path, position)
+        if rid not in first_copies or sort_key < first_copies[rid][0]:
+            first_copies[rid] = (sort_key, route)
+
+    for rel_path, routes in changed.items():
+        for position, route in enumerate(routes):
+            add(rel_path, position, route)
+    for rel_path, ids in wanted.items():
+        if rel_path in changed or not os.path.exists(
+            os.path.join(root_folder, rel_path)
+        ):
+            continue
+        for position, route in enumerate(read_source_routes(root_folder, rel_path)):
+            if route_id(route) in ids:
+                add(rel_path, position, route)
+    sort_keys = {rid: sort_key for rid, (sort_key, _) in first_copies.items()}
+    fresh_copies = sorted(first_copies.values(), key=lambda copy: copy[0])
+    fresh = [route for _, route in fresh_copies]
+
+    candidates = {}
+    routes = fresh
+    if merge and fresh:
+        candidates, candidate_keys = find_routes(
+            connection, merge_keys={merge_key(route.get("sector")) for route in fresh}
+        )
+        for row in dropped:
+            candidates.pop(row, None)
+        # The deleted routes are found again, their copies keep the new keys
+        for copy, sort_key in candidate_keys.items():
+            sort_keys.setdefault(copy, sort_key)
+        kept = list(candidates.values())
+        order = [
+            min(sort_keys[copy] for copy in route_copies(route)) for route in kept
+        ] + [sort_key for sort_key, _ in fresh_copies]
+        routes = merge_duplicates(kept + fresh, start=len(kept), order=order)
+        print(f"{len(kept) + len(fresh) - len(routes)} duplicate routes merged")
+
+    # Catalog routes a new copy was merged into are replaced too
+    unchanged = {id(route) for route in routes}
+    replaced = [row for row, route in candidates.items() if id(route) not in unchanged]
+    kept_ids = {id(route) for route in candidates.values()}
+    inserted = [route for route in routes if id(route) not in kept_ids]
+    deleted = list(dropped.values()) + [candidates[row] for row in replaced]
+
+    delete_rows(connection, list(dropped) + replaced)
+    insert_routes(connection, inserted, sort_keys)
+    return deleted, inserted
+
+
+def consolidate(
+    root_folder,
+    output_file,
+    manifest_file=None,
+    full=False,
+    legacy_file=None,
+    catalog_file=None,
+    merge=True,
+):
+    """
+    Incrementally update the SQLite catalog and the route store from the
+    page JSONs.
+
+    The manifest keeps each page file's mtime, size, hash and route ids, so
+    only new or modified files are read on the next run. The catalog routes
+    built from their old or new routes are deleted and inserted again, row
+    by row; nothing is written when no file changed. The route store, a
+    single JSON file, is then exported from the catalog in full.
+
+    The merge options, the catalog data version and the store's mtime and
+    size are kept in the manifest too; everything is read and built again
+    when one of them differs, e.g. after the viewer rebuilt the catalog
+    from a pulled store. With full=True the manifest is ignored. When
+    legacy_file is given, the old by_grade/by_block/by_sector JSON is
+    written there too. The catalog defaults to routes.sqlite next to the
+    store. Routes extracted more than once are merged unless merge=False;
+    the page files always keep every copy.
+    """
+    output_dir = os.path.dirname(output_file)
+    if manifest_file is None:
+        manifest_file = os.path.join(output_dir, "consolidated_manifest.json")
+    if catalog_file is None:
+        catalog_file = os.path.join(output_dir, "routes.sqlite")
+    manifest = empty_manifest() if full else load_manifest(manifest_file)
+    options = {"merge": merge}
+    outputs = [output_file, catalog_file] + ([legacy_file] if legacy_file else [])
+    missing = not all(os.path.exists(path) for path in outputs)
+
+    connection = connect(catalog_file)
+    try:
+        prepare_catalog(connection)
+        data_version = read_meta(connection, "data_version")
+        rebuild = (
+            missing
+            or manifest.get("options") != options
+            or manifest.get("data_version") != data_version
+            or manifest.get("store_signature") != list(file_signature(output_file))
+        )
+        if rebuild:
+            manifest = empty_manifest()
+        # Route ids of every file as last consolidated
+        previous = dict(manifest["files"])
+        changed, removed, restamped = update_manifest(root_folder, manifest)
+
+        if rebuild or changed or removed:
+            dirty = set()
+            if not rebuild:
+                for rel_path in list(changed) + removed:
+                    dirty.update(previous.get(rel_path, {"route_ids": []})["route_ids"])
+                    dirty.update(
+                        manifest["files"].get(rel_path, {"route_ids": []})["route_ids"]
+                    )
+            with connection:
+                if rebuild:
+                    clear_catalog(connection)
+                deleted, inserted = update_catalog(
+                    connection, root_folder, manifest, changed, dirty, merge
+                )
+                data_version = hash_bytes(
+                    "" if rebuild else data_version,
+                    json.dumps(sorted(route["route_id"] for route in deleted)),
+                    json.dumps(inserted, ensure_ascii=False, sort_keys=True),
+                )
+                print(f"Saving route store {output_file}")
+                routes = catalog_routes(connection)
+                save_store(RouteStore.from_routes(routes), output_file)
+                write_meta(connection, data_version, file_sha256(output_file))
+            connection.execute("PRAGMA optimize")
+            if legacy_file:
+                save_consolidated_data(group_routes(routes), legacy_file)
+            manifest["options"] = options
+            manifest["data_version"] = data_version
+            manifest["store_signature"] = list(file_signature(output_file))
+    finally:
+        connection.close()
+    if rebuild or changed or removed or restamped:
+        save_manifest(manifest, manifest_file)
+
+    print(
+        f"{len(manifest['files'])} page files, {len(changed)} changed, "
+        f"{len(removed)} removed"
+    )
+    return list(changed), removed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Consolidate the page JSON files into a single route store."
+    )
+    parser.add_argument(
+        "root_folder",
+        nargs="?",
+        default="output",
+        help="Folder containing the page JSON files.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        type=str,
+        default="output/routes_store.json",
+        help="Route store file to write.",
+    )
+    parser.add_argument(
+        "--legacy-file",
+        type=str,
+        default=None,
+        help="Also write the old by_grade/by_block/by_sector JSON to this file.",
+    )
+    parser.add_argument(
+        "--catalog-file",
+        type=str,
+        default=None,
+        help="SQLite catalog file (defaults to routes.sqlite next to the output).",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Manifest file (defaults to consolidated_manifest.json next to the output).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest and re-read every page file.",
+    )
+    parser.add_argument(
+        "--keep-duplicates",
+        action="store_true",
+        help="Do not merge routes extracted more than once.",
+    )
+    args = parser.parse_args()
+
+    consolidate(
+        args.root_folder,
+        args.output_file,
+        args.manifest,
+        args.full,
+        args.legacy_file,
+        args.catalog_file,
+        not args.keep_duplicates,
+    )
+    print(f"Consolidated data saved to {args.output_file}")
 
-consolidated_data = load_json_files(root_folder)
-save_consolidated_data(consolidated_data, output_file)
 
-print(f"Consolidated data saved to {output_file}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from iperocks_croqui_ui.export_pdf import export_to_pdf, generate_filename
+from iperocks_croqui_ui.page_pack import INDEX_FILE
+from iperocks_croqui_ui.route_store import route_id
+
+
+def pack_signatures(image_folder, routes):
+    """
+    Size and mtime of the pack index of each guidebook folder the routes
+    come from. Images appended to a pack, e.g. renditions or a page read
+    again, change its index.
+    """
+    signatures = []
+    for source in sorted({route.get("source") or "" for route in routes}):
+        try:
+            stat = os.stat(os.path.join(image_folder, source, INDEX_FILE))
+            signatures.append(f"{source}:{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            signatures.append(f"{source}:")
+    return signatures
+
+
+class ExportJob:
+    """State of one background PDF export."""
+
+    def __init__(self, path):
+        self.path = path
+        self.status = "pending"
+        self.done = 0
+        self.total = 0
+        self.size = 0
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def update(self, done, total):
+        self.done, self.total = done, total
+
+
+class ExportJobManager:
+    """
+    Runs PDF exports on a bounded thread pool and memoizes the results.
+
+    Jobs are keyed by their output path: generate_filename names the PDF
+    after the filters, in a folder named after a hash of the data version,
+    the pack index signatures of the route folders and the ids of the
+    exported routes. The same routes are only exported once per data
+    version and page images, and a search or guidebook selection that keeps
+    the sidebar filters still gets its own PDF.
+    Finished PDFs form an LRU cache capped at max_bytes; PDFs left by a
+    previous run are picked up again on start.
+    """
+
+    def __init__(self, output_directory, max_workers=2, max_bytes=500 * 1024**2):
+        self.output_directory = output_directory
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self._load_existing()
+
+    def _load_existing(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.output_directory):
+            for filename in filenames:
+                if filename.endswith(".pdf"):
+                    path = os.path.join(dirpath, filename)
+                    found.append((os.path.getmtime(path), path))
+        for _, path in sorted(found):
+            job = ExportJob(path)
+            job.status = "done"
+            job.size = os.path.getsize(path)
+            self.jobs[path] = job
+        self._evict()
+
+    def job_path(self, export_key, sector, block, grade, unique_pages=False):
+        return os.path.join(
+            self.output_directory,
+            export_key[:12],
+            generate_filename(sector, block, grade, unique_pages),
+        )
+
+    def submit(
+        self,
+        routes,
+        image_folder,
+        data_version,
+        sector=None,
+        block=None,
+        grade=None,
+        unique_pages=False,
+    ):
+        """Return the job for these routes, starting it if it is not known."""
+        routes = list(routes)
+        key = hashlib.sha256(f"{data_version}:{image_folder}".encode())
+        for signature in pack_signatures(image_folder, routes):
+            key.update(f"\n{signature}".encode())
+        for route in routes:
+            key.update(f"\n{route.get('route_id') or route_id(route)}".encode())
+        path = self.job_path(key.hexdigest(), sector, block, grade, unique_pages)
+        with self.lock:
+            job = self.jobs.get(path)
+            if job is not None and job.status != "failed":
+                if job.status != "done" or os.path.exists(path):
+                    self.jobs.move_to_end(path)
+                    return job
+
+            job = self.jobs[path] = ExportJob(path)
+            self.pool.submit(
+                self._run,
+                job,
+                routes,
+                image_folder,
+                sector,
+                block,
+                grade,
+                unique_pages,
+            )
+            return job
+
+    def get(self, path):
+        with self.lock:
+            return self.jobs.get(path)
+
+    def _run(self, job, routes, image_folder, sector, block, grade, unique_pages):
+        job.status = "running"
+        try:
+            os.makedirs(os.path.dirname(job.path), exist_ok=True)
+            export_to_pdf(
+                routes,
+                image_folder,
+                os.path.dirname(job.path),
+                sector,
+                block,
+                grade,
+                unique_pages=unique_pages,
+                progress=job.update,
+            )
+            job.size = os.path.getsize(job.path)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+            print(f"Error exporting {job.path}: {e}")
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used finished PDFs above max_bytes."""
+        total = sum(job.size for job in self.jobs.values())
+        # The most recently used PDF is always kept, even when it is too big
+        for path, job in list(self.jobs.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            if job.status != "done":
+                continue
+            del self.jobs[path]
+            total -= job.size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
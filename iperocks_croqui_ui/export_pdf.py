@@ -1,26 +1,70 @@
+import io
 import os
+import threading
+import zlib
 
 from fpdf import FPDF
 from PIL import Image
 
+from iperocks_croqui_ui.page_pack import INDEX_FILE, PagePack, page_image_name
+
 
 def sanitize_filename(text):
     """Sanitize text for use in filenames."""
     return text.replace(" ", "_").replace("/", "_").replace("\\", "_")
 
 
-def generate_filename(sector, block, grade):
+def generate_filename(sector, block, grade, unique_pages=False):
     """Generate a filename based on selected filters."""
     sector = sanitize_filename(sector) if sector else "All"
     block = sanitize_filename(block) if block else "All"
     grade = sanitize_filename(grade) if grade else "All"
-    return f"routes_{sector}_{block}_{grade}.pdf"
+    suffix = "_pages" if unique_pages else ""
+    return f"routes_{sector}_{block}_{grade}{suffix}.pdf"
+
+
+class StreamBuffer:
+    """
+    Stands in for FPDF's in-memory document buffer. Text FPDF appends to it
+    is written to a binary file as latin-1, like output() would, and len()
+    is the number of bytes written, which FPDF uses for the xref offsets.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+
+    def __iadd__(self, text):
+        self.write(text.encode("latin-1"))
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
 
 
 class CustomPDF(FPDF):
-    def __init__(self, page_format):
+    """
+    FPDF writer that streams the document to a binary file.
+
+    FPDF keeps every page and image in memory and writes them all on
+    output(), appending to one string. Here each page is written as soon as
+    it is finished, after the images it uses, and then freed; close() only
+    adds the page tree, fonts, resources and xref. Memory stays flat with
+    the number of pages and the first bytes are out after the first page.
+    """
+
+    def __init__(self, page_format, file):
         super().__init__()
         self.page_format = page_format
+        self.buffer = StreamBuffer(file)
+        self.page_objects = []
+        # Images added since the last page was written
+        self.pending_images = []
+        FPDF._putheader(self)
 
     def add_page(self):
         super().add_page(orientation="L")  # Landscape orientation
@@ -31,94 +75,364 @@ class CustomPDF(FPDF):
         self.l_margin = self.r_margin = 10
         self.t_margin = self.b_margin = 10
 
+    def add_jpeg(self, name, data, width, height):
+        """
+        Register in-memory JPEG bytes as the image `name`, so pdf.image(name)
+        embeds them without FPDF reading a file from disk. The bytes are
+        written and dropped when the page is finished.
+        """
+        if name not in self.images:
+            self.images[name] = {
+                "w": width,
+                "h": height,
+                "cs": "DeviceRGB",
+                "bpc": 8,
+                "f": "DCTDecode",
+                "data": data,
+                "i": len(self.images) + 1,
+            }
+            self.pending_images.append(self.images[name])
+        return self.images[name]
+
+    def end_page(self):
+        """Write the current page now instead of on the next add_page()."""
+        self._endpage()
+
+    def _endpage(self):
+        super()._endpage()
+        if len(self.page_objects) == self.page:
+            return
+        self._putimages()
+        self._putpage(self.page)
+
+    def _putpage(self, n):
+        """Write page n and its content stream, then free its content."""
+        if self.def_orientation == "P":
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        self._newobj()
+        self.page_objects.append(self.n)
+        self._out("<</Type /Page")
+        self._out("/Parent 1 0 R")
+        if n in self.orientation_changes:
+            self._out(f"/MediaBox [0 0 {h_pt:.2f} {w_pt:.2f}]")
+        self._out("/Resources 2 0 R")
+        if self.pdf_version > "1.3":
+            self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+        self._out(f"/Contents {self.n + 1} 0 R>>")
+        self._out("endobj")
+
+        content = self.pages[n].encode("latin-1")
+        self.pages[n] = ""
+        if self.compress:
+            content = zlib.compress(content)
+        self._newobj()
+        flate = "/Filter /FlateDecode " if self.compress else ""
+        self._out(f"<<{flate}/Length {len(content)}>>")
+        self._putstream(content)
+        self._out("endobj")
+
+    def _putpages(self):
+        # The pages were written as they were finished, only their tree is left
+        if self.def_orientation == "P":
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        self.offsets[1] = len(self.buffer)
+        self._out("1 0 obj")
+        self._out("<</Type /Pages")
+        self._out("/Kids [" + "".join(f"{n} 0 R " for n in self.page_objects) + "]")
+        self._out(f"/Count {len(self.page_objects)}")
+        self._out(f"/MediaBox [0 0 {w_pt:.2f} {h_pt:.2f}]")
+        self._out(">>")
+        self._out("endobj")
+
+    def _putimages(self):
+        # Only the images added since the last page, the others were written
+        for info in self.pending_images:
+            self._putimage(info)
+            del info["data"]
+        self.pending_images = []
+
+    def _putheader(self):
+        # Written when the document is created, before the first page
+        pass
+
+    def _putstream(self, data):
+        # Image and content bytes go to the file as they are
+        self._out("stream")
+        self.buffer.write(data.encode("latin-1") if isinstance(data, str) else data)
+        self.buffer.write(b"\n")
+        self._out("endstream")
+
+
+def encode_jpeg(img, quality=95):
+    """Encode a PIL image as JPEG bytes in memory."""
+    # Ensure the image is in RGB mode
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), img.size
+
+
+def get_export_jpeg(image_path, cache_folder):
+    """
+    Return (jpeg_bytes, (width, height)) for a page PNG.
+
+    The JPEG is kept in cache_folder and re-encoded only when the PNG is
+    newer than the cached copy, so each page is encoded once across exports.
+    """
+    cache_path = os.path.join(
+        cache_folder, os.path.splitext(os.path.basename(image_path))[0] + ".jpg"
+    )
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(
+        image_path
+    ):
+        with open(cache_path, "rb") as file:
+            data = file.read()
+        # Only the JPEG header is parsed here
+        with Image.open(io.BytesIO(data)) as img:
+            return data, img.size
+
+    with Image.open(image_path) as img:
+        data, size = encode_jpeg(img)
+    os.makedirs(cache_folder, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, cache_path)
+    return data, size
+
+
+def get_packed_jpeg(pack, page_number):
+    """
+    Return (jpeg_bytes, (width, height)) for a packed page PNG, or None.
+
+    The JPEG is appended to the pack next to the PNG it was encoded from,
+    and encoded again only when that PNG was replaced. Both are read as
+    copies, so a long export does not keep the whole pack resident.
+    """
+    png = pack.entry(page_image_name(page_number))
+    if png is None:
+        return None
+    jpeg_name = f"export/page_{page_number}.jpg"
+    jpeg = pack.entry(jpeg_name)
+    if jpeg is None or jpeg.get("png_offset") != png["offset"]:
+        with Image.open(io.BytesIO(pack.read(page_image_name(page_number)))) as img:
+            data, (width, height) = encode_jpeg(img)
+        jpeg = pack.append(
+            jpeg_name, data, png_offset=png["offset"], width=width, height=height
+        )
+    return pack.read(jpeg_name), (jpeg["width"], jpeg["height"])
+
+
+def page_key(route):
+    """(guidebook, page number) identifying the page image of a route."""
+    return route.get("source") or "", route.get("page_number")
+
+
+def group_routes_by_page(filtered_routes):
+    """Map each page to its routes, in order of first appearance."""
+    pages = {}
+    for route in filtered_routes:
+        if route.get("page_number") is not None:
+            pages.setdefault(page_key(route), []).append(route)
+    return pages
+
+
+def route_caption(routes):
+    caption = "   ".join(
+        f"{route.get('id_number', '')}. {route.get('name', '')} ({route.get('grade', '')})"
+        for route in routes
+    )
+    # The core PDF fonts only cover latin-1
+    return caption.encode("latin-1", "replace").decode("latin-1")
+
+
+def write_pdf(
+    file, filtered_routes, image_folder, unique_pages=False, cache_folder=None
+):
+    """
+    Write the export PDF of filtered_routes to a binary file, one page at a
+    time. A generator, it yields (done, total) after each page is written.
+    See export_to_pdf for the parameters.
+    """
+    # PowerPoint slide dimensions in mm (landscape)
+    slide_width_mm = 254
+    slide_height_mm = 191
+    # Room left under the image for the route list
+    caption_height_mm = 12 if unique_pages else 0
+
+    # Page size in pixels at 96 DPI
+    slide_width_px = int(slide_width_mm / 25.4 * 96)
+    slide_height_px = int((slide_height_mm - caption_height_mm) / 25.4 * 96)
+
+    pdf = CustomPDF((slide_width_mm, slide_height_mm), file)
+
+    if unique_pages:
+        pages = list(group_routes_by_page(filtered_routes).items())
+    else:
+        pages = [
+            (page_key(route), [route])
+            for route in filtered_routes
+            if route.get("page_number") is not None
+        ]
+
+    # Image pack of each guidebook folder, None for folders of loose files
+    packs = {}
+
+    for done, ((source, page_number), page_routes) in enumerate(pages, 1):
+        # Construct the image filename
+        image_filename = f"page_{page_number}.png"  # Adjust this pattern if needed
+        page_folder = os.path.join(image_folder, source)
+        image_path = os.path.join(page_folder, image_filename)
+        if page_folder not in packs:
+            packs[page_folder] = (
+                PagePack(page_folder)
+                if os.path.exists(os.path.join(page_folder, INDEX_FILE))
+                else None
+            )
+        pack = packs[page_folder]
+
+        # Check if the image file exists
+        if (pack is not None and image_filename in pack) or os.path.exists(image_path):
+            try:
+                # Each page is embedded once, repeated pages reuse the image
+                image_name = f"{source}/page_{page_number}"
+                info = pdf.images.get(image_name)
+                if info is None:
+                    jpeg = get_packed_jpeg(pack, page_number) if pack else None
+                    if jpeg is None:
+                        jpeg = get_export_jpeg(
+                            image_path,
+                            cache_folder or os.path.join(page_folder, ".export_cache"),
+                        )
+                    data, (width, height) = jpeg
+                    info = pdf.add_jpeg(image_name, data, width, height)
+
+                # Get image size (width and height)
+                width, height = info["w"], info["h"]
+
+                # Calculate scaling to fit image into PDF page size
+                scale_width = slide_width_px / width
+                scale_height = slide_height_px / height
+                scale = min(scale_width, scale_height)
+
+                # New dimensions for the image
+                new_width = width * scale
+                new_height = height * scale
+
+                # Add a page to the PDF
+                pdf.add_page()
+
+                # Center image on page
+                x_offset = (
+                    slide_width_mm - (new_width / 96 * 25.4)
+                ) / 2  # Convert pixels to mm
+                y_offset = (
+                    slide_height_mm - caption_height_mm - (new_height / 96 * 25.4)
+                ) / 2  # Convert pixels to mm
+
+                # Add the image to the PDF
+                pdf.image(
+                    image_name,
+                    x=x_offset,
+                    y=y_offset,
+                    w=new_width / 96 * 25.4,
+                    h=new_height / 96 * 25.4,
+                )
+
+                if unique_pages:
+                    # List the routes found on this page under the image
+                    pdf.set_font("Helvetica", size=9)
+                    pdf.set_xy(pdf.l_margin, slide_height_mm - caption_height_mm)
+                    pdf.multi_cell(
+                        slide_width_mm - pdf.l_margin - pdf.r_margin,
+                        4,
+                        route_caption(page_routes),
+                    )
+
+            except Exception as e:
+                print(f"Error processing image {image_filename}: {e}")
+
+        # Written out now, so the file grows page by page
+        pdf.end_page()
+        yield done, len(pages)
+
+    # Page tree, fonts, resources and xref
+    pdf.close()
+
 
 def export_to_pdf(
-    filtered_routes, image_folder, output_directory, sector=None, block=None, grade=None
+    filtered_routes,
+    image_folder,
+    output_directory,
+    sector=None,
+    block=None,
+    grade=None,
+    unique_pages=False,
+    cache_folder=None,
+    progress=None,
 ):
     """
     Export a PDF composed of images corresponding to the filtered routes.
 
     Parameters:
     - filtered_routes (list): List of filtered route dictionaries.
-    - image_folder (str): Directory containing the route images.
+    - image_folder (str): Directory containing the route images. Routes
+      tagged with a "source" guidebook use its subfolder of image_folder.
     - output_directory (str): Directory to save the output PDF.
     - sector (str, optional): Selected sector for filtering.
     - block (str, optional): Selected block for filtering.
     - grade (str, optional): Selected grade for filtering.
+    - unique_pages (bool): Embed each page once, listing the routes on it,
+      instead of one PDF page per route.
+    - cache_folder (str, optional): Folder of the encoded page cache, by
+      default ".export_cache" inside each folder of page images. Folders
+      with a PagePack read their images and keep the JPEGs in it instead.
+    - progress (callable, optional): Called as progress(done, total) after
+      each page.
     """
     # Generate the output PDF filename based on filters
-    output_pdf_filename = generate_filename(sector, block, grade)
+    output_pdf_filename = generate_filename(sector, block, grade, unique_pages)
     output_pdf_path = os.path.join(output_directory, output_pdf_filename)
 
-    # PowerPoint slide dimensions in mm (landscape)
-    slide_width_mm = 254
-    slide_height_mm = 191
-
-    # Page size in pixels at 96 DPI
-    slide_width_px = int(slide_width_mm / 25.4 * 96)
-    slide_height_px = int(slide_height_mm / 25.4 * 96)
-
-    pdf = CustomPDF(page_format=(slide_width_mm, slide_height_mm))
+    # Written next to the PDF and renamed once complete
+    temp_path = f"{output_pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            for done, total in write_pdf(
+                file, filtered_routes, image_folder, unique_pages, cache_folder
+            ):
+                if progress is not None:
+                    progress(done, total)
+        os.replace(temp_path, output_pdf_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return output_pdf_path
 
-    for route in filtered_routes:
-        # Get the page number from the route
-        page_number = route.get("page_number")
-        if page_number is not None:
-            # Construct the image filename
-            image_filename = f"page_{page_number}.png"  # Adjust this pattern if needed
-            image_path = os.path.join(image_folder, image_filename)
-
-            # Check if the image file exists
-            if os.path.exists(image_path):
-                try:
-                    # Open the image using PIL
-                    with Image.open(image_path) as img:
-                        # Ensure the image is in RGB mode
-                        if img.mode != "RGB":
-                            img = img.convert("RGB")
-
-                        # Save the image to a temporary file in JPEG format (required by FPDF)
-                        temp_image_path = f"temp_page_{page_number}.jpg"
-                        img.save(temp_image_path, quality=95)  # Save with high quality
-
-                        # Get image size (width and height)
-                        width, height = img.size
-
-                        # Calculate scaling to fit image into PDF page size
-                        scale_width = slide_width_px / width
-                        scale_height = slide_height_px / height
-                        scale = min(scale_width, scale_height)
-
-                        # New dimensions for the image
-                        new_width = width * scale
-                        new_height = height * scale
-
-                        # Add a page to the PDF
-                        pdf.add_page()
-
-                        # Center image on page
-                        x_offset = (
-                            slide_width_mm - (new_width / 96 * 25.4)
-                        ) / 2  # Convert pixels to mm
-                        y_offset = (
-                            slide_height_mm - (new_height / 96 * 25.4)
-                        ) / 2  # Convert pixels to mm
-
-                        # Add the image to the PDF
-                        pdf.image(
-                            temp_image_path,
-                            x=x_offset,
-                            y=y_offset,
-                            w=new_width / 96 * 25.4,
-                            h=new_height / 96 * 25.4,
-                        )
 
-                        # Remove the temporary image file
-                        os.remove(temp_image_path)
+def stream_pdf(filtered_routes, image_folder, unique_pages=False, cache_folder=None):
+    """
+    Yield the export PDF in chunks of bytes as its pages are written, e.g.
+    for a chunked HTTP response, without writing the PDF to disk. Only one
+    page is held in memory at a time.
+    """
+    buffer = io.BytesIO()
 
-                except Exception as e:
-                    print(f"Error processing image {image_filename}: {e}")
+    def take():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
 
-    # Output the PDF
-    pdf.output(output_pdf_path)
-    return output_pdf_path
+    for _ in write_pdf(
+        buffer, filtered_routes, image_folder, unique_pages, cache_folder
+    ):
+        chunk = take()
+        if chunk:
+            yield chunk
+    yield take()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import re
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+# Lines such as "@ Mal Criado — V4" or "6 Sem Educagdo - V5"
+ROUTE_LINE = re.compile(r"^\W*(\d+)?\s*(.+?)\s+[-—–]\s+(V\d+(?:/\d+)?)\s*$")
+PAGE_NUMBER = re.compile(r"page number:\s*(\d+)")
+PAGE_CONTENT = re.compile(r"Page content:\s*(.*?)\s*page number:", re.DOTALL)
+REPAIR_FIELDS = re.compile(r"invalid or missing fields: (.*?)\. Read")
+
+
+def fake_page_response(page_content, page_number):
+    """
+    Build a CroquiPage-shaped dict from the page text with simple heuristics.
+
+    It only recognizes "name - grade" lines, which is enough to exercise the
+    pipeline without calling a real model.
+    """
+    sector = ""
+    block = "Bloco"
+    routes = []
+    for line in page_content.splitlines():
+        line = line.strip()
+        if line.upper().startswith("SETOR"):
+            sector = line.title()
+        elif line.lower().startswith("bloco"):
+            block = line[len("bloco") :].strip() or block
+        else:
+            match = ROUTE_LINE.match(line)
+            if match:
+                id_number, name, grade = match.groups()
+                routes.append(
+                    {
+                        "id_number": int(id_number) if id_number else len(routes) + 1,
+                        "name": name,
+                        "grade": grade,
+                        "description": "",
+                        "page_number": page_number,
+                        "block": block,
+                        "sector": sector,
+                    }
+                )
+    return {"page_message": "", "routes": routes}
+
+
+def fake_repair_response(fields, page_number):
+    """Placeholder values for the fields a repair prompt asks for."""
+    defaults = {"id_number": 0, "page_number": page_number}
+    return {field: defaults.get(field, "") for field in fields}
+
+
+def _respond(prompt_value):
+    text = prompt_value.to_string()
+    page_number = int(PAGE_NUMBER.search(text).group(1))
+    repair = REPAIR_FIELDS.search(text)
+    if repair:
+        fields = [field.strip() for field in repair.group(1).split(",")]
+        response = fake_repair_response(fields, page_number)
+        return AIMessage(content=json.dumps(response))
+    content = PAGE_CONTENT.search(text)
+    response = fake_page_response(content.group(1) if content else "", page_number)
+    return AIMessage(content=json.dumps(response))
+
+
+def build_fake_llm(latency=0.0):
+    """
+    Offline stand-in for ChatOpenAI, used for tests and benchmarks.
+
+    latency (seconds) simulates the network round trip of a real model.
+    """
+
+    def invoke(prompt_value):
+        if latency:
+            time.sleep(latency)
+        return _respond(prompt_value)
+
+    async def ainvoke(prompt_value):
+        if latency:
+            await asyncio.sleep(latency)
+        return _respond(prompt_value)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
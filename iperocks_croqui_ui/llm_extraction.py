@@ -0,0 +1,411 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.pydantic_v1 import ValidationError
+
+from iperocks_croqui_ui.artifact_cache import llm_cache_key
+from iperocks_croqui_ui.metrics import PageMetrics
+
+
+def read_page_json(json_path):
+    """Read a page JSON, None when it is missing or not a CroquiPage shape."""
+    try:
+        with open(json_path, "r", encoding="utf-8") as json_file:
+            data = json.load(json_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("routes", []), list):
+        return None
+    return data
+
+
+def write_page_json(json_path, response, key=None):
+    """
+    Save a page response, along with the llm_cache_key of its inputs so a
+    later run can tell whether the page is still up to date.
+    """
+    if key is not None:
+        response = {**response, "llm_key": key}
+    # Written atomically, the consolidator may read pages during extraction
+    temp_path = f"{json_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as json_file:
+        json.dump(response, json_file, indent=4)
+    os.replace(temp_path, json_path)
+
+
+def load_known_page(cache, key, json_path, page_metrics):
+    """
+    Check whether the result of a page is already known. A cache hit is
+    written to json_path; on a cache miss an existing page JSON is kept, and
+    added to the cache, only when it was extracted with the same key, that
+    is from the same text with the same prompt, model and schema.
+    """
+    if cache is not None:
+        data = cache.get_text(key)
+        if data is not None:
+            page_metrics.count("llm_cache_hits")
+            write_page_json(json_path, json.loads(data), key)
+            return True
+    page = read_page_json(json_path)
+    if page is not None and page.get("llm_key") == key:
+        page_metrics.count("llm_skipped")
+        if cache is not None:
+            del page["llm_key"]
+            cache.put_text(key, json.dumps(page))
+        return True
+    if cache is not None:
+        page_metrics.count("llm_cache_misses")
+    return False
+
+
+def validate_route(route, route_schema, page_number):
+    """
+    Validate a route dict against the pydantic route_schema.
+
+    A missing page number is filled in from the page being extracted.
+    Returns (route, invalid_fields); the route is the validated dict when
+    invalid_fields is empty.
+    """
+    if not isinstance(route, dict):
+        return {}, ["route"]
+    if route_schema is None:
+        return route, []
+    route = dict(route)
+    if route.get("page_number") is None:
+        route["page_number"] = page_number
+    try:
+        return route_schema(**route).dict(), []
+    except ValidationError as e:
+        return route, sorted({str(error["loc"][0]) for error in e.errors()})
+
+
+class PageAssembler:
+    """
+    Builds a validated page from the partial objects a JSON output parser
+    streams.
+
+    Every route but the last one of a partial object is complete, so each
+    route is validated, and passed to on_route(page_number, route), as soon
+    as the next one starts. Routes failing validation wait in `invalid` as
+    (position, route, invalid_fields); the saved page keeps the routes in
+    the order of the response.
+    """
+
+    def __init__(self, page_number, route_schema=None, on_route=None):
+        self.page_number = page_number
+        self.route_schema = route_schema
+        self.on_route = on_route
+        self.page = None
+        self.routes = []
+        self.invalid = []
+        self.seen = 0
+
+    def feed(self, partial):
+        if not isinstance(partial, dict):
+            return
+        self.page = partial
+        routes = partial.get("routes")
+        if isinstance(routes, list):
+            self._accept(routes[:-1])
+
+    def finish(self):
+        """Validate the last route, once the response is complete."""
+        if self.page is None:
+            raise OutputParserException("The response contains no JSON object")
+        routes = self.page.get("routes")
+        self._accept(routes if isinstance(routes, list) else [])
+
+    def add(self, position, route):
+        self.routes.append((position, route))
+        if self.on_route is not None:
+            self.on_route(self.page_number, route)
+
+    def check(self, position, route):
+        route, fields = validate_route(route, self.route_schema, self.page_number)
+        if fields:
+            self.invalid.append((position, route, fields))
+        else:
+            self.add(position, route)
+        return not fields
+
+    def _accept(self, routes):
+        for route in routes[self.seen :]:
+            self.check(self.seen, route)
+            self.seen += 1
+
+    def result(self):
+        """The page dict to save; routes still invalid are kept apart."""
+        message = self.page.get("page_message")
+        page = {
+            "page_message": message if isinstance(message, str) else "",
+            "routes": [route for _, route in sorted(self.routes, key=lambda r: r[0])],
+        }
+        if self.invalid:
+            page["invalid_routes"] = [
+                {"route": route, "fields": fields} for _, route, fields in self.invalid
+            ]
+        return page
+
+
+def repair_inputs(text, page_number, route, fields):
+    return {
+        "page_content": text,
+        "page_number": page_number,
+        "route": json.dumps(route, ensure_ascii=False),
+        "fields": ", ".join(fields),
+    }
+
+
+def apply_repair(assembler, position, route, fields, response):
+    """Merge the re-prompted fields into the route and validate it again."""
+    if isinstance(response, dict):
+        route = {**route, **{f: response[f] for f in fields if f in response}}
+    return assembler.check(position, route)
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` requests per second, bursting to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def acall_with_retry(call, max_retries=5, base_delay=1.0, on_retry=None):
+    """
+    Await call(), retrying transient failures with exponential backoff.
+
+    Parser errors mean the page has no usable content and are not retried.
+    on_retry, when given, is called with the exception before each retry.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except OutputParserException:
+            raise
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            delay = base_delay * 2**attempt
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+
+async def ainvoke_with_retry(
+    chain, inputs, max_retries=5, base_delay=1.0, config=None, on_retry=None
+):
+    """Call chain.ainvoke with the retries of acall_with_retry."""
+    return await acall_with_retry(
+        lambda: chain.ainvoke(inputs, config=config), max_retries, base_delay, on_retry
+    )
+
+
+async def astream_page(chain, inputs, assembler, config=None):
+    """Feed the streamed partial responses of chain to the assembler."""
+    async for partial in chain.astream(inputs, config=config):
+        assembler.feed(partial)
+    assembler.finish()
+    return assembler
+
+
+class ExtractionStage:
+    """
+    Concurrent, rate-limited LLM extraction of page JSON files.
+
+    Parameters:
+    - chain: Runnable taking {"page_content", "page_number"} and returning a
+      dict, or None to build it with get_chains.
+    - concurrency (int): Maximum number of requests in flight.
+    - requests_per_second (float, optional): Rate limit for the requests.
+    - max_retries (int): Retries per page for transient errors.
+    - base_delay (float): First backoff delay in seconds.
+    - cache (ArtifactCache, optional): Reuse responses keyed by the page text
+      and llm_config. Without a hit, an existing page JSON is only reused
+      when it was saved under the same key.
+    - llm_config (str): Hash of the prompt, model and schema.
+    - route_schema (optional): Pydantic model each streamed route is
+      validated against as soon as it is complete.
+    - repair_chain (optional): Runnable taking the repair_inputs of an
+      invalid route and returning only its corrected fields.
+    - on_route (callable, optional): Called as on_route(page_number, route)
+      for every valid route while the response streams in. Routes of a
+      stream that fails and is retried may be passed again.
+    - get_chains (callable, optional): Returns (chain, repair_chain), called
+      for the first page that is not already extracted when chain is None.
+
+    Failed pages are collected in `errors`, keyed by page number.
+    """
+
+    def __init__(
+        self,
+        chain,
+        concurrency=4,
+        requests_per_second=None,
+        max_retries=5,
+        base_delay=1.0,
+        cache=None,
+        llm_config="",
+        route_schema=None,
+        repair_chain=None,
+        on_route=None,
+        get_chains=None,
+    ):
+        self.chain = chain
+        self.get_chains = get_chains
+        self.cache = cache
+        self.llm_config = llm_config
+        self.route_schema = route_schema
+        self.repair_chain = repair_chain
+        self.on_route = on_route
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.errors = {}
+
+    async def extract(self, page_number, text, json_path, page_metrics=None):
+        """
+        Extract a single page, skipping it when its result is already known.
+
+        The response is streamed and validated route by route; invalid
+        fields are then re-prompted on their own. Queueing and request time,
+        time to the first valid route, retries, repairs, cache hits and token
+        usage are added to page_metrics. Returns the exception of a failed
+        page, None otherwise.
+        """
+        page_metrics = page_metrics if page_metrics is not None else PageMetrics()
+        key = llm_cache_key(text, page_number, self.llm_config)
+        if load_known_page(self.cache, key, json_path, page_metrics):
+            return
+        if self.chain is None:
+            self.chain, self.repair_chain = self.get_chains()
+        # Imported here, langchain's callback module is slow to import
+        from iperocks_croqui_ui.token_usage import TokenUsage
+
+        usage = TokenUsage()
+        config = {"callbacks": [usage]}
+        queued = started = time.perf_counter()
+        first_route = []
+
+        def on_route(page_number, route):
+            if not first_route:
+                first_route.append(time.perf_counter() - started)
+            if self.on_route is not None:
+                self.on_route(page_number, route)
+
+        def stream():
+            assembler = PageAssembler(page_number, self.route_schema, on_route)
+            inputs = {"page_content": text, "page_number": page_number}
+            return astream_page(self.chain, inputs, assembler, config)
+
+        try:
+            # The slot is released once the page is streamed, each repair
+            # then queues for a slot of its own
+            async with self.semaphore:
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                started = time.perf_counter()
+                page_metrics.add("llm-queue", wall=started - queued)
+                assembler = await acall_with_retry(
+                    stream,
+                    max_retries=self.max_retries,
+                    base_delay=self.base_delay,
+                    on_retry=lambda e: page_metrics.count("llm_retries"),
+                )
+            if assembler.invalid:
+                page_metrics.count("invalid_routes", len(assembler.invalid))
+                if self.repair_chain is not None:
+                    repaired = await self.repair(text, assembler, config)
+                    page_metrics.count("repaired_routes", repaired)
+        except OutputParserException:
+            print(f"Page {page_number} doesn't contain expected information, skipping.")
+            return
+        except Exception as e:
+            self.errors[page_number] = e
+            print(f"Error extracting routes from page {page_number}: {e}")
+            return e
+        finally:
+            page_metrics.add("llm", wall=time.perf_counter() - started)
+            if first_route:
+                page_metrics.add("llm-first-route", wall=first_route[0])
+            usage.record(page_metrics)
+
+        response = assembler.result()
+        write_page_json(json_path, response, key)
+        page_metrics.wrote("json", json_path)
+        if self.cache is not None:
+            self.cache.put_text(key, json.dumps(response))
+
+    async def repair(self, text, assembler, config=None):
+        """
+        Re-prompt only the invalid fields of the assembler's invalid routes.
+        Each repair request takes its own semaphore slot; a route whose
+        repair fails stays invalid. Returns the number of routes repaired.
+        """
+        invalid, assembler.invalid = assembler.invalid, []
+
+        async def repair_route(route, fields):
+            inputs = repair_inputs(text, assembler.page_number, route, fields)
+            async with self.semaphore:
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                try:
+                    return await ainvoke_with_retry(
+                        self.repair_chain,
+                        inputs,
+                        max_retries=self.max_retries,
+                        base_delay=self.base_delay,
+                        config=config,
+                    )
+                except OutputParserException:
+                    return None
+                except Exception as e:
+                    print(
+                        f"Error repairing a route of page {assembler.page_number}: {e}"
+                    )
+                    return None
+
+        responses = await asyncio.gather(
+            *(repair_route(route, fields) for _, route, fields in invalid)
+        )
+        return sum(
+            apply_repair(assembler, *entry, response)
+            for entry, response in zip(invalid, responses)
+        )
+
+
+async def aextract_pages(chain, pages, **kwargs):
+    """
+    Run the extraction chain over (page_number, text, json_path) tuples.
+
+    Keyword arguments are passed to ExtractionStage. Returns the errors dict.
+    """
+    stage = ExtractionStage(chain, **kwargs)
+    await asyncio.gather(*(stage.extract(*page) for page in pages))
+    return stage.errors
+
+
+def extract_pages(chain, pages, **kwargs):
+    """Synchronous wrapper around aextract_pages."""
+    return asyncio.run(aextract_pages(chain, pages, **kwargs))
@@ -0,0 +1,160 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# USD per million (input, output) tokens, for the cost estimate
+MODEL_PRICES = {"gpt-4o-mini": (0.15, 0.60)}
+
+
+class PageMetrics:
+    """
+    Wall and CPU time, bytes written and counters of the stages run for one
+    page. It is picklable, so pool workers return it with their results.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name, wall=0.0, cpu=0.0, calls=1, nbytes=0):
+        stage = self.stages.setdefault(
+            name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0}
+        )
+        stage["calls"] += calls
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["bytes"] += nbytes
+
+    def wrote(self, name, path):
+        """Count the size of a file written by a stage."""
+        self.add(name, calls=0, nbytes=os.path.getsize(path))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        for name, stage in other.stages.items():
+            self.add(name, stage["wall"], stage["cpu"], stage["calls"], stage["bytes"])
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+    def to_dict(self):
+        return {"stages": self.stages, "counters": self.counters}
+
+
+class RunMetrics:
+    """
+    Collects the PageMetrics of an ingest run.
+
+    Every page is appended to metrics_file as one JSON line, followed by a
+    summary line when the run is closed, so runs can be compared over time.
+    CPU time of stages run in pool workers is the CPU time of the worker.
+    """
+
+    def __init__(self, metrics_file=None, model_name=None):
+        self.metrics_file = metrics_file
+        self.model_name = model_name
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.started = time.perf_counter()
+        self.totals = PageMetrics()
+        self.pages = 0
+        self.errors = 0
+        self.text_sources = {}
+        self.file = None
+        if metrics_file:
+            os.makedirs(os.path.dirname(metrics_file) or ".", exist_ok=True)
+            self.file = open(metrics_file, "a", encoding="utf-8")
+
+    def _emit(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps({"run": self.run_id, **record}) + "\n")
+            self.file.flush()
+
+    def record_page(
+        self, document, page_number, page_metrics, text_source=None, error=None
+    ):
+        self.pages += 1
+        self.errors += error is not None
+        if text_source is not None:
+            self.text_sources[text_source] = self.text_sources.get(text_source, 0) + 1
+        self.totals.merge(page_metrics)
+        self._emit(
+            {
+                "type": "page",
+                "document": document,
+                "page": page_number,
+                "text_source": text_source,
+                "error": None if error is None else str(error),
+                **page_metrics.to_dict(),
+            }
+        )
+
+    @contextmanager
+    def stage(self, name):
+        """Time a run-level stage that is not tied to a single page."""
+        with self.totals.stage(name):
+            yield
+
+    def cost(self):
+        """Estimated LLM cost in USD, None for models without a known price."""
+        prices = MODEL_PRICES.get(self.model_name)
+        if prices is None:
+            return None
+        counters = self.totals.counters
+        return (
+            counters.get("input_tokens", 0) * prices[0]
+            + counters.get("output_tokens", 0) * prices[1]
+        ) / 1e6
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        return {
+            "pages": self.pages,
+            "errors": self.errors,
+            "wall": wall,
+            "pages_per_second": self.pages / wall if wall else 0.0,
+            "text_sources": self.text_sources,
+            "model": self.model_name,
+            "cost_usd": self.cost(),
+            **self.totals.to_dict(),
+        }
+
+    def report(self):
+        summary = self.summary()
+        lines = [
+            f"{summary['pages']} pages in {summary['wall']:.1f} s "
+            f"({summary['pages_per_second']:.2f} pages/s), "
+            f"{summary['errors']} error(s)",
+            f"{'stage':<12}{'calls':>7}{'wall s':>10}{'cpu s':>10}"
+            f"{'ms/call':>10}{'MB':>9}",
+        ]
+        stages = sorted(summary["stages"].items(), key=lambda item: -item[1]["wall"])
+        for name, stage in stages:
+            per_call = stage["wall"] / stage["calls"] * 1000 if stage["calls"] else 0
+            lines.append(
+                f"{name:<12}{stage['calls']:>7}{stage['wall']:>10.2f}"
+                f"{stage['cpu']:>10.2f}{per_call:>10.1f}{stage['bytes'] / 1e6:>9.2f}"
+            )
+        counters = summary["counters"]
+        if counters:
+            lines.append(", ".join(f"{k}: {v}" for k, v in sorted(counters.items())))
+        if summary["cost_usd"] is not None:
+            lines.append(
+                f"Estimated LLM cost: ${summary['cost_usd']:.4f} ({self.model_name})"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        self._emit({"type": "summary", **self.summary()})
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,239 @@
+import argparse
+import json
+import mmap
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within a process
+    fcntl = None
+
+from iperocks_croqui_ui.renditions import RENDITION_FOLDER
+
+PACK_FILE = "pages.pack"
+INDEX_FILE = "pages.idx"
+
+
+class PagePack:
+    """
+    Append-only pack of the page images of one guidebook folder.
+
+    Images are appended to `pages.pack` and every append adds a JSON line
+    {"name", "offset", "size", ...} to `pages.idx`; the last line for a name
+    wins, so an image is replaced by appending it again. Readers map the
+    pack with mmap and get() hands out memoryview slices of it, so fetching
+    an image costs no file open or stat. refresh() picks up images appended
+    since by reading only the new index lines.
+
+    Appends are serialized with a lock on the pack file, so the converter
+    and the exporter can add images while the app is reading.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.pack_path = os.path.join(folder, PACK_FILE)
+        self.index_path = os.path.join(folder, INDEX_FILE)
+        self.lock = threading.Lock()
+        # (entries, mapped pack) swapped as a whole, readers never lock
+        self.state = ({}, None)
+        self.index_inode = None
+        self.index_read = 0
+        self.refresh()
+
+    def __contains__(self, name):
+        return name in self.state[0]
+
+    def __len__(self):
+        return len(self.state[0])
+
+    def names(self):
+        return list(self.state[0])
+
+    def entry(self, name):
+        """Index record of an image: offset, size and what it was made from."""
+        return self.state[0].get(name)
+
+    def get(self, name):
+        """Zero-copy view of the bytes of an image, None if it is not packed."""
+        entries, mapped = self.state
+        entry = entries.get(name)
+        if entry is None or mapped is None:
+            return None
+        return memoryview(mapped)[entry["offset"] : entry["offset"] + entry["size"]]
+
+    def read(self, name):
+        """
+        Copy of the bytes of an image read from the pack file, None if it is
+        not packed. Unlike get() it leaves no pages of the pack mapped, for
+        long passes over many images such as exports.
+        """
+        entry = self.state[0].get(name)
+        if entry is None:
+            return None
+        with open(self.pack_path, "rb") as file:
+            file.seek(entry["offset"])
+            return file.read(entry["size"])
+
+    def refresh(self):
+        """Read index lines appended since the last call and remap the pack."""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino == self.index_inode and stat.st_size == self.index_read:
+            return
+
+        with self.lock:
+            entries, mapped = self.state
+            if stat.st_ino != self.index_inode or stat.st_size < self.index_read:
+                # Written anew by compact(), read and map from the start
+                entries, mapped, self.index_read = {}, None, 0
+            else:
+                entries = dict(entries)
+
+            with open(self.index_path, "rb") as file:
+                file.seek(self.index_read)
+                data = file.read()
+            # A line still being appended is read on the next refresh
+            complete = data[: data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                entry = json.loads(line)
+                entries[entry.pop("name")] = entry
+            self.index_read += len(complete)
+            self.index_inode = stat.st_ino
+
+            end = max((e["offset"] + e["size"] for e in entries.values()), default=0)
+            # An empty pack cannot be mapped, and has nothing to read
+            if end and (mapped is None or len(mapped) < end):
+                # Views handed out keep the previous mapping alive
+                with open(self.pack_path, "rb") as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.state = (entries, mapped)
+
+    def append(self, name, data, **info):
+        """
+        Append the bytes of an image under name, with extra index fields
+        (e.g. the mtime of the file it was read from). Returns its entry.
+        """
+        with self.lock, open(self.pack_path, "ab") as pack:
+            if fcntl is not None:
+                fcntl.flock(pack, fcntl.LOCK_EX)
+            offset = pack.seek(0, os.SEEK_END)
+            pack.write(data)
+            pack.flush()
+            entry = {"name": name, "offset": offset, "size": len(data), **info}
+            # The index line is only written once the bytes are in the pack
+            with open(self.index_path, "a", encoding="utf-8") as index:
+                index.write(json.dumps(entry) + "\n")
+        self.refresh()
+        return self.entry(name)
+
+    def add_file(self, name, path):
+        """Append a file unless the same version of it is already packed."""
+        stat = os.stat(path)
+        entry = self.entry(name)
+        if (
+            entry is not None
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return False
+        with open(path, "rb") as file:
+            self.append(name, file.read(), mtime_ns=stat.st_mtime_ns)
+        return True
+
+    def page_numbers(self):
+        """Pages with a packed page_N.png, in order."""
+        return sorted(
+            int(name[len("page_") : -len(".png")])
+            for name in self.state[0]
+            if name.startswith("page_") and name.endswith(".png")
+        )
+
+
+def page_image_name(page_number):
+    return f"page_{page_number}.png"
+
+
+def pack_folder(folder, page_numbers=None):
+    """
+    Pack the page PNGs of a guidebook folder and their renditions. Files
+    already packed with the same mtime and size are skipped. Returns the
+    number of files appended.
+    """
+    pack = PagePack(folder)
+    if page_numbers is None:
+        page_numbers = sorted(
+            int(name[len("page_") : -len(".png")])
+            for name in os.listdir(folder)
+            if name.startswith("page_") and name.endswith(".png")
+        )
+    rendition_folder = os.path.join(folder, RENDITION_FOLDER)
+    renditions = {}
+    if os.path.isdir(rendition_folder):
+        for name in os.listdir(rendition_folder):
+            if name.endswith(".webp"):
+                page = name[len("page_") :].split("_")[0]
+                renditions.setdefault(page, []).append(name)
+
+    appended = 0
+    for page_number in page_numbers:
+        path = os.path.join(folder, page_image_name(page_number))
+        if not os.path.exists(path):
+            continue
+        appended += pack.add_file(page_image_name(page_number), path)
+        for name in sorted(renditions.get(str(page_number), [])):
+            appended += pack.add_file(
+                f"{RENDITION_FOLDER}/{name}", os.path.join(rendition_folder, name)
+            )
+    return appended
+
+
+def compact(folder):
+    """
+    Rewrite the pack without the images that were replaced since. Returns
+    the number of bytes reclaimed.
+
+    The new pack and index are swapped in one after the other, so this is
+    maintenance to run while nothing converts, exports or views the folder.
+    """
+    pack = PagePack(folder)
+    entries, _ = pack.state
+    before = os.path.getsize(pack.pack_path) if os.path.exists(pack.pack_path) else 0
+    temp_pack = f"{pack.pack_path}.{os.getpid()}.tmp"
+    temp_index = f"{pack.index_path}.{os.getpid()}.tmp"
+    with open(temp_pack, "wb") as pack_file, open(
+        temp_index, "w", encoding="utf-8"
+    ) as index_file:
+        for name in sorted(entries, key=lambda n: entries[n]["offset"]):
+            entry = dict(entries[name], name=name, offset=pack_file.tell())
+            pack_file.write(pack.get(name))
+            index_file.write(json.dumps(entry) + "\n")
+        after = pack_file.tell()
+    os.replace(temp_pack, pack.pack_path)
+    os.replace(temp_index, pack.index_path)
+    return before - after
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack the page images of guidebook folders into one file each."
+    )
+    parser.add_argument("folders", nargs="+", help="Folders of page images.")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Also drop the replaced images from the packs.",
+    )
+    args = parser.parse_args()
+
+    for folder in args.folders:
+        appended = pack_folder(folder)
+        print(f"{folder}: {appended} files packed")
+        if args.compact:
+            print(f"{folder}: {compact(folder) / 1e6:.1f} MB reclaimed")
+
+
+if __name__ == "__main__":
+    main()
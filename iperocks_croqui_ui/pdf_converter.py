@@ -1,19 +1,36 @@
+import asyncio
+import functools
 import json
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Optional
 
-import pytesseract
-from dotenv import load_dotenv
-from langchain_core.exceptions import OutputParserException
-from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
-from langchain_core.prompts import PromptTemplate
+import pdfplumber
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
-load_dotenv(override=True)
+from iperocks_croqui_ui.artifact_cache import (
+    ArtifactCache,
+    hash_bytes,
+    hash_file,
+    hash_image,
+    ocr_cache_key,
+    read_blob,
+    write_blob,
+)
+from iperocks_croqui_ui.llm_extraction import (
+    ExtractionStage,
+)
+from iperocks_croqui_ui.metrics import PageMetrics, RunMetrics
+from iperocks_croqui_ui.page_pack import pack_folder
+from iperocks_croqui_ui.renditions import generate_renditions
+from iperocks_croqui_ui.text_regions import (
+    clean_ocr_text,
+    find_text_regions,
+    pdf_word_boxes,
+)
 
 
 class Route(BaseModel):
@@ -35,8 +52,10 @@ class CroquiPage(BaseModel):
     )
 
 
-prompt = PromptTemplate.from_template(
-    """you receive the text version of a pdf page. Your task is to organize 
+# Prompts, LLM clients and chains are built on first use: importing this
+# module (CLI start-up, OCR pool workers) must not need langchain's heavier
+# modules, a .env file or an API key.
+PAGE_TEMPLATE = """you receive the text version of a pdf page. Your task is to organize 
     the text and output in JSON. The page contains the block name in portugues 
     'Bloco', the sector (e.g., 'Setor Seu Luiz') some warnings or instructions, followed by a list of climbing 
     routes: with a id number, a name, a grade. Each of those should become a 
@@ -50,15 +69,103 @@ prompt = PromptTemplate.from_template(
     Output format: 
     {output_format}
     """
-)
 
-pydantic_parser = PydanticOutputParser(pydantic_object=CroquiPage)
-prompt = prompt.partial(output_format=pydantic_parser.get_format_instructions())
+REPAIR_TEMPLATE = """A climbing route extracted from the text version of a pdf page has 
+    invalid or missing fields: {fields}. Read the page again and output a 
+    JSON object containing only these fields, with their correct values.
+
+    Page content: 
+    {page_content}
+
+    page number: {page_number}
+
+    Route: {route}
+
+    Route fields: 
+    {route_fields}
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def get_prompt():
+    """Page prompt, with the CroquiPage format instructions filled in."""
+    from langchain_core.output_parsers import PydanticOutputParser
+    from langchain_core.prompts import PromptTemplate
+
+    pydantic_parser = PydanticOutputParser(pydantic_object=CroquiPage)
+    prompt = PromptTemplate.from_template(PAGE_TEMPLATE)
+    return prompt.partial(output_format=pydantic_parser.get_format_instructions())
+
+
+@functools.lru_cache(maxsize=None)
+def get_repair_prompt():
+    from langchain_core.prompts import PromptTemplate
+
+    repair_prompt = PromptTemplate.from_template(REPAIR_TEMPLATE)
+    return repair_prompt.partial(
+        route_fields=json.dumps(Route.schema()["properties"], indent=2)
+    )
+
+
+# Model of each LLM backend, known without building its client
+LLM_MODELS = {"openai": "gpt-4o-mini", "fake": "fake"}
+
+
+def get_llm(backend="openai"):
+    """Return the chat model for the extraction chain ("openai" or "fake")."""
+    if backend == "fake":
+        from iperocks_croqui_ui.fake_llm import build_fake_llm
+
+        return build_fake_llm()
+    from dotenv import load_dotenv
+    from langchain_openai import ChatOpenAI
+
+    # The API key may come from a .env file
+    load_dotenv(override=True)
+    # Token usage is only reported for streamed responses when asked for
+    return ChatOpenAI(model=LLM_MODELS["openai"], stream_usage=True)
+
+
+def build_chain(llm):
+    from langchain_core.output_parsers import JsonOutputParser
+
+    return get_prompt() | llm | JsonOutputParser()
+
+
+def build_repair_chain(llm):
+    """Chain re-prompting only the invalid fields of one route."""
+    from langchain_core.output_parsers import JsonOutputParser
+
+    return get_repair_prompt() | llm | JsonOutputParser()
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_chains(backend="openai"):
+    """Extraction and repair chains of an LLM backend, created once."""
+    llm = get_llm(backend)
+    return build_chain(llm), build_repair_chain(llm)
 
-llm = ChatOpenAI(model="gpt-4o-mini")
-json_parser = JsonOutputParser()
 
-chain = prompt | llm | json_parser
+def get_llm_config(model_name):
+    """Everything besides the page text that determines the LLM response."""
+    schema = json.dumps(CroquiPage.schema(), sort_keys=True)
+    return hash_bytes(PAGE_TEMPLATE, REPAIR_TEMPLATE, model_name, schema)
+
+
+# Tesseract settings, part of the OCR cache key. Whole pages use automatic
+# page segmentation; cropped text regions are read as uniform text blocks
+TESSERACT_CONFIG = ""
+REGION_TESSERACT_CONFIG = "--psm 6"
+OCR_CONFIG = f"tesseract config={TESSERACT_CONFIG!r}"
+
+# OCR only the text regions found by layout analysis, or every page whole
+OCR_LAYOUTS = ("regions", "page")
+
+# How page text is obtained: the PDF text layer with OCR fallback ("auto"),
+# only the text layer, or always OCR
+TEXT_STRATEGIES = ("auto", "text-layer", "ocr")
+MIN_TEXT_LAYER_WORDS = 5
+MIN_TEXT_LAYER_SCORE = 0.5
 
 
 def sanitize_filename(filename):
@@ -66,65 +173,562 @@ def sanitize_filename(filename):
     return re.sub(r"[^a-zA-Z0-9_\-]", "_", filename)
 
 
-def pdf_to_png_and_extract_text(pdf_path, output_root, page_numbers=None):
-    # Extract the base name of the PDF file (without extension)
-    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    # Sanitize the base name to make it a valid folder name
-    sanitized_name = sanitize_filename(base_name)
-    # Define the output folder path
-    output_folder = os.path.join(output_root, sanitized_name)
+def get_page_count(pdf_path):
+    """Read the number of pages from the PDF metadata without rendering it."""
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def page_artifact_paths(output_folder, page_number):
+    """Return the (png, txt, json) paths used for a 1-based page number."""
+    return (
+        os.path.join(output_folder, f"page_{page_number}.png"),
+        os.path.join(output_folder, f"page_{page_number}.txt"),
+        os.path.join(output_folder, f"page_{page_number}.json"),
+    )
+
+
+def render_page(pdf_path, page_number):
+    """Rasterize a single 1-based page of the PDF into a PIL image."""
+    images = convert_from_path(pdf_path, first_page=page_number, last_page=page_number)
+    return images[0]
+
+
+def extract_text_layer(pdf_path, page_number):
+    """Read the embedded text of a 1-based page, without rendering it."""
+    with pdfplumber.open(pdf_path) as pdf:
+        return pdf.pages[page_number - 1].extract_text() or ""
+
+
+def score_text_quality(text):
+    """
+    Rough 0-1 quality score of extracted text: the share of non-space
+    characters that belong to words. Undecodable glyphs score 0.
+    """
+    if not text or "(cid:" in text:
+        return 0.0
+    nonspace = sum(1 for c in text if not c.isspace())
+    letters = sum(len(w) for w in re.findall(r"[^\W\d_]{2,}", text))
+    return letters / nonspace if nonspace else 0.0
+
+
+def is_usable_text(text):
+    words = re.findall(r"[^\W\d_]{2,}", text or "")
+    return (
+        len(words) >= MIN_TEXT_LAYER_WORDS
+        and score_text_quality(text) >= MIN_TEXT_LAYER_SCORE
+    )
+
+
+def read_text_layer(pdf_path, page_number, text_strategy):
+    """Return the text layer when the strategy allows it and it is usable."""
+    if text_strategy == "ocr":
+        return None
+    text = extract_text_layer(pdf_path, page_number)
+    if text_strategy == "text-layer" or is_usable_text(text):
+        return text
+    return None
+
+
+def write_page_text(text_path, text):
+    with open(text_path, "w", encoding="utf-8") as text_file:
+        text_file.write(text)
+
+
+def get_ocr_config(ocr_layout="regions"):
+    """Everything besides the pixels that determines the OCR text."""
+    if ocr_layout == "page":
+        return OCR_CONFIG
+    return f"{OCR_CONFIG} regions config={REGION_TESSERACT_CONFIG!r}"
+
+
+def ocr_image(image, config=TESSERACT_CONFIG):
+    # Imported here, pytesseract loads pandas and pages read from the PDF
+    # text layer never need it
+    import pytesseract
+
+    return pytesseract.image_to_string(image, config=config)
+
+
+def find_page_regions(image, pdf_path=None, page_number=None):
+    """Text regions of a page image, helped by the PDF word boxes if any."""
+    word_boxes = pdf_word_boxes(pdf_path, page_number) if pdf_path else None
+    return find_text_regions(image, word_boxes)
+
+
+def ocr_page(image, regions=None):
+    """
+    OCR the given text regions of a page image and drop the noise lines
+    between them. The whole page is OCR'd when there are no regions or
+    nothing was read from them.
+    """
+    if regions:
+        texts = [ocr_image(image.crop(box), REGION_TESSERACT_CONFIG) for box in regions]
+        text = clean_ocr_text("\n\n".join(texts))
+        if text:
+            return text
+    return ocr_image(image)
+
+
+def timed_render(pdf_path, page_number, page_metrics):
+    with page_metrics.stage("render"):
+        return render_page(pdf_path, page_number)
+
+
+def timed_save_png(image, image_path, page_metrics):
+    with page_metrics.stage("png"):
+        image.save(image_path, "PNG")
+    page_metrics.wrote("png", image_path)
+
 
-    # Convert PDF pages to images
-    pages = convert_from_path(pdf_path)
+def timed_write_text(text_path, text, page_metrics):
+    write_page_text(text_path, text)
+    page_metrics.wrote("text", text_path)
 
-    # Create the output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
 
-    # Initialize text storage
-    text_storage = {}
+def timed_ocr(
+    image, page_metrics, ocr_layout="regions", pdf_path=None, page_number=None
+):
+    regions = None
+    if ocr_layout == "regions":
+        with page_metrics.stage("layout"):
+            regions = find_page_regions(image, pdf_path, page_number)
+        page_metrics.count("ocr_regions", len(regions or ()))
+    with page_metrics.stage("ocr"):
+        return ocr_page(image, regions)
 
-    # Determine pages to process
-    if page_numbers is None:
-        page_indices = range(len(pages))
+
+def save_page_and_text(
+    output_folder,
+    page_number,
+    image,
+    page_metrics=None,
+    ocr_layout="regions",
+    pdf_path=None,
+):
+    """
+    Write the PNG and OCR text for a page, reusing whatever is on disk.
+
+    Returns the page text. The image may be None when both files exist.
+    pdf_path, when given, provides word boxes to the layout analysis.
+    """
+    page_metrics = page_metrics if page_metrics is not None else PageMetrics()
+    # Define output file paths
+    image_path, text_path, _ = page_artifact_paths(output_folder, page_number)
+
+    # Check if image file exists
+    if not os.path.exists(image_path):
+        # Save the page as a PNG image
+        timed_save_png(image, image_path, page_metrics)
+
+    # Check if text file exists
+    if os.path.exists(text_path):
+        # Read text from the existing file
+        with open(text_path, "r", encoding="utf-8") as text_file:
+            return text_file.read()
+
+    # Extract text from the image using OCR and save it to a file
+    text = timed_ocr(image, page_metrics, ocr_layout, pdf_path, page_number)
+    timed_write_text(text_path, text, page_metrics)
+    return text
+
+
+def save_page_and_text_cached(
+    pdf_path,
+    output_folder,
+    page_number,
+    cache_dir,
+    known_pixel_hash=None,
+    page_metrics=None,
+    ocr_layout="regions",
+):
+    """
+    Write the PNG and OCR text for a page using the content-addressed cache.
+
+    The page is rendered unless the PNG exists and the OCR text for its last
+    known pixel hash is cached. Returns (text, (pixel_hash, hit, size)).
+    """
+    page_metrics = page_metrics if page_metrics is not None else PageMetrics()
+    image_path, text_path, _ = page_artifact_paths(output_folder, page_number)
+
+    if known_pixel_hash is not None and os.path.exists(image_path):
+        key = ocr_cache_key(known_pixel_hash, get_ocr_config(ocr_layout))
+        data = read_blob(cache_dir, key)
+        if data is not None:
+            text = data.decode("utf-8")
+            timed_write_text(text_path, text, page_metrics)
+            return text, (known_pixel_hash, True, len(data))
+
+    image = timed_render(pdf_path, page_number, page_metrics)
+    with page_metrics.stage("hash"):
+        pixel_hash = hash_image(image)
+    if pixel_hash != known_pixel_hash or not os.path.exists(image_path):
+        timed_save_png(image, image_path, page_metrics)
+
+    key = ocr_cache_key(pixel_hash, get_ocr_config(ocr_layout))
+    data = read_blob(cache_dir, key)
+    if data is not None:
+        text = data.decode("utf-8")
+        hit, size = True, len(data)
     else:
-        page_indices = [p - 1 for p in page_numbers if 1 <= p <= len(pages)]
+        text = timed_ocr(image, page_metrics, ocr_layout, pdf_path, page_number)
+        hit, size = False, write_blob(cache_dir, key, text.encode("utf-8"))
+    timed_write_text(text_path, text, page_metrics)
+    return text, (pixel_hash, hit, size)
+
 
-    # Save each page as a PNG image and extract text
-    for i in page_indices:
-        # Define output file paths
-        image_path = os.path.join(output_folder, f"page_{i + 1}.png")
-        text_path = os.path.join(output_folder, f"page_{i + 1}.txt")
-        json_path = os.path.join(output_folder, f"page_{i + 1}.json")
+def rasterize_and_ocr_page(
+    pdf_path,
+    output_folder,
+    page_number,
+    cache_dir=None,
+    known_pixel_hash=None,
+    text_strategy="auto",
+    ocr_layout="regions",
+):
+    """
+    Write the PNG and text of a single page. Runs inside pool workers.
+
+    The PDF text layer is tried first and the page is only OCR'd when that
+    text is not usable, by default only in the text regions of the page.
+    Returns (text, text_source, cache_info, page_metrics), where text_source
+    is "text-layer", "ocr" or "existing", cache_info is None without a cache
+    and page_metrics times the stages run for the page.
+    """
+    page_metrics = PageMetrics()
+    image_path, text_path, _ = page_artifact_paths(output_folder, page_number)
 
-        # Check if image file exists
+    # Without a cache, text already on disk is reused as is
+    if cache_dir is None and os.path.exists(text_path):
+        image = None
         if not os.path.exists(image_path):
-            # Save the page as a PNG image
-            pages[i].save(image_path, "PNG")
-
-        # Check if text file exists
-        if os.path.exists(text_path):
-            # Read text from the existing file
-            with open(text_path, "r", encoding="utf-8") as text_file:
-                text = text_file.read()
+            image = timed_render(pdf_path, page_number, page_metrics)
+        text = save_page_and_text(output_folder, page_number, image, page_metrics)
+        return text, "existing", None, page_metrics
+
+    with page_metrics.stage("text-layer"):
+        text = read_text_layer(pdf_path, page_number, text_strategy)
+    if text is not None:
+        # The PNG is still needed by the viewer and the PDF export
+        pixel_hash = known_pixel_hash
+        needs_hash = cache_dir is not None and known_pixel_hash is None
+        if needs_hash or not os.path.exists(image_path):
+            image = timed_render(pdf_path, page_number, page_metrics)
+            if cache_dir is not None:
+                with page_metrics.stage("hash"):
+                    pixel_hash = hash_image(image)
+            timed_save_png(image, image_path, page_metrics)
+        timed_write_text(text_path, text, page_metrics)
+        cache_info = (pixel_hash, None, None) if cache_dir is not None else None
+        return text, "text-layer", cache_info, page_metrics
+
+    if cache_dir is not None:
+        text, cache_info = save_page_and_text_cached(
+            pdf_path,
+            output_folder,
+            page_number,
+            cache_dir,
+            known_pixel_hash,
+            page_metrics,
+            ocr_layout,
+        )
+        page_metrics.count("ocr_cache_hits" if cache_info[1] else "ocr_cache_misses")
+        return text, "ocr", cache_info, page_metrics
+    image = None
+    if not os.path.exists(image_path) or not os.path.exists(text_path):
+        image = timed_render(pdf_path, page_number, page_metrics)
+    text = save_page_and_text(
+        output_folder, page_number, image, page_metrics, ocr_layout, pdf_path
+    )
+    return text, "ocr", None, page_metrics
+
+
+def record_ocr(cache, pdf_digest, page_number, cache_info, ocr_layout="regions"):
+    """Register the OCR cache lookup done for a page in the cache index."""
+    if cache is None or cache_info is None:
+        return
+    pixel_hash, hit, size = cache_info
+    cache.set_page_pixel_hash(pdf_digest, page_number, pixel_hash)
+    # hit is None when the text layer was used and OCR was skipped
+    if hit is not None:
+        cache.record(ocr_cache_key(pixel_hash, get_ocr_config(ocr_layout)), hit, size)
+
+
+def save_text_sources(output_folder, text_sources):
+    """Merge the text source of each page into text_sources.json."""
+    sources_path = os.path.join(output_folder, "text_sources.json")
+    sources = {}
+    if os.path.exists(sources_path):
+        with open(sources_path, "r", encoding="utf-8") as sources_file:
+            sources = json.load(sources_file)
+    for page_number, source in text_sources.items():
+        # Keep the original source of pages reused from disk
+        if source != "existing" or str(page_number) not in sources:
+            sources[str(page_number)] = source
+    with open(sources_path, "w", encoding="utf-8") as sources_file:
+        json.dump(sources, sources_file, indent=4, sort_keys=True)
+
+    counts = {}
+    for source in text_sources.values():
+        counts[source] = counts.get(source, 0) + 1
+    print("Text sources: " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+
+
+class Document:
+    """A guidebook PDF being ingested and the pages requested from it."""
+
+    def __init__(self, pdf_path, output_root, page_numbers=None):
+        self.pdf_path = pdf_path
+        # Extract the base name of the PDF file (without extension)
+        base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        # Sanitize the base name to make it a valid folder name
+        self.name = sanitize_filename(base_name)
+        # Define the output folder path
+        self.output_folder = os.path.join(output_root, self.name)
+
+        # Only read the page count, pages are rendered lazily
+        self.total_pages = get_page_count(pdf_path)
+
+        # Determine pages to process
+        if page_numbers is None:
+            self.page_numbers = list(range(1, self.total_pages + 1))
         else:
-            # Extract text from the image using OCR
-            text = pytesseract.image_to_string(pages[i])
-            # Save the extracted text to a file
-            with open(text_path, "w", encoding="utf-8") as text_file:
-                text_file.write(text)
-
-        # Store text in the dictionary
-        text_storage[f"page_{i + 1}"] = text
-
-        try:
-            # Generate JSON response (assuming chain.invoke() is a valid function)
-            response = chain.invoke({"page_content": text, "page_number": i + 1})
-
-            # Save the response to a JSON file
-            if not os.path.exists(json_path):
-                with open(json_path, "w", encoding="utf-8") as json_file:
-                    json.dump(response, json_file, indent=4)
-        except OutputParserException:
-            print(f"Page {i+1} doesn't contain expected information, skipping.")
-
-    return text_storage
+            self.page_numbers = [p for p in page_numbers if 1 <= p <= self.total_pages]
+
+        self.pdf_digest = None
+        self.texts = {}
+        self.text_sources = {}
+        self.errors = {}
+
+    def text_storage(self):
+        # Keep the requested page order
+        return {
+            f"page_{page_number}": self.texts[page_number]
+            for page_number in self.page_numbers
+            if page_number in self.texts
+        }
+
+
+async def _process_pages_serial(
+    documents,
+    llm_backend,
+    requests_per_second,
+    cache,
+    llm_config,
+    text_strategy,
+    metrics,
+    ocr_layout="regions",
+):
+    """
+    Rasterize, OCR and extract one page at a time. The LLM requests go
+    through an ExtractionStage with a single slot, so they get the retries,
+    backoff and rate limit of the parallel pipeline.
+    """
+    cache_dir = cache.cache_dir if cache is not None else None
+    stage = ExtractionStage(
+        None,
+        concurrency=1,
+        requests_per_second=requests_per_second,
+        cache=cache,
+        llm_config=llm_config,
+        route_schema=Route,
+        get_chains=functools.partial(get_default_chains, llm_backend),
+    )
+
+    # Save each page as a PNG image and extract text, one page at a time
+    for doc in documents:
+        for page_number in doc.page_numbers:
+            known_pixel_hash = (
+                cache.page_pixel_hash(doc.pdf_digest, page_number) if cache else None
+            )
+            text, source, cache_info, page_metrics = rasterize_and_ocr_page(
+                doc.pdf_path,
+                doc.output_folder,
+                page_number,
+                cache_dir,
+                known_pixel_hash,
+                text_strategy,
+                ocr_layout,
+            )
+            record_ocr(cache, doc.pdf_digest, page_number, cache_info, ocr_layout)
+
+            # Store text in the dictionary
+            doc.texts[page_number] = text
+            doc.text_sources[page_number] = source
+            _, _, json_path = page_artifact_paths(doc.output_folder, page_number)
+            error = await stage.extract(page_number, text, json_path, page_metrics)
+            if error is not None:
+                doc.errors[page_number] = error
+            metrics.record_page(doc.name, page_number, page_metrics, source, error)
+
+
+async def _process_pages_parallel(
+    documents,
+    workers,
+    llm_backend,
+    requests_per_second,
+    cache,
+    llm_config,
+    text_strategy,
+    metrics,
+    ocr_layout="regions",
+):
+    """
+    Two-stage pipeline: rasterization and OCR run in a process pool and each
+    finished page goes straight to the async, rate-limited LLM stage. The
+    pages of every document share the same pool and stage. A failure on one
+    page is reported and does not stop the other pages.
+    """
+    loop = asyncio.get_running_loop()
+    cache_dir = cache.cache_dir if cache is not None else None
+
+    with ProcessPoolExecutor(max_workers=workers) as ocr_pool:
+
+        async def process_page(doc, stage, page_number):
+            known_pixel_hash = (
+                cache.page_pixel_hash(doc.pdf_digest, page_number) if cache else None
+            )
+            try:
+                text, source, cache_info, page_metrics = await loop.run_in_executor(
+                    ocr_pool,
+                    rasterize_and_ocr_page,
+                    doc.pdf_path,
+                    doc.output_folder,
+                    page_number,
+                    cache_dir,
+                    known_pixel_hash,
+                    text_strategy,
+                    ocr_layout,
+                )
+            except Exception as e:
+                doc.errors[page_number] = e
+                print(f"Error converting {doc.name} page {page_number}: {e}")
+                metrics.record_page(doc.name, page_number, PageMetrics(), error=e)
+                return
+            record_ocr(cache, doc.pdf_digest, page_number, cache_info, ocr_layout)
+            doc.texts[page_number] = text
+            doc.text_sources[page_number] = source
+            _, _, json_path = page_artifact_paths(doc.output_folder, page_number)
+            error = await stage.extract(page_number, text, json_path, page_metrics)
+            if error is not None:
+                doc.errors[page_number] = error
+            metrics.record_page(doc.name, page_number, page_metrics, source, error)
+
+        stage = ExtractionStage(
+            None,
+            concurrency=workers,
+            requests_per_second=requests_per_second,
+            cache=cache,
+            llm_config=llm_config,
+            route_schema=Route,
+            get_chains=functools.partial(get_default_chains, llm_backend),
+        )
+        tasks = [
+            process_page(doc, stage, page_number)
+            for doc in documents
+            for page_number in doc.page_numbers
+        ]
+        await asyncio.gather(*tasks)
+
+
+def ingest_pdfs(
+    pdf_paths,
+    output_root,
+    page_numbers=None,
+    workers=1,
+    llm_backend="openai",
+    requests_per_second=None,
+    cache_dir=None,
+    cache_max_bytes=1 << 30,
+    text_strategy="auto",
+    renditions=True,
+    metrics=None,
+    ocr_layout="regions",
+):
+    """
+    Convert several guidebook PDFs, scheduling the pages of all of them on a
+    single worker pool. Each guidebook is written to its own folder under
+    output_root, where its page images are also appended to a PagePack.
+    page_numbers (1-based) applies to every PDF and defaults to all of its
+    pages. Stage timings, cache hits and token usage of every page are added
+    to metrics (a RunMetrics) when given. ocr_layout is one of OCR_LAYOUTS.
+    Returns the list of processed Document objects.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    documents = [
+        Document(pdf_path, output_root, page_numbers) for pdf_path in pdf_paths
+    ]
+    for doc in documents:
+        # Create the output folder if it doesn't exist
+        os.makedirs(doc.output_folder, exist_ok=True)
+
+    # The LLM client and chains are only built for the first page that is
+    # not already extracted
+    metrics.model_name = LLM_MODELS[llm_backend]
+
+    # Without a cache, artifacts on disk are reused as long as they exist,
+    # page JSONs only when they were extracted with the same llm_config
+    cache = None
+    llm_config = get_llm_config(LLM_MODELS[llm_backend])
+    if cache_dir is not None:
+        cache = ArtifactCache(cache_dir, max_bytes=cache_max_bytes)
+        for doc in documents:
+            doc.pdf_digest = hash_file(doc.pdf_path)
+
+    try:
+        if workers > 1:
+            asyncio.run(
+                _process_pages_parallel(
+                    documents,
+                    workers,
+                    llm_backend,
+                    requests_per_second,
+                    cache,
+                    llm_config,
+                    text_strategy,
+                    metrics,
+                    ocr_layout,
+                )
+            )
+        else:
+            asyncio.run(
+                _process_pages_serial(
+                    documents,
+                    llm_backend,
+                    requests_per_second,
+                    cache,
+                    llm_config,
+                    text_strategy,
+                    metrics,
+                    ocr_layout,
+                )
+            )
+    finally:
+        if cache is not None:
+            cache.save()
+            print(cache.summary())
+
+    for doc in documents:
+        if doc.errors:
+            print(f"{doc.name}: {len(doc.errors)} page(s) failed: {sorted(doc.errors)}")
+        save_text_sources(doc.output_folder, doc.text_sources)
+
+        # Smaller WebP copies of the new PNGs for the viewer
+        if renditions:
+            with metrics.stage("renditions"):
+                written = generate_renditions(
+                    doc.output_folder, doc.page_numbers, workers
+                )
+            print(f"{doc.name}: {written} image renditions written")
+
+        # The viewer and the exporter read the images from the pack
+        with metrics.stage("pack"):
+            packed = pack_folder(doc.output_folder, doc.page_numbers)
+        print(f"{doc.name}: {packed} images packed")
+    return documents
+
+
+def pdf_to_png_and_extract_text(pdf_path, output_root, page_numbers=None, **kwargs):
+    """Convert a single PDF; keyword arguments are those of ingest_pdfs."""
+    (doc,) = ingest_pdfs([pdf_path], output_root, page_numbers, **kwargs)
+    return doc.text_storage()
@@ -0,0 +1,165 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# Widths (px) of the WebP renditions generated for every page image
+RENDITION_WIDTHS = (480, 960, 1600)
+THUMBNAIL_WIDTH = 240
+RENDITION_QUALITY = 80
+RENDITION_FOLDER = "renditions"
+
+
+def rendition_name(page_number, width=None):
+    """
+    File name of a page rendition: width=None gives the thumbnail and
+    width="full" the WebP copy at the original size.
+    """
+    if width is None:
+        suffix = "thumb"
+    elif width == "full":
+        suffix = "full"
+    else:
+        suffix = f"w{width}"
+    return f"page_{page_number}_{suffix}.webp"
+
+
+def rendition_path(image_folder, page_number, width=None):
+    return os.path.join(
+        image_folder, RENDITION_FOLDER, rendition_name(page_number, width)
+    )
+
+
+def _is_fresh(path, source_mtime):
+    return os.path.exists(path) and os.path.getmtime(path) >= source_mtime
+
+
+def generate_page_renditions(image_folder, page_number, widths=RENDITION_WIDTHS):
+    """
+    Write the WebP renditions and thumbnail of one page PNG.
+
+    Besides the thumbnail, one rendition is written per width smaller than
+    the original plus a full-size WebP copy. Renditions newer than the PNG
+    are kept. Returns the number of files written.
+    """
+    image_path = os.path.join(image_folder, f"page_{page_number}.png")
+    source_mtime = os.path.getmtime(image_path)
+    targets = [None, "full"] + list(widths)
+    paths = {
+        width: rendition_path(image_folder, page_number, width) for width in targets
+    }
+    if all(_is_fresh(path, source_mtime) for path in paths.values()):
+        return 0
+
+    os.makedirs(os.path.join(image_folder, RENDITION_FOLDER), exist_ok=True)
+    written = 0
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")
+        for width, path in paths.items():
+            if width is None:
+                width = THUMBNAIL_WIDTH
+            elif width == "full":
+                width = img.width
+            elif width >= img.width:
+                # Would only upscale, the full-size copy covers it
+                continue
+            if _is_fresh(path, source_mtime):
+                continue
+            height = max(1, round(img.height * width / img.width))
+            resized = (
+                img
+                if width == img.width
+                else img.resize((width, height), Image.LANCZOS)
+            )
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            resized.save(temp_path, "WEBP", quality=RENDITION_QUALITY, method=4)
+            os.replace(temp_path, path)
+            written += 1
+    return written
+
+
+def generate_renditions(image_folder, page_numbers=None, workers=1):
+    """Generate renditions for the given pages (default: every page PNG)."""
+    if page_numbers is None:
+        page_numbers = sorted(
+            int(name[len("page_") : -len(".png")])
+            for name in os.listdir(image_folder)
+            if name.startswith("page_") and name.endswith(".png")
+        )
+    page_numbers = [
+        p
+        for p in page_numbers
+        if os.path.exists(os.path.join(image_folder, f"page_{p}.png"))
+    ]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = pool.map(
+                generate_page_renditions,
+                [image_folder] * len(page_numbers),
+                page_numbers,
+            )
+            return sum(written)
+    return sum(generate_page_renditions(image_folder, p) for p in page_numbers)
+
+
+def pick_rendition(image_folder, page_number, max_width=None):
+    """
+    Smallest rendition at least max_width wide. Falls back to the full-size
+    WebP, then to the original PNG when no renditions were generated.
+    """
+    candidates = [
+        rendition_path(image_folder, page_number, width)
+        for width in RENDITION_WIDTHS
+        if max_width is not None and width >= max_width
+    ]
+    candidates.append(rendition_path(image_folder, page_number, "full"))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return os.path.join(image_folder, f"page_{page_number}.png")
+
+
+def pick_packed_rendition(pack, page_number, max_width=None):
+    """
+    Like pick_rendition, over the images of a PagePack: the name of the
+    smallest packed rendition at least max_width wide, else of the full-size
+    WebP, else of the page PNG. None when the page is not packed at all.
+    """
+    widths = [w for w in RENDITION_WIDTHS if max_width is not None and w >= max_width]
+    for width in widths + ["full"]:
+        name = f"{RENDITION_FOLDER}/{rendition_name(page_number, width)}"
+        if name in pack:
+            return name
+    name = f"page_{page_number}.png"
+    return name if name in pack else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate and pack WebP renditions and thumbnails of the page "
+        "images."
+    )
+    parser.add_argument("image_folder", help="Folder containing the page PNGs.")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parallel workers.",
+    )
+    args = parser.parse_args()
+
+    written = generate_renditions(args.image_folder, workers=args.workers)
+    print(f"{written} renditions written to {args.image_folder}")
+    # Imported here, page_pack imports this module
+    from iperocks_croqui_ui.page_pack import pack_folder
+
+    # The viewer only reads renditions from the pack
+    packed = pack_folder(args.image_folder)
+    print(f"{packed} images packed in {args.image_folder}")
+
+
+if __name__ == "__main__":
+    main()
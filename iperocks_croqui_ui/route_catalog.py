@@ -0,0 +1,536 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from iperocks_croqui_ui.route_dedup import sector_key as merge_key
+from iperocks_croqui_ui.route_store import (
+    COLUMNS,
+    RouteStore,
+    route_copies,
+    route_id,
+)
+from iperocks_croqui_ui.search_index import (
+    FIELD_WEIGHTS,
+    edit_distance,
+    max_edits,
+    tokenize,
+)
+from iperocks_croqui_ui.text_utils import normalize_name
+
+CATALOG_VERSION = 2
+# Routes listed per page of results in the viewer
+PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS routes (
+    row INTEGER PRIMARY KEY,
+    route_id TEXT NOT NULL UNIQUE,
+    id_number INTEGER,
+    name TEXT,
+    grade TEXT NOT NULL,
+    grade_rank REAL,
+    description TEXT,
+    page_number INTEGER,
+    block TEXT,
+    sector TEXT,
+    source TEXT NOT NULL,
+    block_key TEXT NOT NULL,
+    sector_key TEXT NOT NULL,
+    merge_key TEXT NOT NULL,
+    sort_key TEXT NOT NULL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS copies (
+    copy_id TEXT PRIMARY KEY,
+    route_row INTEGER NOT NULL,
+    sort_key TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS copies_route ON copies (route_row);
+CREATE INDEX IF NOT EXISTS routes_sector
+    ON routes (sector_key, block_key, grade_rank, grade);
+CREATE INDEX IF NOT EXISTS routes_block ON routes (block_key, grade_rank, grade);
+CREATE INDEX IF NOT EXISTS routes_grade ON routes (grade, grade_rank);
+CREATE INDEX IF NOT EXISTS routes_source ON routes (source, sector_key, block_key);
+CREATE INDEX IF NOT EXISTS routes_page ON routes (source, page_number);
+CREATE INDEX IF NOT EXISTS routes_merge ON routes (merge_key);
+CREATE INDEX IF NOT EXISTS routes_order ON routes (grade_rank, sort_key);
+CREATE VIRTUAL TABLE IF NOT EXISTS routes_fts USING fts5 (
+    name, description, block, sector, tokenize = 'unicode61'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS routes_terms USING fts5vocab (routes_fts, 'row');
+"""
+# Text columns of the FTS table, weighted like the in-memory search index
+FTS_COLUMNS = ("name", "description", "block", "sector")
+ROUTE_FIELDS = ("route_id",) + COLUMNS
+
+
+def grade_rank(grade):
+    """
+    Numeric sort key of a grade: "V6/7" -> 6.5, "V4.2" -> 4.2. Remarks in
+    parentheses are ignored; grades without a number rank None (last).
+    """
+    numbers = re.findall(r"\d+(?:\.\d+)?", (grade or "").split("(")[0])
+    if not numbers:
+        return None
+    return sum(float(number) for number in numbers) / len(numbers)
+
+
+def connect(catalog_file, readonly=False):
+    """
+    Open the catalog. The writer puts it in WAL mode, which is persistent,
+    so readers never wait for a rebuild and a rebuild never waits for them.
+    """
+    connection = sqlite3.connect(catalog_file)
+    if readonly:
+        connection.execute("PRAGMA query_only=ON")
+    else:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def route_row(row, route, sort_key):
+    extra = {
+        key: value for key, value in route.items() if key not in ROUTE_FIELDS and value
+    }
+    return (
+        row,
+        route.get("route_id") or route_id(route),
+        route.get("id_number"),
+        route.get("name"),
+        route.get("grade") or "",
+        grade_rank(route.get("grade")),
+        route.get("description"),
+        route.get("page_number"),
+        route.get("block"),
+        route.get("sector"),
+        route.get("source") or "",
+        normalize_name(route.get("block")),
+        normalize_name(route.get("sector")),
+        merge_key(route.get("sector")),
+        sort_key,
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def row_route(row):
+    """The route dict of a catalog row."""
+    route = {field: row[field] for field in ROUTE_FIELDS}
+    if row["extra"]:
+        route.update(json.loads(row["extra"]))
+    return route
+
+
+def prepare_catalog(connection):
+    """Create the tables, dropping those built by another catalog version."""
+    version = None
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'meta'").fetchone():
+        version = read_meta(connection, "version")
+    if version is not None and version != str(CATALOG_VERSION):
+        connection.executescript(
+            "DROP TABLE IF EXISTS routes_terms; DROP TABLE IF EXISTS routes_fts;"
+            "DROP TABLE IF EXISTS copies; DROP TABLE IF EXISTS routes;"
+            "DROP TABLE IF EXISTS meta;"
+        )
+    connection.executescript(SCHEMA)
+
+
+def read_meta(connection, key):
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def write_meta(connection, data_version, store_sha256=None):
+    routes = connection.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+    connection.executemany(
+        "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+        [
+            ("version", str(CATALOG_VERSION)),
+            ("data_version", data_version),
+            ("routes", str(routes)),
+            ("store_sha256", store_sha256 or ""),
+        ],
+    )
+
+
+def clear_catalog(connection):
+    for table in ("routes", "routes_fts", "copies"):
+        connection.execute(f"DELETE FROM {table}")
+
+
+def insert_routes(connection, routes, sort_keys):
+    """
+    Append routes to the catalog, with their FTS entries and the ids of the
+    copies they were built from. sort_keys maps every copy id to its place
+    in store order; a route is listed at the place of its first copy.
+    """
+    start = connection.execute(
+        "SELECT COALESCE(MAX(row), -1) + 1 FROM routes"
+    ).fetchone()[0]
+    rows, copies = [], []
+    for row, route in enumerate(routes, start):
+        keys = {copy: sort_keys[copy] for copy in route_copies(route)}
+        rows.append(route_row(row, route, min(keys.values())))
+        copies.extend((copy, row, key) for copy, key in keys.items())
+    connection.executemany(f"INSERT INTO routes VALUES ({', '.join('?' * 16)})", rows)
+    # Accents are folded the same way as in the search index
+    connection.executemany(
+        "INSERT INTO routes_fts (rowid, name, description, block, sector) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (row, *(normalize_name(route.get(f)) for f in FTS_COLUMNS))
+            for row, route in enumerate(routes, start)
+        ),
+    )
+    # A route read twice from the same page is only kept once
+    connection.executemany("INSERT OR IGNORE INTO copies VALUES (?, ?, ?)", copies)
+
+
+def delete_rows(connection, rows):
+    """Delete catalog routes, with their FTS entries and copies."""
+    params = [(row,) for row in rows]
+    connection.executemany("DELETE FROM routes WHERE row = ?", params)
+    connection.executemany("DELETE FROM routes_fts WHERE rowid = ?", params)
+    connection.executemany("DELETE FROM copies WHERE route_row = ?", params)
+
+
+def _temp_values(connection, table, values):
+    connection.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {table} (value PRIMARY KEY) WITHOUT ROWID"
+    )
+    connection.execute(f"DELETE FROM {table}")
+    connection.executemany(
+        f"INSERT OR IGNORE INTO {table} VALUES (?)", ((value,) for value in values)
+    )
+
+
+def find_routes(connection, copy_ids=(), merge_keys=()):
+    """
+    Catalog routes built from one of copy_ids, or whose sector merges with
+    one of merge_keys, as {row: route}, and the sort key of each of their
+    copies as {copy_id: sort_key}.
+    """
+    _temp_values(connection, "wanted_copies", copy_ids)
+    _temp_values(connection, "wanted_keys", merge_keys)
+    _temp_values(connection, "found_rows", ())
+    connection.execute(
+        "INSERT OR IGNORE INTO found_rows "
+        "SELECT route_row FROM copies JOIN wanted_copies ON copy_id = value "
+        "UNION SELECT row FROM routes JOIN wanted_keys ON merge_key = value"
+    )
+    routes = {
+        row["row"]: row_route(row)
+        for row in connection.execute(
+            "SELECT routes.* FROM routes JOIN found_rows ON row = value"
+        )
+    }
+    sort_keys = {
+        row[0]: row[1]
+        for row in connection.execute(
+            "SELECT copy_id, sort_key FROM copies JOIN found_rows ON route_row = value"
+        )
+    }
+    return routes, sort_keys
+
+
+def catalog_routes(connection):
+    """Every route of the catalog, in store order."""
+    return [
+        row_route(row)
+        for row in connection.execute("SELECT * FROM routes ORDER BY sort_key")
+    ]
+
+
+def save_catalog(store, catalog_file, store_sha256=None):
+    """
+    Write the routes of a RouteStore to the SQLite catalog.
+
+    The tables are replaced in a single transaction, so readers keep seeing
+    the previous routes until it commits. The data version stored with them
+    is a hash of the routes; store_sha256, the hash of the JSON store file
+    they were read from, is stored too, to tell when the catalog is stale.
+    Routes keep the store order.
+    """
+    routes = store.routes()
+    data_version = hashlib.sha256(
+        json.dumps(routes, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    sort_keys = {}
+    for row, route in enumerate(routes):
+        for copy in route_copies(route):
+            sort_keys.setdefault(copy, f"{row:09d}")
+
+    connection = connect(catalog_file)
+    try:
+        prepare_catalog(connection)
+        with connection:
+            clear_catalog(connection)
+            insert_routes(connection, routes, sort_keys)
+            write_meta(connection, data_version, store_sha256)
+        connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+
+
+class RouteCatalog:
+    """
+    Read side of the SQLite route catalog, as the viewer queries it.
+
+    Facet lists and filters are SQL queries answered from the indexes on
+    the normalized sector and block, the grade and the source, and results
+    can be fetched a page at a time. Free-text queries go through the FTS
+    table and are ranked with bm25, weighted by FIELD_WEIGHTS; terms matching
+    nothing are widened to the indexed terms within a small edit distance.
+
+    Each thread gets its own read-only connection; in WAL mode they read a
+    consistent snapshot while collect_json rewrites the catalog. Only
+    routes with a grade are listed, as in the viewer's by_grade view, and
+    results are ordered by numeric grade, then by store order.
+
+    When store_file is given, refresh() builds the catalog from that JSON
+    route store if it is missing or was built from other store content,
+    e.g. after a checkout. The store is only hashed again when its mtime or
+    size changed.
+    """
+
+    def __init__(self, catalog_file, store_file=None):
+        self.catalog_file = catalog_file
+        self.store_file = store_file
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.store_signature = None
+        self.store_sha256 = None
+        self.metrics = {
+            "queries": 0,
+            "query_seconds": 0.0,
+            "last_query_seconds": 0.0,
+            "builds": 0,
+            "build_seconds": 0.0,
+            "connections": 0,
+        }
+        start = time.perf_counter()
+        self.refresh()
+        self.metrics["open_seconds"] = time.perf_counter() - start
+
+    def _stale(self):
+        if self.store_file is None or not os.path.exists(self.store_file):
+            return False
+        if not os.path.exists(self.catalog_file):
+            return True
+        stat = os.stat(self.store_file)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self.store_signature:
+            with open(self.store_file, "rb") as file:
+                self.store_sha256 = hashlib.sha256(file.read()).hexdigest()
+            self.store_signature = signature
+        try:
+            meta = dict(
+                self._connection().execute(
+                    "SELECT key, value FROM meta "
+                    "WHERE key IN ('version', 'store_sha256')"
+                )
+            )
+        except sqlite3.DatabaseError:
+            return True
+        # A catalog written by another version has other tables
+        return meta != {
+            "version": str(CATALOG_VERSION),
+            "store_sha256": self.store_sha256,
+        }
+
+    def refresh(self):
+        """Rebuild the catalog from the store file when it is stale."""
+        if not self._stale():
+            return False
+        with self.lock:
+            if not self._stale():
+                return False
+            start = time.perf_counter()
+            with open(self.store_file, "rb") as file:
+                data = file.read()
+            save_catalog(
+                RouteStore.from_dict(json.loads(data)),
+                self.catalog_file,
+                hashlib.sha256(data).hexdigest(),
+            )
+            self.metrics["builds"] += 1
+            self.metrics["build_seconds"] = time.perf_counter() - start
+            return True
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = connect(
+                self.catalog_file, readonly=True
+            )
+            self.metrics["connections"] += 1
+        return connection
+
+    def _execute(self, sql, params=()):
+        start = time.perf_counter()
+        rows = self._connection().execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - start
+        self.metrics["queries"] += 1
+        self.metrics["query_seconds"] += elapsed
+        self.metrics["last_query_seconds"] = elapsed
+        return rows
+
+    def expand(self, term):
+        """
+        The term itself when some indexed term starts with it, otherwise the
+        indexed terms within its edit distance (see max_edits).
+        """
+        limit = max_edits(term)
+        if not limit or self._execute(
+            "SELECT 1 FROM routes_terms WHERE term >= ? AND term < ? LIMIT 1",
+            (term, term + "\uffff"),
+        ):
+            return [term]
+        candidates = self._execute(
+            "SELECT term FROM routes_terms WHERE length(term) BETWEEN ? AND ?",
+            (len(term) - limit, len(term) + limit),
+        )
+        return [term] + [
+            row[0] for row in candidates if edit_distance(term, row[0], limit) <= limit
+        ]
+
+    def fts_query(self, query):
+        """FTS5 expression requiring every query term, as a prefix or fuzzily."""
+        terms = []
+        for term in tokenize(query):
+            alternatives = " OR ".join(f'"{match}"*' for match in self.expand(term))
+            terms.append(f"({alternatives})")
+        return " AND ".join(terms)
+
+    def _where(self, grade=None, block=None, sector=None, query=None, source=None):
+        clauses, params = ["routes.grade <> ''"], []
+        if source is not None:
+            clauses.append("routes.source = ?")
+            params.append(source)
+        if grade:
+            clauses.append("routes.grade = ?")
+            params.append(grade)
+        if block:
+            clauses.append("routes.block_key = ?")
+            params.append(normalize_name(block))
+        if sector:
+            clauses.append("routes.sector_key = ?")
+            params.append(normalize_name(sector))
+        if query and tokenize(query):
+            clauses.append("routes_fts MATCH ?")
+            params.append(self.fts_query(query))
+        elif query and query.strip():
+            # A query without a single word matches nothing
+            clauses.append("0")
+        return " AND ".join(clauses), params
+
+    def _from(self, query):
+        if query and tokenize(query):
+            return "routes JOIN routes_fts ON routes_fts.rowid = routes.row"
+        return "routes"
+
+    def sources(self):
+        rows = self._execute(
+            "SELECT DISTINCT source FROM routes WHERE grade <> '' ORDER BY source"
+        )
+        return [row[0] for row in rows]
+
+    def sectors(self):
+        rows = self._execute(
+            "SELECT DISTINCT sector_key FROM routes WHERE grade <> '' "
+            "ORDER BY sector_key"
+        )
+        return [row[0] for row in rows]
+
+    def blocks(self, sector=None):
+        where, params = self._where(sector=sector)
+        rows = self._execute(
+            f"SELECT DISTINCT block_key FROM routes WHERE {where} ORDER BY block_key",
+            params,
+        )
+        return [row[0] for row in rows]
+
+    def grades(self, sector=None, block=None):
+        """Grades present under the filters, in numeric order."""
+        where, params = self._where(block=block, sector=sector)
+        rows = self._execute(
+            f"SELECT grade FROM routes WHERE {where} GROUP BY grade "
+            "ORDER BY MIN(grade_rank) IS NULL, MIN(grade_rank), grade",
+            params,
+        )
+        return [row[0] for row in rows]
+
+    def count(self, grade=None, block=None, sector=None, query=None, source=None):
+        where, params = self._where(grade, block, sector, query, source)
+        return self._execute(
+            f"SELECT COUNT(*) FROM {self._from(query)} WHERE {where}", params
+        )[0][0]
+
+    def filter(
+        self,
+        grade=None,
+        block=None,
+        sector=None,
+        query=None,
+        source=None,
+        limit=None,
+        offset=0,
+    ):
+        """
+        Routes matching all the given filters; None means no filter. Search
+        results are ranked best first. limit and offset select one page.
+        """
+        where, params = self._where(grade, block, sector, query, source)
+        if query and tokenize(query):
+            weights = ", ".join(str(FIELD_WEIGHTS[column]) for column in FTS_COLUMNS)
+            order = f"bm25(routes_fts, {weights}), routes.sort_key"
+        else:
+            order = "routes.grade_rank IS NULL, routes.grade_rank, routes.sort_key"
+        rows = self._execute(
+            f"SELECT routes.* FROM {self._from(query)} WHERE {where} "
+            f"ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset],
+        )
+        return [row_route(row) for row in rows]
+
+    @property
+    def data_version(self):
+        """Hash of the catalog content, changes whenever it is rebuilt."""
+        row = self._execute("SELECT value FROM meta WHERE key = 'data_version'")
+        return row[0][0] if row else None
+
+    def page_cache_bytes(self):
+        """Upper bound of SQLite's page cache, summed over the connections."""
+        connection = self._connection()
+        cache_size = connection.execute("PRAGMA cache_size").fetchone()[0]
+        if cache_size < 0:
+            # A negative size is in KiB, a positive one in pages
+            limit = -cache_size * 1024
+        else:
+            limit = cache_size * connection.execute("PRAGMA page_size").fetchone()[0]
+        return limit * self.metrics["connections"]
+
+    def stats(self):
+        """
+        Route count, file size on disk and page cache limit, with the time
+        taken to open the catalog, and to build it when it was stale, and
+        the query timings.
+        """
+        routes = self._execute("SELECT value FROM meta WHERE key = 'routes'")
+        file_bytes = sum(
+            os.path.getsize(path)
+            for path in (self.catalog_file, f"{self.catalog_file}-wal")
+            if os.path.exists(path)
+        )
+        return {
+            "routes": int(routes[0][0]) if routes else 0,
+            "file_bytes": file_bytes,
+            "page_cache_bytes": self.page_cache_bytes(),
+            **self.metrics,
+        }
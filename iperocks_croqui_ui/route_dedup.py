@@ -0,0 +1,256 @@
+import random
+import re
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+
+from iperocks_croqui_ui.route_store import route_id
+from iperocks_croqui_ui.search_index import tokenize
+from iperocks_croqui_ui.text_utils import normalize_name
+
+# MinHash signature of a name: BANDS bands of ROWS hashes. Names sharing a
+# band become candidates, so a pair with trigram similarity s is found with
+# probability 1 - (1 - s**ROWS) ** BANDS (0.9 at s = 0.5)
+BANDS = 8
+ROWS = 2
+# Buckets larger than this are too generic to tell routes apart and are not
+# paired, which keeps the number of comparisons linear in the routes
+MAX_BUCKET = 50
+# Score above which two routes are the same, lower when they also share
+# sector, block and id_number
+MATCH_SCORE = 0.7
+SAME_NUMBER_SCORE = 0.5
+# Share of the name in the score when both routes have a description
+NAME_WEIGHT = 0.7
+# Descriptions shorter than this many words are not compared
+MIN_DESCRIPTION_WORDS = 4
+# Blocks the LLM writes when it does not know the block name
+PLACEHOLDER_BLOCK = re.compile(r"^(bloco|block|boulder|n/?a)?\s*\d*$")
+UNKNOWN_GRADES = {"", "N/A", "NA", "?"}
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0)
+_HASHES = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(BANDS * ROWS)
+]
+
+
+def sector_key(sector):
+    """'SETOR BUFALO' and 'Setor Bufalo' both become 'bufalo'."""
+    return re.sub(r"^setor\s+", "", normalize_name(sector))
+
+
+def block_key(block):
+    """Normalized block name, empty when it is a placeholder like 'Bloco'."""
+    block = normalize_name(block)
+    return "" if PLACEHOLDER_BLOCK.match(block) else block
+
+
+def grade_key(grade):
+    grade = (grade or "").strip().upper()
+    return "" if grade in UNKNOWN_GRADES else grade
+
+
+@lru_cache(maxsize=65536)
+def name_shingles(name):
+    """Character trigrams of a normalized name."""
+    name = " ".join(tokenize(name))
+    if len(name) < 3:
+        return frozenset([name]) if name else frozenset()
+    return frozenset(name[i : i + 3] for i in range(len(name) - 2))
+
+
+@lru_cache(maxsize=65536)
+def name_bands(name):
+    """LSH bands of the MinHash signature of a name."""
+    values = [zlib.crc32(shingle.encode("utf-8")) for shingle in name_shingles(name)]
+    if not values:
+        return ()
+    signature = [min((a * v + b) % _PRIME for v in values) for a, b in _HASHES]
+    return tuple(
+        (band, tuple(signature[band * ROWS : (band + 1) * ROWS]))
+        for band in range(BANDS)
+    )
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def description_words(route):
+    words = frozenset(tokenize(route.get("description")))
+    return words if len(words) >= MIN_DESCRIPTION_WORDS else frozenset()
+
+
+def candidate_pairs(keys, routes, start=0):
+    """
+    Index pairs of routes worth comparing. Routes are blocked by sector,
+    then paired when they share block and id_number or a MinHash band of
+    their names, instead of comparing every pair. Routes before start are
+    not paired with each other.
+    """
+    buckets = defaultdict(list)
+    for i, (route, (sector, block, _)) in enumerate(zip(routes, keys)):
+        if block and route.get("id_number") is not None:
+            buckets[(sector, "id", block, str(route["id_number"]))].append(i)
+        for band in name_bands(route.get("name") or ""):
+            buckets[(sector, "name", band)].append(i)
+
+    pairs = set()
+    for members in buckets.values():
+        if 1 < len(members) <= MAX_BUCKET:
+            for x, j in enumerate(members):
+                if j >= start:
+                    for i in members[:x]:
+                        pairs.add((i, j))
+    return sorted(pairs)
+
+
+def match_score(a, b, key_a, key_b):
+    """
+    Similarity of two routes in [0, 1], or 0 when they cannot be the same
+    route: other sector, two different known blocks or grades, or different
+    numbers on the same block.
+    """
+    sector_a, block_a, grade_a = key_a
+    sector_b, block_b, grade_b = key_b
+    if sector_a != sector_b:
+        return 0.0
+    if block_a and block_b and block_a != block_b:
+        return 0.0
+    if grade_a and grade_b and grade_a != grade_b:
+        return 0.0
+    same_block = block_a and block_a == block_b
+    number_a, number_b = a.get("id_number"), b.get("id_number")
+    both_numbered = number_a is not None and number_b is not None
+    if same_block and both_numbered and str(number_a) != str(number_b):
+        return 0.0
+
+    score = jaccard(
+        name_shingles(a.get("name") or ""), name_shingles(b.get("name") or "")
+    )
+    words_a, words_b = description_words(a), description_words(b)
+    if words_a and words_b:
+        score = NAME_WEIGHT * score + (1 - NAME_WEIGHT) * jaccard(words_a, words_b)
+    if same_block and both_numbered:
+        # Same number on the same block: a lower bar, e.g. for OCR'd names
+        return score if score >= SAME_NUMBER_SCORE else 0.0
+    return score if score >= MATCH_SCORE else 0.0
+
+
+def completeness(route, key):
+    _, block, grade = key
+    return (bool(block), bool(grade), len(route.get("description") or ""))
+
+
+def merge_cluster(members, keys):
+    """
+    One route out of duplicates, given in store order. The first of the
+    most complete ones is kept, with its placeholder block, unknown grade or
+    missing number and description filled in from the others. "provenance"
+    lists where each copy was read, including the copies of routes that
+    were already merged.
+    """
+    best = members[0]
+    for member in members[1:]:
+        if completeness(member[1], keys[member[0]]) > completeness(
+            best[1], keys[best[0]]
+        ):
+            best = member
+    merged = dict(best[1])
+    # The id is kept even when the fields it is derived from get filled in
+    merged["route_id"] = merged.get("route_id") or route_id(merged)
+    for i, route in members:
+        _, block, grade = keys[i]
+        if block and not block_key(merged.get("block")):
+            merged["block"] = route["block"]
+        if grade and not grade_key(merged.get("grade")):
+            merged["grade"] = route["grade"]
+        if merged.get("id_number") is None:
+            merged["id_number"] = route.get("id_number")
+        if len(route.get("description") or "") > len(merged.get("description") or ""):
+            merged["description"] = route["description"]
+    merged["provenance"] = [
+        copy
+        for _, route in members
+        for copy in route.get("provenance")
+        or [
+            {
+                "route_id": route.get("route_id") or route_id(route),
+                "source": route.get("source"),
+                "page_number": route.get("page_number"),
+            }
+        ]
+    ]
+    return merged
+
+
+def merge_duplicates(routes, start=0, order=None):
+    """
+    Merge routes that were extracted more than once, e.g. from several
+    pages or guidebook revisions. Merged routes take the place of their
+    first copy; other routes are returned unchanged and in order.
+
+    The first start routes are taken as already merged, e.g. the routes of
+    the current store, and are only compared with the routes after them.
+    order, when given, holds the sort key of each route in store order, to
+    be used instead of its position to order the copies of a merged route.
+    """
+    keys = [
+        (
+            sector_key(route.get("sector")),
+            block_key(route.get("block")),
+            grade_key(route.get("grade")),
+        )
+        for route in routes
+    ]
+
+    # Union-find over the matching pairs. The known blocks, grades and block
+    # numbers of each cluster are tracked, so that a copy with a placeholder
+    # block cannot chain two different routes together
+    parent = list(range(len(routes)))
+    known = [
+        (
+            {block} - {""},
+            {grade} - {""},
+            (
+                {str(route["id_number"])}
+                if block and route.get("id_number") is not None
+                else set()
+            ),
+        )
+        for route, (_, block, grade) in zip(routes, keys)
+    ]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in candidate_pairs(keys, routes, start):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j or not match_score(routes[i], routes[j], keys[i], keys[j]):
+            continue
+        merged = tuple(a | b for a, b in zip(known[root_i], known[root_j]))
+        if all(len(values) <= 1 for values in merged):
+            root, other = min(root_i, root_j), max(root_i, root_j)
+            parent[other] = root
+            known[root] = merged
+
+    clusters = defaultdict(list)
+    for i, route in enumerate(routes):
+        clusters[find(i)].append((i, route))
+    if order is not None:
+        for members in clusters.values():
+            members.sort(key=lambda member: order[member[0]])
+
+    merged = []
+    for i, route in enumerate(routes):
+        members = clusters.get(i)
+        if members is None:
+            continue
+        merged.append(route if len(members) == 1 else merge_cluster(members, keys))
+    return merged
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+
+STORE_VERSION = 2
+
+# Route fields kept in the store, in column order
+COLUMNS = (
+    "id_number",
+    "name",
+    "grade",
+    "description",
+    "page_number",
+    "block",
+    "sector",
+    "source",
+)
+# Columns stored as integer codes into a string table, each with an index
+CATEGORIES = ("grade", "block", "sector", "source")
+# Legacy consolidated shape: category -> key in the old JSON
+LEGACY_KEYS = {"grade": "by_grade", "block": "by_block", "sector": "by_sector"}
+
+
+def route_id(route):
+    """Stable id of a route, derived from where it was found and its name."""
+    key = "\x1f".join(
+        str(route.get(field) or "")
+        for field in ("source", "page_number", "id_number", "name")
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def route_copies(route):
+    """Ids of the page routes a store route was built from."""
+    provenance = route.get("provenance")
+    if provenance:
+        return [copy["route_id"] for copy in provenance]
+    return [route.get("route_id") or route_id(route)]
+
+
+class RouteStore:
+    """
+    De-duplicated, columnar route table.
+
+    Every route is stored once. Grade, block and sector are dictionary-encoded
+    as integer codes, and `indexes[category][code]` lists the rows with that
+    value, so grouping never copies route records.
+    """
+
+    def __init__(self, columns, strings, indexes):
+        self.columns = columns
+        self.strings = strings
+        self.indexes = indexes
+        self.ids = columns["route_id"]
+        self.row_of = {rid: row for row, rid in enumerate(self.ids)}
+        self.codes = {
+            category: {value: code for code, value in enumerate(values)}
+            for category, values in strings.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_routes(cls, routes):
+        """Build a store from route dicts, dropping repeated route ids."""
+        extra = sorted(
+            {field for route in routes for field in route} - set(COLUMNS) - {"route_id"}
+        )
+        names = ("route_id",) + COLUMNS + tuple(extra)
+        columns = {name: [] for name in names}
+        strings = {category: [] for category in CATEGORIES}
+        codes = {category: {} for category in CATEGORIES}
+        seen = set()
+
+        for route in routes:
+            rid = route.get("route_id") or route_id(route)
+            if rid in seen:
+                continue
+            seen.add(rid)
+            columns["route_id"].append(rid)
+            for name in names[1:]:
+                value = route.get(name)
+                if name in codes:
+                    value = value or ""
+                    code = codes[name].get(value)
+                    if code is None:
+                        code = codes[name][value] = len(strings[name])
+                        strings[name].append(value)
+                    value = code
+                columns[name].append(value)
+
+        indexes = {}
+        for category in CATEGORIES:
+            postings = [[] for _ in strings[category]]
+            for row, code in enumerate(columns[category]):
+                postings[code].append(row)
+            indexes[category] = postings
+        return cls(columns, strings, indexes)
+
+    def value(self, row, name):
+        value = self.columns[name][row]
+        return self.strings[name][value] if name in self.strings else value
+
+    def route(self, row):
+        """Materialize the route dict stored at a row."""
+        return {name: self.value(row, name) for name in self.columns}
+
+    def routes(self, rows=None):
+        rows = range(len(self)) if rows is None else rows
+        return [self.route(row) for row in rows]
+
+    def rows_for(self, category, value):
+        """Rows whose category (grade/block/sector/source) equals value."""
+        code = self.codes[category].get(value)
+        return [] if code is None else self.indexes[category][code]
+
+    def to_legacy(self, categories=tuple(LEGACY_KEYS)):
+        """
+        Emit the old {"by_grade", "by_block", "by_sector"} shape for existing
+        consumers. Routes with an empty value are left out, as before.
+        """
+        routes = self.routes()
+        legacy = {}
+        for category in categories:
+            legacy[LEGACY_KEYS[category]] = {
+                value: [routes[row] for row in self.indexes[category][code]]
+                for code, value in enumerate(self.strings[category])
+                if value
+            }
+        return legacy
+
+    def to_dict(self):
+        return {
+            "version": STORE_VERSION,
+            "columns": self.columns,
+            "strings": self.strings,
+            "indexes": self.indexes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported route store version {data.get('version')}")
+        return cls(data["columns"], data["strings"], data["indexes"])
+
+
+def save_store(store, output_file):
+    """Write the store as compact JSON, atomically."""
+    temp_file = f"{output_file}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as file:
+        file.write(
+            json.dumps(store.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        )
+    os.replace(temp_file, output_file)
+
+
+def load_store(store_file):
+    with open(store_file, "r", encoding="utf-8") as file:
+        return RouteStore.from_dict(json.load(file))
+
+
+def load_legacy(path):
+    """
+    Read routes in the old consolidated shape from either file format, so
+    code written against consolidated_routes.json keeps working.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    if "columns" in data:
+        return RouteStore.from_dict(data).to_legacy()
+    return data
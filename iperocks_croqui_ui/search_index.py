@@ -0,0 +1,39 @@
+import re
+
+from iperocks_croqui_ui.text_utils import normalize_name
+
+# Weight of a term match in each route field
+FIELD_WEIGHTS = {"name": 3.0, "block": 2.0, "sector": 1.0, "description": 1.0}
+
+
+def tokenize(text):
+    """Accent-insensitive, lowercase word tokens."""
+    return re.findall(r"[a-z0-9]+", normalize_name(text))
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(term):
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, or limit + 1 as soon as it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
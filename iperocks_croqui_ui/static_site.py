@@ -0,0 +1,391 @@
+import argparse
+import html
+import json
+import os
+
+from iperocks_croqui_ui.page_pack import PagePack
+from iperocks_croqui_ui.renditions import RENDITION_FOLDER, pick_packed_rendition
+from iperocks_croqui_ui.route_catalog import RouteCatalog
+from iperocks_croqui_ui.text_utils import normalize_name
+
+# Width of the page renditions copied into the site
+IMAGE_WIDTH = 960
+SITE_TITLE = "Climbing Routes"
+
+STYLE = """
+body { font-family: sans-serif; margin: 0; display: flex; flex-wrap: wrap; }
+nav { padding: 1em; width: 16em; background: #f0f2f6; box-sizing: border-box; }
+nav label { display: block; margin-top: 0.8em; font-size: 0.85em; }
+nav select, nav input { width: 100%; }
+main { flex: 1; padding: 1em; min-width: 18em; }
+img { max-width: 100%; height: auto; }
+.buttons a { display: inline-block; padding: 0.4em 1.2em; margin-right: 0.5em;
+  border: 1px solid #ccc; border-radius: 0.4em; text-decoration: none; }
+.buttons a.disabled { pointer-events: none; opacity: 0.4; }
+.caption { color: #666; font-size: 0.85em; }
+"""
+
+# Filters, search and prev/next run in the browser over window.CATALOG; the
+# state lives in the URL hash, so views can be bookmarked and shared
+SCRIPT = """
+const C = window.CATALOG;
+const $ = (id) => document.getElementById(id);
+const norm = (s) => s.normalize("NFD").replace(/[\\u0300-\\u036f]/g, "").toLowerCase();
+const keys = ["source", "sector", "block", "grade", "q", "r"];
+
+function readState() {
+  const params = new URLSearchParams(location.hash.slice(1));
+  return Object.fromEntries(keys.map((k) => [k, params.get(k) || ""]));
+}
+
+function hashOf(state) {
+  const params = new URLSearchParams();
+  keys.forEach((k) => state[k] && params.set(k, state[k]));
+  return "#" + params.toString();
+}
+
+function writeState(state) {
+  location.hash = hashOf(state);
+}
+
+function rows(state, grade) {
+  return C.filters[[state.source, state.sector, state.block, grade].join("|")] || [];
+}
+
+function distinct(list, field) {
+  return [...new Set(list.map((i) => C.routes[i][field]))];
+}
+
+function fill(select, options, value) {
+  select.replaceChildren(new Option("All", ""), ...options.map((o) => new Option(o, o)));
+  select.value = options.includes(value) ? value : "";
+  return select.value;
+}
+
+function render() {
+  const state = readState();
+  if (C.sources.length > 1) {
+    $("source-filter").hidden = false;
+    state.source = fill($("source"), C.sources, state.source);
+  }
+  state.sector = fill($("sector"), C.sectors, state.sector);
+  const blocks = distinct(rows({ ...state, block: "" }, ""), "block_key").sort();
+  state.block = fill($("block"), blocks, state.block);
+  state.grade = fill($("grade"), distinct(rows(state, ""), "grade"), state.grade);
+  $("q").value = state.q;
+
+  let found = rows(state, state.grade);
+  const terms = norm(state.q).match(/[a-z0-9]+/g) || [];
+  if (state.q.trim()) {
+    found = found.filter((i) => {
+      const words = C.routes[i].search.split(" ");
+      return terms.length && terms.every((t) => words.some((w) => w.startsWith(t)));
+    });
+  }
+  $("count").textContent = `Filtered results (${found.length} routes found)`;
+
+  const select = $("route");
+  select.replaceChildren(
+    ...found.map((i) => new Option(`${C.routes[i].name} (${C.routes[i].grade})`, C.routes[i].id))
+  );
+  let position = found.findIndex((i) => C.routes[i].id === state.r);
+  if (position < 0) position = 0;
+  const route = found.length ? C.routes[found[position]] : null;
+  $("view").hidden = !route;
+  $("empty").hidden = !!route;
+  if (!route) return;
+  select.value = route.id;
+  $("title").textContent = `${route.sector} / ${route.block} / ${route.name} - ${route.grade}`;
+  $("description").textContent = route.description;
+  $("image").src = route.image || "";
+  $("image").hidden = !route.image;
+  $("page").textContent = route.image ? `Page ${route.page_number}` : "Image not available";
+  $("link").href = `routes/${route.id}.html`;
+
+  const link = (a, i) => {
+    a.classList.toggle("disabled", i < 0 || i >= found.length);
+    if (i >= 0 && i < found.length) {
+      a.href = hashOf({ ...state, r: C.routes[found[i]].id });
+    }
+  };
+  link($("prev"), position - 1);
+  link($("next"), position + 1);
+}
+
+["source", "sector", "block", "grade", "route"].forEach((id) =>
+  $(id).addEventListener("change", () => {
+    const state = readState();
+    state[id === "route" ? "r" : id] = $(id).value;
+    writeState(state);
+  })
+);
+$("q").addEventListener("change", () => writeState({ ...readState(), q: $("q").value }));
+window.addEventListener("hashchange", render);
+render();
+"""
+
+
+def page(title, body, root=""):
+    return (
+        '<!DOCTYPE html>\n<html lang="pt">\n<head>\n<meta charset="utf-8">\n'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+        f"<title>{html.escape(title)}</title>\n"
+        f'<link rel="stylesheet" href="{root}style.css">\n</head>\n'
+        f"<body>\n{body}\n</body>\n</html>\n"
+    )
+
+
+def index_page():
+    def select(name, label, hidden=False):
+        return (
+            f'<div id="{name}-filter"{" hidden" if hidden else ""}>'
+            f'<label for="{name}">{label}</label><select id="{name}"></select></div>'
+        )
+
+    body = (
+        "<nav>\n"
+        '<label for="q">Search</label>'
+        '<input id="q" type="search" placeholder="e.g. reglete, SDS, travessia">\n'
+        + select("source", "Select Guidebook", hidden=True)
+        + select("sector", "Select Sector")
+        + select("block", "Select Block")
+        + select("grade", "Select Grade")
+        + '\n<p class="caption" id="count"></p>'
+        '<select id="route" aria-label="Select Route"></select>\n</nav>\n'
+        '<main>\n<p id="empty" hidden>No routes match the selected criteria. '
+        "Please adjust your filters.</p>\n"
+        '<div id="view" hidden>\n<h2 id="title"></h2>\n<p id="description"></p>\n'
+        '<img id="image" alt="">\n<p class="caption" id="page"></p>\n'
+        '<p class="buttons"><a id="prev">Previous</a><a id="next">Next</a></p>\n'
+        '<p class="caption"><a id="link">Link to this route</a></p>\n</div>\n'
+        "</main>\n"
+        '<script src="data/catalog.js"></script>\n'
+        '<script src="app.js"></script>'
+    )
+    return page(SITE_TITLE, body)
+
+
+def route_page(route, previous, following):
+    """Pre-rendered page of one route, readable without JavaScript."""
+    title = f"{route['sector']} / {route['block']} / {route['name']} - {route['grade']}"
+    image = (
+        f'<img src="../{html.escape(route["image"])}" alt="">'
+        f'<p class="caption">Page {route["page_number"]}</p>'
+        if route["image"]
+        else "<p>Image not available</p>"
+    )
+
+    def link(other, label):
+        if other is None:
+            return f'<a class="disabled">{label}</a>'
+        return f'<a href="{other["id"]}.html">{label}</a>'
+
+    body = (
+        f"<main>\n<h2>{html.escape(title)}</h2>\n"
+        f"<p>{html.escape(route['description'] or '')}</p>\n{image}\n"
+        f'<p class="buttons">{link(previous, "Previous")}{link(following, "Next")}'
+        f'</p>\n<p class="caption"><a href="../index.html#r={route["id"]}">'
+        "Browse all routes</a></p>\n</main>"
+    )
+    return page(title, body, root="../")
+
+
+def write_file(path, data):
+    """Write a file of the site, leaving it untouched when unchanged."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, "rb") as file:
+            if file.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+    return True
+
+
+def remove_stale_files(site_dir, folder, keep):
+    """
+    Delete the files under a folder of the site whose site path is not in
+    keep, and the folders left empty. Returns the number of files deleted.
+    """
+    top = os.path.join(site_dir, folder)
+    removed = 0
+    for dirpath, _, filenames in os.walk(top, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.relpath(path, site_dir).replace(os.sep, "/") not in keep:
+                os.remove(path)
+                removed += 1
+        if dirpath != top and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
+def copy_page_image(pack, site_dir, source, page_number, width):
+    """
+    Copy one page rendition from the pack into the site, or the packed page
+    PNG when the page has no rendition. Returns its site path.
+    """
+    name = pick_packed_rendition(pack, page_number, width)
+    if name is None:
+        print(f"Page {page_number} is not packed in {pack.folder}, no image")
+        return None
+    if not name.startswith(f"{RENDITION_FOLDER}/"):
+        print(
+            f"No rendition of page {page_number} in {pack.folder}, copying the "
+            "page PNG (python -m iperocks_croqui_ui.renditions generates them)"
+        )
+    extension = os.path.splitext(name)[1]
+    site_path = f"images/{source or '_'}/page_{page_number}{extension}"
+    write_file(os.path.join(site_dir, site_path), pack.get(name))
+    return site_path
+
+
+def build_site(catalog, output_root, site_dir, image_width=IMAGE_WIDTH):
+    """
+    Generate the static catalog site in site_dir.
+
+    Parameters:
+    - catalog (RouteCatalog): Routes to publish, in catalog order.
+    - output_root (str): Folder of the guidebook folders and their images.
+    - site_dir (str): Folder the site is written to.
+    - image_width (int): Smallest width of the page renditions copied.
+
+    The site has an index.html where filtering, search and navigation run
+    in the browser, one pre-rendered page per route under routes/, and the
+    catalog with its precomputed filter results in data/catalog.js, which
+    is loaded as a script so the site also works opened from disk. Files
+    whose content did not change are not rewritten, and route pages and
+    images no longer in the catalog are deleted. Returns the number of
+    routes published.
+    """
+    routes = catalog.filter()
+    packs = {}
+    images = {}
+    published = []
+    for route in routes:
+        source = route.get("source") or ""
+        key = (source, route["page_number"])
+        if key not in images:
+            folder = os.path.join(output_root, source)
+            if folder not in packs:
+                packs[folder] = PagePack(folder)
+            images[key] = copy_page_image(
+                packs[folder],
+                site_dir,
+                source,
+                route["page_number"],
+                image_width,
+            )
+        published.append(
+            {
+                "id": route["route_id"],
+                "name": route["name"],
+                "grade": route["grade"],
+                "description": route["description"],
+                "page_number": route["page_number"],
+                "block": route["block"],
+                "sector": route["sector"],
+                "source": source,
+                "block_key": normalize_name(route["block"]),
+                "sector_key": normalize_name(route["sector"]),
+                "image": images[key],
+                "search": " ".join(
+                    normalize_name(route.get(field))
+                    for field in ("name", "description", "block", "sector")
+                ),
+            }
+        )
+
+    # Route positions for every source|sector|block|grade combination,
+    # where an empty value stands for "All"
+    filters = {}
+    for position, route in enumerate(published):
+        for source in ("", route["source"]):
+            for sector in ("", route["sector_key"]):
+                for block in ("", route["block_key"]):
+                    for grade in ("", route["grade"]):
+                        key = "|".join((source, sector, block, grade))
+                        positions = filters.setdefault(key, [])
+                        if not positions or positions[-1] != position:
+                            positions.append(position)
+
+    data = {
+        "version": catalog.data_version,
+        "sources": sorted({route["source"] for route in published}),
+        "sectors": sorted({route["sector_key"] for route in published}),
+        "routes": published,
+        "filters": filters,
+    }
+    write_file(
+        os.path.join(site_dir, "data", "catalog.js"),
+        "window.CATALOG = "
+        + json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        + ";\n",
+    )
+    write_file(os.path.join(site_dir, "index.html"), index_page())
+    write_file(os.path.join(site_dir, "style.css"), STYLE.lstrip())
+    write_file(os.path.join(site_dir, "app.js"), SCRIPT.lstrip())
+    for position, route in enumerate(published):
+        previous = published[position - 1] if position > 0 else None
+        following = published[position + 1] if position + 1 < len(published) else None
+        write_file(
+            os.path.join(site_dir, "routes", f"{route['id']}.html"),
+            route_page(route, previous, following),
+        )
+
+    # Routes removed from the catalog since the last build, and their images
+    remove_stale_files(
+        site_dir, "routes", {f"routes/{route['id']}.html" for route in published}
+    )
+    remove_stale_files(site_dir, "images", set(images.values()))
+    return len(published)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a static site of the route catalog and page images."
+    )
+    parser.add_argument(
+        "-o",
+        "--site-dir",
+        type=str,
+        default="site",
+        help="Folder the site is written to.",
+    )
+    parser.add_argument(
+        "--catalog-file",
+        type=str,
+        default="output/routes.sqlite",
+        help="SQLite route catalog written by collect_json.",
+    )
+    parser.add_argument(
+        "--store-file",
+        type=str,
+        default="output/routes_store.json",
+        help="Route store the catalog is built from when it is missing or older.",
+    )
+    parser.add_argument(
+        "--output-root",
+        type=str,
+        default="output",
+        help="Folder containing the guidebook folders of page images.",
+    )
+    parser.add_argument(
+        "--image-width",
+        type=int,
+        default=IMAGE_WIDTH,
+        help="Smallest width of the page renditions copied into the site.",
+    )
+    args = parser.parse_args()
+
+    catalog = RouteCatalog(args.catalog_file, args.store_file)
+    routes = build_site(catalog, args.output_root, args.site_dir, args.image_width)
+    print(f"{routes} routes published to {args.site_dir}")
+
+
+if __name__ == "__main__":
+    main()
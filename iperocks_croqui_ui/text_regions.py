@@ -0,0 +1,186 @@
+import re
+
+import pdfplumber
+from PIL import Image, ImageChops, ImageFilter
+
+# The page image is analysed on a grid of CELL x CELL pixel cells
+CELL = 8
+# Local contrast above which a pixel is ink, and below which it is background
+INK_THRESHOLD = 40
+FLAT_THRESHOLD = 6
+# A text cell has this share of ink and sits among this share of background,
+# which tells text on a slide apart from a textured photo
+MIN_INK = 0.1
+MIN_FLAT = 0.27
+# Straight ink runs at least this long (px) are frames and rules, not text
+LINE_LENGTH = 24
+# Smallest region kept, in cells, and margin added around each region (px)
+MIN_CELLS = 3
+PADDING = 4
+# When the regions cover more of the page than this, OCR the whole page
+MAX_COVERAGE = 0.7
+
+
+def local_contrast(gray):
+    """Morphological gradient: max minus min over each 3x3 neighbourhood."""
+    return ImageChops.subtract(
+        gray.filter(ImageFilter.MaxFilter(3)), gray.filter(ImageFilter.MinFilter(3))
+    )
+
+
+def remove_lines(ink):
+    """Drop horizontal and vertical ink runs of at least LINE_LENGTH px."""
+    width, height = ink.size
+    # A block of LINE_LENGTH px that is all ink is part of a straight line
+    for size in ((width // LINE_LENGTH, height), (width, height // LINE_LENGTH)):
+        if 0 in size:
+            continue
+        runs = ink.resize(size, Image.BOX).point(lambda v: 255 if v >= 250 else 0)
+        scaled = (size[0] * (width // size[0]), size[1] * (height // size[1]))
+        lines = Image.new("L", ink.size)
+        lines.paste(runs.resize(scaled, Image.NEAREST), (0, 0))
+        ink = ImageChops.subtract(ink, lines.filter(ImageFilter.MaxFilter(5)))
+    return ink
+
+
+def text_cell_mask(image):
+    """Rows of booleans telling which grid cells look like text."""
+    gray = image.convert("L")
+    contrast = local_contrast(gray)
+    ink = remove_lines(contrast.point(lambda v: 255 if v > INK_THRESHOLD else 0))
+    flat = contrast.point(lambda v: 255 if v < FLAT_THRESHOLD else 0)
+
+    grid = (gray.width // CELL, gray.height // CELL)
+    ink_share = ink.resize(grid, Image.BOX).load()
+    # Background share over the 3x3 cells around each cell
+    flat_share = flat.resize(grid, Image.BOX).filter(ImageFilter.BoxBlur(1)).load()
+    return [
+        [
+            ink_share[x, y] > MIN_INK * 255 and flat_share[x, y] > MIN_FLAT * 255
+            for x in range(grid[0])
+        ]
+        for y in range(grid[1])
+    ]
+
+
+def connected_boxes(mask):
+    """
+    Pixel boxes of the groups of text cells. Cells up to two columns or one
+    row apart are joined, so the words of a line and the lines of a block
+    end up in the same box.
+    """
+    rows, cols = len(mask), len(mask[0]) if mask else 0
+    seen = set()
+    boxes = []
+    for y in range(rows):
+        for x in range(cols):
+            if not mask[y][x] or (x, y) in seen:
+                continue
+            stack = [(x, y)]
+            seen.add((x, y))
+            x0, y0, x1, y1, cells = x, y, x, y, 0
+            while stack:
+                cx, cy = stack.pop()
+                cells += 1
+                x0, y0, x1, y1 = min(x0, cx), min(y0, cy), max(x1, cx), max(y1, cy)
+                for nx in range(cx - 2, cx + 3):
+                    for ny in range(cy - 1, cy + 2):
+                        if (
+                            0 <= nx < cols
+                            and 0 <= ny < rows
+                            and mask[ny][nx]
+                            and (nx, ny) not in seen
+                        ):
+                            seen.add((nx, ny))
+                            stack.append((nx, ny))
+            if cells >= MIN_CELLS:
+                boxes.append((x0 * CELL, y0 * CELL, (x1 + 1) * CELL, (y1 + 1) * CELL))
+    return boxes
+
+
+def merge_boxes(boxes, gap=0):
+    """Union boxes that overlap or are closer than gap pixels."""
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if (
+                    box[0] <= other[2] + gap
+                    and other[0] <= box[2] + gap
+                    and box[1] <= other[3] + gap
+                    and other[1] <= box[3] + gap
+                ):
+                    result[i] = (
+                        min(box[0], other[0]),
+                        min(box[1], other[1]),
+                        max(box[2], other[2]),
+                        max(box[3], other[3]),
+                    )
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def pdf_word_boxes(pdf_path, page_number):
+    """
+    Word boxes of a 1-based PDF page as fractions of the page size. Their
+    positions are usable even when the text itself is not decodable.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        page = pdf.pages[page_number - 1]
+        return [
+            (
+                word["x0"] / page.width,
+                word["top"] / page.height,
+                word["x1"] / page.width,
+                word["bottom"] / page.height,
+            )
+            for word in page.extract_words()
+        ]
+
+
+def find_text_regions(image, word_boxes=None):
+    """
+    Boxes (in reading order) of the text blocks of a page image.
+
+    Text cells found in the pixels are combined with the PDF word boxes,
+    when given, since slides may carry text both as glyphs and inside
+    pictures. Returns None when the regions would cover most of the page,
+    so it is OCR'd whole.
+    """
+    width, height = image.size
+    boxes = connected_boxes(text_cell_mask(image))
+    boxes += [
+        (int(x0 * width), int(y0 * height), int(x1 * width) + 1, int(y1 * height) + 1)
+        for x0, y0, x1, y1 in word_boxes or ()
+    ]
+
+    regions = [
+        (
+            max(0, x0 - PADDING),
+            max(0, y0 - PADDING),
+            min(width, x1 + PADDING),
+            min(height, y1 + PADDING),
+        )
+        for x0, y0, x1, y1 in merge_boxes(boxes)
+    ]
+    covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if not regions or covered > MAX_COVERAGE * width * height:
+        return None
+    return sorted(regions, key=lambda box: (box[1], box[0]))
+
+
+def clean_ocr_text(text):
+    """Drop OCR lines without a single word or number, typically photo noise."""
+    lines = [
+        line.strip()
+        for line in text.splitlines()
+        if re.search(r"[^\W_]{2,}", line) or not line.strip()
+    ]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
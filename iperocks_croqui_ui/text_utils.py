@@ -0,0 +1,6 @@
+from unidecode import unidecode
+
+
+# Normalize names by converting to lowercase and removing accents
+def normalize_name(name):
+    return unidecode(name).strip().lower() if name else ""
@@ -0,0 +1,22 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class TokenUsage(BaseCallbackHandler):
+    """Callback adding up the token usage reported by the chat model."""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    self.input_tokens += usage.get("input_tokens", 0)
+                    self.output_tokens += usage.get("output_tokens", 0)
+
+    def record(self, page_metrics):
+        page_metrics.count("input_tokens", self.input_tokens)
+        page_metrics.count("output_tokens", self.output_tokens)
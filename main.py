@@ -1,43 +1,75 @@
 import argparse
 import os
 
-from iperocks_croqui_ui.pdf_converter import pdf_to_png_and_extract_text
+from iperocks_croqui_ui.metrics import RunMetrics
 
 
-def parse_page_ranges(pages, total_pages=200):
+def parse_page_ranges(pages, total_pages=None):
     """
     Convert a page range string like '1-5,6,7' into a list of page indices.
+
+    Returns None (all pages) when no range is given. Pages above total_pages
+    are dropped when it is given; otherwise each PDF clips them to its own
+    page count.
     """
+    if not pages:
+        return None
+
     pages_set = set()
-    if pages:
-        ranges = pages.split(",")
-
-        for r in ranges:
-            if "-" in r:
-                start, end = r.split("-")
-                try:
-                    pages_set.update(range(int(start), int(end) + 1))
-                except ValueError:
-                    print(f"Error: Invalid page range '{r}'.")
-                    exit(1)
-            else:
-                try:
-                    pages_set.add(int(r))
-                except ValueError:
-                    print(f"Error: Invalid page number '{r}'.")
-                    exit(1)
+    ranges = pages.split(",")
+
+    for r in ranges:
+        if "-" in r:
+            start, end = r.split("-")
+            try:
+                pages_set.update(range(int(start), int(end) + 1))
+            except ValueError:
+                print(f"Error: Invalid page range '{r}'.")
+                exit(1)
+        else:
+            try:
+                pages_set.add(int(r))
+            except ValueError:
+                print(f"Error: Invalid page number '{r}'.")
+                exit(1)
 
     # Ensure pages are within valid range
-    return sorted(p for p in pages_set if 1 <= p <= total_pages)
+    return sorted(
+        p for p in pages_set if 1 <= p and (total_pages is None or p <= total_pages)
+    )
+
+
+def find_pdfs(inputs):
+    """Expand files and directories into a sorted list of PDF paths."""
+    pdf_paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pdf_paths.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(".pdf")
+            )
+        elif os.path.isfile(path):
+            pdf_paths.append(path)
+        else:
+            print(f"Error: PDF file '{path}' not found.")
+            exit(1)
+    return pdf_paths
 
 
 def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Convert PDF pages to PNG images.")
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="PDF files or folders of PDF files to ingest together.",
+    )
     parser.add_argument(
         "--pdf-filename",
         type=str,
-        required=True,
+        action="append",
+        default=[],
         help="The name of the PDF file (with extension) in the assets folder.",
     )
     parser.add_argument(
@@ -54,20 +86,96 @@ def main():
         default=None,
         help="Comma-separated list of page numbers to convert (e.g., '1,2,5-10').",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parallel workers for OCR and route extraction.",
+    )
+    parser.add_argument(
+        "--llm",
+        choices=["openai", "fake"],
+        default="openai",
+        help="LLM backend for route extraction ('fake' runs offline).",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        help="Maximum LLM requests per second.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=".croqui_cache",
+        help="Folder of the content-addressed OCR/LLM cache.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Only reuse existing page files, without the content-addressed cache.",
+    )
+    parser.add_argument(
+        "--text-source",
+        choices=["auto", "text-layer", "ocr"],
+        default="auto",
+        help="Use the PDF text layer, falling back to OCR ('auto'), or force one.",
+    )
+    parser.add_argument(
+        "--ocr-layout",
+        choices=["regions", "page"],
+        default="regions",
+        help="OCR only the text regions found on each page, or whole pages.",
+    )
+    parser.add_argument(
+        "--no-renditions",
+        action="store_true",
+        help="Skip generating the WebP renditions of the page images.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="JSON lines file the per-page metrics are appended to "
+        "(default: ingest_metrics.jsonl in the output folder).",
+    )
 
     # Parse arguments
     args = parser.parse_args()
 
-    # Check if the PDF file exists
-    if not os.path.isfile(args.pdf_filename):
-        print(f"Error: PDF file '{args.pdf_filename}' not found.")
-        exit(1)
+    # Collect the PDF files to convert
+    pdf_paths = find_pdfs(args.pdf_filename + args.inputs)
+    if not pdf_paths:
+        parser.error("no PDF files given")
 
-    # Parse page numbers
+    # Parse page numbers, each PDF clips them to its real page count
     page_numbers = parse_page_ranges(args.pages)
 
-    # Convert the PDF to PNG images
-    pdf_to_png_and_extract_text(args.pdf_filename, args.output_folder, page_numbers)
+    # Per-page stage timings, appended to a JSON lines file
+    metrics = RunMetrics(
+        args.metrics_file or os.path.join(args.output_folder, "ingest_metrics.jsonl")
+    )
+
+    # Imported once the arguments are valid, so --help answers immediately
+    from iperocks_croqui_ui.pdf_converter import ingest_pdfs
+
+    # Convert the PDFs to PNG images, sharing one worker pool
+    ingest_pdfs(
+        pdf_paths,
+        args.output_folder,
+        page_numbers,
+        workers=args.workers,
+        llm_backend=args.llm,
+        requests_per_second=args.rate_limit,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        text_strategy=args.text_source,
+        ocr_layout=args.ocr_layout,
+        renditions=not args.no_renditions,
+        metrics=metrics,
+    )
+    metrics.close()
+    print(metrics.report())
 
 
 if __name__ == "__main__":
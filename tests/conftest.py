@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def make_route():
+    """Factory of page routes, with the given fields replaced."""
+
+    def make_route(id_number=1, **fields):
+        route = {
+            "id_number": id_number,
+            "name": f"Route {id_number}",
+            "grade": "V3",
+            "description": "Sai sentado na aresta esquerda e cruza o teto",
+            "page_number": 7,
+            "block": "Pedra Grande",
+            "sector": "Setor Bufalo",
+            "source": "Croqui_v4",
+        }
+        route.update(fields)
+        return route
+
+    return make_route
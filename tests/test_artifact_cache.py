@@ -0,0 +1,35 @@
+import itertools
+
+from iperocks_croqui_ui import artifact_cache
+from iperocks_croqui_ui.artifact_cache import ArtifactCache, blob_path, hash_bytes
+
+
+def test_blob_is_found_again_after_a_restart(tmp_path):
+    key = hash_bytes("llm", "page text")
+    cache = ArtifactCache(str(tmp_path))
+    assert cache.get_text(key) is None
+    cache.put_text(key, '{"routes": []}')
+    cache.save()
+
+    cache = ArtifactCache(str(tmp_path))
+
+    assert cache.get_text(key) == '{"routes": []}'
+    assert cache.stats == {"hits": 1, "misses": 0, "evictions": 0}
+    assert cache.total_bytes == len('{"routes": []}')
+
+
+def test_least_recently_used_blob_is_evicted(tmp_path, monkeypatch):
+    # One tick per access, so the order does not depend on the clock
+    clock = itertools.count()
+    monkeypatch.setattr(artifact_cache.time, "time", lambda: next(clock))
+    cache = ArtifactCache(str(tmp_path), max_bytes=10)
+    cache.put("first", b"1111")
+    cache.put("second", b"2222")
+    assert cache.get("first") == b"1111"
+
+    cache.put("third", b"3333")
+
+    assert sorted(cache.entries) == ["first", "third"]
+    assert cache.stats["evictions"] == 1
+    assert not (tmp_path / blob_path("", "second")).exists()
+    assert cache.get("second") is None
@@ -0,0 +1,76 @@
+import json
+import os
+
+from iperocks_croqui_ui.collect_json import consolidate, load_manifest
+from iperocks_croqui_ui.route_store import load_store, route_id
+
+
+def write_page(root, source, page_number, routes):
+    folder = root / source
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"page_{page_number}.json").write_text(
+        json.dumps({"page_message": "", "routes": routes}), encoding="utf-8"
+    )
+
+
+def full_store(root, output_dir):
+    store_file = str(output_dir / "full" / "routes_store.json")
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+    consolidate(str(root), store_file, full=True)
+    return load_store(store_file).routes()
+
+
+def test_incremental_consolidation_matches_a_full_build(tmp_path, make_route):
+    root = tmp_path / "output"
+    store_file = str(tmp_path / "routes_store.json")
+    sol = make_route(3, name="Travessia do Sol", page_number=12)
+    write_page(root, "Croqui_v4", 12, [sol, make_route(4, page_number=12)])
+    write_page(root, "Croqui_v4", 13, [make_route(5, page_number=13)])
+    # The same route, read again from the next guidebook
+    write_page(root, "Croqui_v5", 20, [dict(sol, page_number=20)])
+
+    assert consolidate(str(root), store_file) == (
+        [
+            os.path.join("Croqui_v4", "page_12.json"),
+            os.path.join("Croqui_v4", "page_13.json"),
+            os.path.join("Croqui_v5", "page_20.json"),
+        ],
+        [],
+    )
+    routes = load_store(store_file).routes()
+    assert len(routes) == 3
+    assert len(routes[0]["provenance"]) == 2
+
+    # Nothing changed, nothing is read again
+    assert consolidate(str(root), store_file) == ([], [])
+
+    # One copy of the merged route is renamed, another page is deleted
+    write_page(root, "Croqui_v5", 20, [dict(sol, page_number=20, name="Lagartixa")])
+    os.remove(root / "Croqui_v4" / "page_13.json")
+    changed, removed = consolidate(str(root), store_file)
+
+    assert changed == [os.path.join("Croqui_v5", "page_20.json")]
+    assert removed == [os.path.join("Croqui_v4", "page_13.json")]
+    routes = load_store(store_file).routes()
+    assert [route["name"] for route in routes] == [
+        "Travessia do Sol",
+        "Route 4",
+        "Lagartixa",
+    ]
+    assert routes == full_store(root, tmp_path)
+
+
+def test_manifest_keeps_only_route_ids(tmp_path, make_route):
+    root = tmp_path / "output"
+    routes = [make_route(1), make_route(2)]
+    write_page(root, "Croqui_v4", 7, routes)
+    consolidate(str(root), str(tmp_path / "routes_store.json"))
+
+    manifest = load_manifest(str(tmp_path / "consolidated_manifest.json"))
+
+    entry = manifest["files"][os.path.join("Croqui_v4", "page_7.json")]
+    assert sorted(entry) == ["mtime_ns", "route_ids", "sha256", "size"]
+    # Ids of the routes as tagged with their guidebook
+    assert entry["route_ids"] == [
+        route_id(dict(route, source="Croqui_v4")) for route in routes
+    ]
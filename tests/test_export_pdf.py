@@ -0,0 +1,34 @@
+import os
+
+import pdfplumber
+from PIL import Image
+
+from iperocks_croqui_ui.export_pdf import export_to_pdf, stream_pdf
+
+
+def test_streamed_pdf_is_written_page_by_page(tmp_path, make_route):
+    image_folder = tmp_path / "output"
+    (image_folder / "Croqui_v4").mkdir(parents=True)
+    for page_number in (7, 8, 9):
+        Image.new("RGB", (320, 240), "white").save(
+            image_folder / "Croqui_v4" / f"page_{page_number}.png"
+        )
+    routes = [make_route(1), make_route(2, page_number=8), make_route(3, page_number=9)]
+    cache_folder = str(tmp_path / "cache")
+
+    chunks = stream_pdf(routes, str(image_folder), cache_folder=cache_folder)
+    first = next(chunks)
+    # The header and first page come out before the others are written
+    assert first.startswith(b"%PDF-")
+    assert b"%%EOF" not in first
+    streamed = tmp_path / "streamed.pdf"
+    streamed.write_bytes(first + b"".join(chunks))
+
+    exported = export_to_pdf(
+        routes, str(image_folder), str(tmp_path), cache_folder=cache_folder
+    )
+    for path in (streamed, exported):
+        with pdfplumber.open(path) as pdf:
+            assert len(pdf.pages) == 3
+            assert [len(page.images) for page in pdf.pages] == [1, 1, 1]
+    assert streamed.stat().st_size == os.path.getsize(exported)
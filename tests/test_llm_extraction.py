@@ -0,0 +1,163 @@
+import asyncio
+import json
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableLambda
+
+from iperocks_croqui_ui.llm_extraction import (
+    ExtractionStage,
+    PageAssembler,
+    apply_repair,
+)
+from iperocks_croqui_ui.pdf_converter import Route
+
+
+def assembled(routes):
+    """Assembler fed the complete response at once."""
+    assembler = PageAssembler(7, Route)
+    assembler.feed({"page_message": "", "routes": routes})
+    assembler.finish()
+    return assembler
+
+
+def repair_routes(repair_chain, assembler):
+    stage = ExtractionStage(None, max_retries=0, repair_chain=repair_chain)
+    return asyncio.run(stage.repair("page text", assembler))
+
+
+def test_route_is_held_back_until_the_next_one_starts(make_route):
+    accepted = []
+    assembler = PageAssembler(7, Route, lambda page, route: accepted.append(route))
+
+    # The parser streams the first route field by field
+    assembler.feed({"routes": [{"id_number": 1}]})
+    assembler.feed({"routes": [make_route(1, name="Route")]})
+    assert accepted == []
+
+    assembler.feed({"routes": [make_route(1), {"id_number": 2}]})
+    assert [route["name"] for route in accepted] == ["Route 1"]
+
+    assembler.feed({"routes": [make_route(1), make_route(2)]})
+    assert len(accepted) == 1
+    assembler.finish()
+    assert [route["name"] for route in accepted] == ["Route 1", "Route 2"]
+
+
+def test_repaired_route_keeps_its_position(make_route):
+    assembler = assembled(
+        [make_route(1), make_route(2, grade=None), make_route(3)],
+    )
+    assert [fields for _, _, fields in assembler.invalid] == [["grade"]]
+
+    repair_chain = RunnableLambda(lambda inputs: {"grade": "V5"})
+    assert repair_routes(repair_chain, assembler) == 1
+
+    page = assembler.result()
+    assert [route["id_number"] for route in page["routes"]] == [1, 2, 3]
+    assert page["routes"][1]["grade"] == "V5"
+    assert "invalid_routes" not in page
+
+
+def test_repair_response_missing_fields_leaves_the_route_invalid(make_route):
+    assembler = assembled([make_route(1, grade=None, block=None)])
+    position, route, fields = assembler.invalid.pop()
+    assert fields == ["block", "grade"]
+
+    # Only one of the two fields comes back
+    assert not apply_repair(assembler, position, route, fields, {"grade": "V5"})
+
+    page = assembler.result()
+    assert page["routes"] == []
+    (invalid,) = page["invalid_routes"]
+    assert invalid["fields"] == ["block"]
+    assert invalid["route"]["grade"] == "V5"
+
+
+def test_unrepaired_page_keeps_its_invalid_routes(make_route):
+    def fail(inputs):
+        raise OutputParserException("not JSON")
+
+    assembler = assembled([make_route(1), make_route(2, name=None)])
+    assert repair_routes(RunnableLambda(fail), assembler) == 0
+
+    page = assembler.result()
+    assert [route["id_number"] for route in page["routes"]] == [1]
+    assert page["invalid_routes"] == [
+        {"route": make_route(2, name=None), "fields": ["name"]}
+    ]
+    # Without a repair chain the invalid routes are saved as they are
+    page = assembled([make_route(1), make_route(2, name=None)]).result()
+    assert [invalid["fields"] for invalid in page["invalid_routes"]] == [["name"]]
+
+
+def test_stage_repairs_each_route_in_its_own_slot(tmp_path, make_route):
+    response = {
+        "page_message": "",
+        "routes": [make_route(1, grade=None), make_route(2), make_route(3, name=None)],
+    }
+    in_flight = []
+    peak = []
+
+    async def stream(inputs):
+        yield response
+
+    async def repair(inputs):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0)
+        in_flight.pop()
+        fields = inputs["fields"].split(", ")
+        if fields == ["name"]:
+            raise ValueError("server error")
+        return {"grade": "V4"}
+
+    # One slot: the repairs would deadlock if the page kept it
+    stage = ExtractionStage(
+        RunnableLambda(stream),
+        concurrency=1,
+        max_retries=0,
+        route_schema=Route,
+        repair_chain=RunnableLambda(repair),
+    )
+    json_path = tmp_path / "page_7.json"
+    error = asyncio.run(
+        asyncio.wait_for(stage.extract(7, "page text", str(json_path)), timeout=10)
+    )
+
+    assert error is None
+    assert peak == [1, 1]
+    page = json.loads(json_path.read_text(encoding="utf-8"))
+    assert [route["id_number"] for route in page["routes"]] == [1, 2]
+    assert page["routes"][0]["grade"] == "V4"
+    assert [invalid["fields"] for invalid in page["invalid_routes"]] == [["name"]]
+
+
+def test_page_is_extracted_again_when_its_inputs_change(tmp_path, make_route):
+    calls = []
+
+    async def stream(inputs):
+        calls.append(inputs["page_content"])
+        yield {"page_message": "", "routes": [make_route(1)]}
+
+    def extract(text, llm_config="prompt v1"):
+        stage = ExtractionStage(
+            RunnableLambda(stream), llm_config=llm_config, route_schema=Route
+        )
+        asyncio.run(stage.extract(7, text, str(json_path)))
+
+    json_path = tmp_path / "page_7.json"
+    extract("page text")
+    extract("page text")
+    assert calls == ["page text"]
+
+    # Another OCR text, then another prompt
+    extract("page text, read again")
+    extract("page text, read again", llm_config="prompt v2")
+    assert calls == ["page text", "page text, read again", "page text, read again"]
+
+    # A page saved without a key is not trusted either
+    page = json.loads(json_path.read_text(encoding="utf-8"))
+    del page["llm_key"]
+    json_path.write_text(json.dumps(page), encoding="utf-8")
+    extract("page text, read again", llm_config="prompt v2")
+    assert len(calls) == 4
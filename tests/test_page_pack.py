@@ -0,0 +1,20 @@
+from iperocks_croqui_ui.page_pack import INDEX_FILE, PACK_FILE, PagePack
+
+
+def test_empty_pack_has_no_images(tmp_path):
+    (tmp_path / PACK_FILE).write_bytes(b"")
+    (tmp_path / INDEX_FILE).write_text("", encoding="utf-8")
+
+    pack = PagePack(str(tmp_path))
+
+    assert len(pack) == 0
+    assert pack.get("page_1.png") is None
+
+
+def test_first_image_of_an_empty_pack_is_mapped(tmp_path):
+    pack = PagePack(str(tmp_path))
+    pack.append("page_1.png", b"first")
+    pack.append("page_1.png", b"second")
+
+    assert bytes(pack.get("page_1.png")) == b"second"
+    assert PagePack(str(tmp_path)).read("page_1.png") == b"second"
@@ -0,0 +1,44 @@
+import pytest
+
+from iperocks_croqui_ui.route_catalog import RouteCatalog, save_catalog
+from iperocks_croqui_ui.route_store import RouteStore
+
+
+@pytest.fixture
+def catalog(tmp_path, make_route):
+    routes = [
+        make_route(1, name="Travessia do Sol", grade="V4"),
+        make_route(2, name="Lagartixa", description="Reglete na saida, sol da tarde"),
+        make_route(3, name="Sol Poente", block="Pedra do Meio", grade="V1"),
+        # Routes without a grade are not listed
+        make_route(4, name="Travessia sem grau", grade=""),
+    ]
+    catalog_file = str(tmp_path / "routes.sqlite")
+    save_catalog(RouteStore.from_routes(routes), catalog_file)
+    return RouteCatalog(catalog_file)
+
+
+def names(routes):
+    return [route["name"] for route in routes]
+
+
+def test_search_ranks_prefix_and_fuzzy_matches(catalog):
+    # An OCR slip in a long term is matched within one edit
+    assert names(catalog.filter(query="travesia")) == ["Travessia do Sol"]
+    assert names(catalog.filter(query="trav")) == ["Travessia do Sol"]
+    # A match in the name ranks before one in the description
+    assert names(catalog.filter(query="sol"))[2:] == ["Lagartixa"]
+    # Every term must match
+    assert names(catalog.filter(query="sol travessia")) == ["Travessia do Sol"]
+    assert catalog.filter(query="sol", block="Pedra do Meio")[0]["id_number"] == 3
+    assert catalog.count(query="reglete") == 1
+    assert catalog.filter(query="?!") == []
+
+
+def test_expand_widens_only_terms_matching_nothing(catalog):
+    # Prefix of an indexed term, kept as it is
+    assert catalog.expand("trav") == ["trav"]
+    # Too short to be matched fuzzily
+    assert catalog.expand("sul") == ["sul"]
+    assert catalog.expand("travesia") == ["travesia", "travessia"]
+    assert catalog.expand("lagartxa") == ["lagartxa", "lagartixa"]
@@ -0,0 +1,97 @@
+import functools
+
+import pytest
+
+from iperocks_croqui_ui.route_dedup import merge_duplicates
+from iperocks_croqui_ui.route_store import route_id
+
+
+@pytest.fixture
+def travessia(make_route):
+    """Copies of route 3 of page 12, Travessia do Sol."""
+    return functools.partial(make_route, 3, name="Travessia do Sol", page_number=12)
+
+
+def test_near_duplicate_is_merged(travessia):
+    first = travessia()
+    # Read again from another guidebook, with an OCR slip in the name
+    second = travessia(
+        name="Travesia do Sol", sector="SETOR BUFALO", source="Croqui_v5"
+    )
+
+    merged = merge_duplicates([first, second])
+
+    assert len(merged) == 1
+    assert [copy["route_id"] for copy in merged[0]["provenance"]] == [
+        route_id(first),
+        route_id(second),
+    ]
+    assert [copy["source"] for copy in merged[0]["provenance"]] == [
+        "Croqui_v4",
+        "Croqui_v5",
+    ]
+
+
+def test_distinct_routes_are_kept(travessia, make_route):
+    routes = [
+        travessia(),
+        # Same number on another block
+        travessia(block="Pedra do Meio", page_number=13),
+        # Same name and block, another grade
+        travessia(grade="V6", page_number=14),
+        # Another route of the same block
+        make_route(4, name="Lagartixa", description="", page_number=12),
+    ]
+
+    merged = merge_duplicates(routes)
+
+    assert merged == routes
+    assert all("provenance" not in route for route in merged)
+
+
+def test_conflicting_fields_are_filled_from_the_copies(travessia):
+    # Known grade, but a placeholder block and a short description
+    partial = travessia(block="Bloco", description="Aresta", page_number=12)
+    # Known block and a longer description, but an unknown grade
+    complete = travessia(grade="?", page_number=13)
+
+    merged = merge_duplicates([partial, complete])
+
+    assert len(merged) == 1
+    route = merged[0]
+    # The copy with a known block is kept, its id too
+    assert route["route_id"] == route_id(complete)
+    assert route["page_number"] == 13
+    assert route["block"] == "Pedra Grande"
+    assert route["grade"] == "V3"
+    assert route["description"] == complete["description"]
+    assert [copy["page_number"] for copy in route["provenance"]] == [12, 13]
+
+
+def test_placeholder_block_does_not_chain_two_routes(travessia):
+    routes = [
+        travessia(block="Pedra Grande"),
+        travessia(block="Bloco", page_number=13),
+        travessia(block="Pedra do Meio", page_number=14),
+    ]
+
+    merged = merge_duplicates(routes)
+
+    assert len(merged) == 2
+    assert {route["block"] for route in merged} == {"Pedra Grande", "Pedra do Meio"}
+
+
+def test_new_copy_joins_an_already_merged_route(travessia):
+    first = travessia()
+    second = travessia(source="Croqui_v5")
+    (merged,) = merge_duplicates([first, second])
+    third = travessia(name="Travessia do Sol ", source="Croqui_v6")
+
+    result = merge_duplicates([merged, third], start=1)
+
+    assert len(result) == 1
+    assert [copy["source"] for copy in result[0]["provenance"]] == [
+        "Croqui_v4",
+        "Croqui_v5",
+        "Croqui_v6",
+    ]
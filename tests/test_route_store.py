@@ -0,0 +1,32 @@
+from iperocks_croqui_ui.route_store import (
+    RouteStore,
+    load_store,
+    route_id,
+    save_store,
+)
+
+
+def test_store_round_trip(tmp_path, make_route):
+    routes = [
+        make_route(1, grade="V5"),
+        make_route(2, block="Pedra do Meio", source="Croqui_v5"),
+        make_route(3, grade="", provenance=[{"route_id": "abc", "page_number": 7}]),
+    ]
+    store = RouteStore.from_routes(routes + [make_route(1, grade="V5")])
+    store_file = tmp_path / "routes_store.json"
+
+    save_store(store, str(store_file))
+    loaded = load_store(str(store_file))
+
+    # The repeated route is stored once
+    assert len(loaded) == 3
+    assert loaded.routes() == store.routes()
+    # Columns of extra fields are None for the routes without them
+    assert loaded.route(0) == {
+        "route_id": route_id(routes[0]),
+        **routes[0],
+        "provenance": None,
+    }
+    assert loaded.route(2)["provenance"] == [{"route_id": "abc", "page_number": 7}]
+    assert loaded.rows_for("block", "Pedra do Meio") == [1]
+    assert loaded.rows_for("grade", "V9") == []